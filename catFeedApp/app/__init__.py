@@ -11,8 +11,12 @@ from flask_migrate import Migrate
 from hardware import charLCD, DCMotor, distanceSensor, PiCam
 from app.configuration import HardwareConfig as hwConfig
 from app.configuration import BaseConfig as appConfig
+from app.configuration import ScheduleConfig as schedConfig
+from video import frameEncoder, parallelPipeline
+from app import videoStream, clipRecorder, presenceDetector, segmentStream, feedSchedule, taskStats, motorQueue, levelSampler, levelHistory, consumptionModel
 
 import atexit
+import time
 
 # Import some system modules
 import os
@@ -21,8 +25,18 @@ import os
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 db = SQLAlchemy()
 cam = None
+stream = None
+segments = None
+recorder = None
+detector = None
+scheduler = None
+telemetry = taskStats.TaskTelemetry(window=schedConfig.TASK_TELEMETRY["WINDOW"])
 motor = None
+motor_queue = None
 distSensor = None
+sampler = None
+history = None
+model = None
 disp = None
 
 def create_app():
@@ -40,10 +54,23 @@ def create_app():
     
     db.init_app(app)
     migrate = Migrate(app, db)
+    # Create the tables added since the database was initialized; existing tables are left as they are
+    with app.app_context():
+        from app import models
+        db.create_all()
     
     # If this is the first time the app is being run, initialize the hardware
     if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
         initialize_hardware() 
+        start_presence_detector(app)
+        start_feed_scheduler(app)
+        start_level_history(app)
+        start_consumption_model(app)
+        if schedConfig.TASK_TELEMETRY["LOG_SECONDS"] > 0:
+            telemetry.start_log(schedConfig.TASK_TELEMETRY["LOG_SECONDS"])
+        # The periodic display tasks
+        from app import appLocal
+        appLocal.start_local_tasks(app)
     
     from .routes import auth, catfeedapp, api
     app.register_blueprint(auth.bp)
@@ -81,6 +108,60 @@ def get_camera():
     """
     return cam
 
+def get_stream():
+    """
+    Returns the shared live video stream
+
+    Returns:
+        videoStream.FrameBroadcaster: The frame broadcaster, or None if the camera is not enabled
+    """
+    return stream
+
+def get_segment_stream():
+    """
+    Returns the shared H.264 segmented live stream
+
+    Returns:
+        segmentStream.SegmentStreamer: The segment streamer, or None if it is not enabled
+    """
+    return segments
+
+def get_clip_recorder():
+    """
+    Returns the feed clip recorder
+
+    Returns:
+        clipRecorder.ClipRecorder: The clip recorder, or None if recording is not enabled
+    """
+    return recorder
+
+def get_presence_detector():
+    """
+    Returns the cat presence detector
+
+    Returns:
+        presenceDetector.PresenceDetector: The presence detector, or None if it is not enabled
+    """
+    return detector
+
+def get_feed_scheduler():
+    """
+    Returns the scheduled feed trigger
+
+    Returns:
+        feedSchedule.FeedScheduler: The feed scheduler, or None if it is not enabled
+    """
+    return scheduler
+
+def get_task_telemetry():
+    """
+    Returns the telemetry of the periodic tasks and the feed scheduler
+
+    Returns:
+        taskStats.TaskTelemetry: The task telemetry
+    """
+    return telemetry
+
 def get_motor():
     """
     Returns the motor object
@@ -90,6 +171,42 @@ def get_motor():
     """
     return motor
 
+def get_motor_queue():
+    """
+    Returns the motor command queue
+
+    Returns:
+        motorQueue.MotorQueue: The queue every feed is run from, or None if the motor is not enabled
+    """
+    return motor_queue
+
+def get_distance_sampler():
+    """
+    Returns the hopper distance sampler
+
+    Returns:
+        levelSampler.DistanceSampler: The sampler, or None if the distance sensor is not enabled
+    """
+    return sampler
+
+def get_level_history():
+    """
+    Returns the hopper level history
+
+    Returns:
+        levelHistory.LevelHistory: The level history, or None if it is not enabled
+    """
+    return history
+
+def get_consumption_model():
+    """
+    Returns the food consumption model
+
+    Returns:
+        consumptionModel.ConsumptionModel: The model, or None if it is not enabled
+    """
+    return model
+
 def get_distance_sensor():
     """
     Returns the distance sensor object
@@ -121,28 +238,74 @@ def initialize_hardware():
     Raises:
         RuntimeError if the hardware objects are not initialized properly
     """
-    global cam, motor, distSensor, disp
+    global cam, stream, segments, recorder, motor, motor_queue, distSensor, sampler, disp
     if hwConfig.HW_ENABLE["CAMERA"]:
-        cam = PiCam.Camera(resolution=hwConfig.CAMERA["RESOLUTION"])
+        pool = None
+        if hwConfig.PARALLEL["ENABLED"]:
+            # Fork the workers before the camera and stream threads exist
+            pool = parallelPipeline.create_pool(hwConfig.PARALLEL["WORKERS"])
+        cam = PiCam.Camera(resolution=hwConfig.CAMERA["RESOLUTION"], hflip=hwConfig.CAMERA["H_FLIP"], vflip=hwConfig.CAMERA["V_FLIP"], rotation=hwConfig.CAMERA["ROTATION"], format=hwConfig.CAMERA["FORMAT"], lores_resolution=hwConfig.CAMERA["LORES_RESOLUTION"], idle_grace=hwConfig.CAMERA["IDLE_GRACE_SECONDS"])
+        # The camera is configured now but only started while something consumes frames
         if cam.initialize():
-            cam.start()
+            encoder = frameEncoder.create_encoder(hwConfig.ENCODER["BACKEND"], hwConfig.ENCODER["QUALITY"])
+            stream = videoStream.FrameBroadcaster(cam, stream=hwConfig.CAMERA["STREAM"], encoder=encoder, pool=pool,
+                                                  parallel_modes=hwConfig.PARALLEL["MODES"],
+                                                  parallel_depth=hwConfig.PARALLEL["DEPTH"],
+                                                  trace_allocations=hwConfig.CAMERA["TRACE_ALLOCATIONS"],
+                                                  stats_window=hwConfig.CAMERA["STATS_WINDOW"],
+                                                  stats_overlay=hwConfig.CAMERA["STATS_OVERLAY"])
+            if hwConfig.SEGMENTS["ENABLED"]:
+                try:
+                    cache = segmentStream.SegmentCache(max_segments=hwConfig.SEGMENTS["CACHE_SEGMENTS"],
+                                                       max_bytes=hwConfig.SEGMENTS["CACHE_MAX_BYTES"])
+                    segments = segmentStream.create_segment_streamer(hwConfig.SEGMENTS["BACKEND"], cam, cache,
+                                                                     stream=hwConfig.SEGMENTS["STREAM"],
+                                                                     fps=hwConfig.SEGMENTS["FPS"],
+                                                                     segment_seconds=hwConfig.SEGMENTS["SEGMENT_SECONDS"],
+                                                                     bitrate=hwConfig.SEGMENTS["BITRATE"],
+                                                                     idle_seconds=hwConfig.SEGMENTS["IDLE_SECONDS"])
+                except ImportError as e:
+                    print(f"H.264 streaming not available ({e}), only MJPEG will be served")
+            if hwConfig.RECORDING["ENABLED"]:
+                recorder = clipRecorder.ClipRecorder(stream, hwConfig.RECORDING["DIRECTORY"],
+                                                     preroll=hwConfig.RECORDING["PREROLL_SECONDS"],
+                                                     postroll=hwConfig.RECORDING["POSTROLL_SECONDS"],
+                                                     max_buffer_bytes=hwConfig.RECORDING["MAX_BUFFER_BYTES"],
+                                                     max_clip_bytes=hwConfig.RECORDING["MAX_CLIP_BYTES"],
+                                                     arm_lead=hwConfig.RECORDING["ARM_LEAD_SECONDS"])
             print("Camera hardware initialized.")
         else:
             print("Camera hardware initialization failed.")
     else:
         cam = None
+        stream = None
+        segments = None
+        recorder = None
         print("Camera hardware not enabled.")
     if hwConfig.HW_ENABLE["MOTOR"]:
-        motor = DCMotor.DCMotor(en_1_pin=hwConfig.GPIOS["DC_MOTOR_EN1"], en_2_pin=hwConfig.GPIOS["DC_MOTOR_EN2"])
+        motor = DCMotor.DCMotor(en_1_pin=hwConfig.GPIOS["DC_MOTOR_EN1"], en_2_pin=hwConfig.GPIOS["DC_MOTOR_EN2"],
+                                mode=hwConfig.MOTOR["MODE"], ramp=hwConfig.MOTOR["RAMP_SECONDS"],
+                                ramp_frequency=hwConfig.MOTOR["RAMP_FREQUENCY"])
         motor.initialize()
+        motor_queue = motorQueue.MotorQueue(motor, max_depth=hwConfig.MOTOR_QUEUE["MAX_DEPTH"],
+                                            max_portion=hwConfig.MOTOR_QUEUE["MAX_PORTION"],
+                                            seconds_per_size=hwConfig.MOTOR_QUEUE["SECONDS_PER_SIZE"],
+                                            history=hwConfig.MOTOR_QUEUE["HISTORY"],
+                                            stats_window=hwConfig.MOTOR_QUEUE["STATS_WINDOW"])
     else:
         motor = None
+        motor_queue = None
         print("Motor hardware not enabled.")
     if hwConfig.HW_ENABLE["DSENS"]:
         distSensor = distanceSensor.DistanceSensor(trig_pin=hwConfig.GPIOS["DSENS_TRIG"], echo_pin=hwConfig.GPIOS["DSENS_ECHO"])
         distSensor.initialize()
+        sampler = levelSampler.DistanceSampler(distSensor, rate=hwConfig.DSENS["RATE_HZ"],
+                                               window=hwConfig.DSENS["WINDOW"],
+                                               outlier_mm=hwConfig.DSENS["OUTLIER_MM"])
+        sampler.start()
     else:
         distSensor = None
+        sampler = None
         print("Distance sensor hardware not enabled.")
     if hwConfig.HW_ENABLE["DISPLAY"]:
         disp = charLCD.CharLCD(address = hwConfig.LCD["LCD_I2C_ADDR"], height = hwConfig.LCD["ROWS"], width = hwConfig.LCD["COLS"])
@@ -151,6 +314,146 @@ def initialize_hardware():
         disp = None
         print("Display hardware not enabled.")
 
+def start_presence_detector(app):
+    """
+    Starts the cat presence detector if the camera and the detector are enabled.
+    The detector keeps the camera running while it samples.
+
+    Args:
+        app (Flask): The Flask app, used by the detector for database access.
+
+    Returns:
+        None
+    """
+    global detector
+    if cam is None or not hwConfig.PRESENCE["ENABLED"]:
+        detector = None
+        print("Presence detector not enabled.")
+        return
+    detector = presenceDetector.PresenceDetector(app, cam, rate=hwConfig.PRESENCE["RATE_HZ"],
+                                                 cpu_budget=hwConfig.PRESENCE["CPU_BUDGET"],
+                                                 downsample=hwConfig.PRESENCE["DOWNSAMPLE"],
+                                                 roi=hwConfig.PRESENCE["ROI"],
+                                                 threshold=hwConfig.PRESENCE["THRESHOLD"],
+                                                 min_fraction=hwConfig.PRESENCE["MIN_FRACTION"],
+                                                 exit_seconds=hwConfig.PRESENCE["EXIT_SECONDS"])
+    detector.start()
+
+def start_level_history(app):
+    """
+    Starts recording the distance sampler's readings if the sensor and the history are enabled.
+
+    Args:
+        app (Flask): The Flask app, used by the history for database access.
+
+    Returns:
+        None
+    """
+    global history
+    if sampler is None or not hwConfig.LEVEL_HISTORY["ENABLED"]:
+        history = None
+        print("Level history not enabled.")
+        return
+    history = levelHistory.LevelHistory(app, flush_seconds=hwConfig.LEVEL_HISTORY["FLUSH_SECONDS"],
+                                        sample_period=1.0 / hwConfig.DSENS["RATE_HZ"],
+                                        raw_hours=hwConfig.LEVEL_HISTORY["RAW_HOURS"],
+                                        five_minute_days=hwConfig.LEVEL_HISTORY["FIVE_MINUTE_DAYS"],
+                                        hourly_days=hwConfig.LEVEL_HISTORY["HOURLY_DAYS"])
+    sampler.add_listener(history.record)
+
+def start_consumption_model(app):
+    """
+    Starts the food consumption model if the distance sensor and the forecast are enabled,
+    fitting it first to the recorded level history and feedings.
+
+    Args:
+        app (Flask): The Flask app, used to read the history.
+
+    Returns:
+        None
+    """
+    global model
+    if sampler is None or not hwConfig.FORECAST["ENABLED"]:
+        model = None
+        print("Consumption model not enabled.")
+        return
+    model = consumptionModel.ConsumptionModel(grams_per_mm=hwConfig.FORECAST["GRAMS_PER_MM"],
+                                              empty_mm=distSensor.MAX_DISTANCE,
+                                              max_size=hwConfig.MOTOR_QUEUE["MAX_PORTION"],
+                                              seconds_per_size=hwConfig.MOTOR_QUEUE["SECONDS_PER_SIZE"],
+                                              update_seconds=hwConfig.FORECAST["UPDATE_SECONDS"],
+                                              forgetting=hwConfig.FORECAST["FORGETTING"],
+                                              refill_grams=hwConfig.FORECAST["REFILL_GRAMS"])
+    if history is not None:
+        from app.models import Feeding
+        end = time.time()
+        start = end - hwConfig.FORECAST["WARM_START_DAYS"] * 24 * 60 * 60
+        try:
+            # 5-minute rollups, the model's update interval
+            points = history.query(start, end, max_points=hwConfig.FORECAST["WARM_START_DAYS"] * 24 * 12)['points']
+            with app.app_context():
+                feedings = consumptionModel.feeding_times(Feeding.query.all())
+            model.warm_start(points, [f for f in feedings if f[0] >= start])
+        except Exception as e:
+            print("Consumption model warm start error: " + str(e))
+    sampler.add_listener(model.record_level)
+    if motor_queue is not None:
+        motor_queue.add_listener(lambda command: model.record_feed(command.size))
+
+def trigger_feed(size, reason="scheduled"):
+    """
+    Dispenses a feed: queues it for the motor and records a clip. Returns immediately.
+
+    Args:
+        size (int): The size of the feed.
+        reason (str): Why the feed was given, "scheduled" or "manual", also used in the clip file name.
+
+    Returns:
+        motorQueue.MotorCommand: The motor command the feed is part of, or None if the
+        motor is not enabled or its queue is full.
+    """
+    command = None
+    if motor_queue is not None:
+        command = motor_queue.submit(size, reason)
+    if recorder is not None:
+        recorder.trigger(reason)
+    return command
+
+def start_feed_scheduler(app):
+    """
+    Starts the scheduled feed trigger if it is enabled.
+
+    Args:
+        app (Flask): The Flask app, used by the scheduler for database access.
+
+    Returns:
+        None
+    """
+    global scheduler
+    if not schedConfig.FEED_SCHEDULE["ENABLED"]:
+        scheduler = None
+        print("Feed scheduler not enabled.")
+        return
+    scheduler = feedSchedule.FeedScheduler(app, trigger_feed, catch_up=schedConfig.FEED_SCHEDULE["CATCH_UP_SECONDS"],
+                                           clock_check=schedConfig.FEED_SCHEDULE["CLOCK_CHECK_SECONDS"],
+                                           telemetry=telemetry)
+    if recorder is not None:
+        # Start the camera ahead of each scheduled feed so unattended feeds get a pre-roll
+        scheduler.add_listener(lambda: arm_recorder(scheduler.upcoming(1)))
+    scheduler.start()
+
+def arm_recorder(upcoming):
+    """
+    Arms the clip recorder for the next scheduled feed.
+
+    Args:
+        upcoming (list): The upcoming FeedOccurrence objects, soonest first.
+
+    Returns:
+        None
+    """
+    recorder.arm_for(time.mktime(upcoming[0].when.timetuple()) if upcoming else None)
+
 def shutdown_hardware():
     """
     Cleanup method for the hardware objects.  This method is called
@@ -163,7 +466,29 @@ def shutdown_hardware():
         None
     """
     
+    from app import appLocal
+    appLocal.stop_local_tasks()
+    if scheduler is not None:
+        scheduler.stop()
+    if motor_queue is not None:
+        # Switches the motor off if a feed is running
+        motor_queue.stop()
+    if detector is not None:
+        detector.stop()
+    if segments is not None:
+        segments.stop()
+    if stream is not None:
+        # Unlinks the parallel pipelines' shared memory, which would otherwise stay in /dev/shm
+        stream.close()
+        if stream.pool is not None:
+            stream.pool.terminate()
     if cam is not None:
         cam.cleanup()
+    if sampler is not None:
+        # Stop taking readings before the history is written out
+        sampler.stop()
+    if history is not None:
+        # Write the buffered readings and the open rollup buckets
+        history.flush(final=True)
 
 atexit.register(shutdown_hardware)
\ No newline at end of file
@@ -1,8 +1,11 @@
-from app import app, db, feeder
+from app.configuration import ScheduleConfig as schedConfig
+from app import get_display, get_task_telemetry, get_consumption_model
 import time
 import datetime
 import threading
-import weakref
+import heapq
+import itertools
+import concurrent.futures
 
 feedMonitor = None
 screenMonitor = None
@@ -13,152 +16,311 @@ FEED_TIMEOUT_SECONDS = 60
 LCD_UPDATE_RATE_SECONDS = 10
 LCD_ITERATE_PANES_RATE_SECONDS = 20
 FEED_TIME_UPDATE_RATE_SECONDS = 15
+# What a task does when it is due while its previous run is still in progress
+OVERRUN_POLICIES = ('skip', 'coalesce', 'queue')
+# Maximum number of overdue runs kept by the 'queue' policy
+OVERRUN_QUEUE_LIMIT = 10
 stop_threads = False
 
 mainProcess_cv = threading.Condition()
 upcomingFeedsString = ""
 pastFeedsString = ""
 
+# The Flask app, the display and the task manager, set by start_local_tasks()
+app = None
+display = None
+manager = None
+
 class TaskManager:
     """
-    The TaskManager class is responsible for scheduling tasks (functions) to run at regular intervals (using threads) 
+    The TaskManager class is responsible for scheduling tasks (functions) to run at regular intervals
     and starting, stopping and managing their execution.
     
+    A single scheduler thread keeps the tasks in a min-heap keyed by their next run time and
+    sleeps on a condition variable until the earliest one is due, so an idle manager never
+    wakes up and the number of threads does not grow with the number of tasks. Registering or
+    unregistering a task wakes the scheduler early.
+    
+    Task bodies always run outside the lock, on a pool of worker threads, so a slow task never
+    blocks the scheduler, other tasks, get_task_status() or register_task(). At most `workers`
+    task bodies run at once; due tasks wait in the heap, in due time order, for a free worker.
+    A task never runs concurrently with itself. When a run is due while the previous one is
+    still in progress, the task's overrun policy decides what happens:
+        'skip': the overdue run is dropped.
+        'coalesce': any number of overdue runs become one run, started when the current one finishes.
+        'queue': every overdue run is kept, up to OVERRUN_QUEUE_LIMIT, and they run back to back.
+    
     Attributes:
         tasks (dict): A dictionary to store the tasks and their associated information.
-        lock (threading.Lock): A lock to ensure thread safety when accessing the tasks dictionary.
-        tickrate (int): The rate at which the tasks are executed (in seconds).
-        last_tick (float): The time at which the last tick occurred.
+        lock (threading.Lock): A lock to ensure thread safety when accessing the tasks dictionary and the heap.
+        cv (threading.Condition): Condition on the lock, notified when the schedule changes.
+        heap (list): Min-heap of (next_run, sequence, name, generation) entries. Entries of
+            unregistered tasks are skipped when they reach the top.
+        workers (int): The maximum number of task bodies running at once. With 0, task bodies
+            run one at a time on the scheduler thread.
+        active (int): The number of task bodies running.
+        telemetry (taskStats.TaskTelemetry): Receives the drift, duration, overruns and
+            exceptions of every run, or None.
         run_tasks (bool): A flag indicating whether the tasks should be run.
         stop_tasks (bool): A flag indicating whether the tasks should be stopped.
         queue (list): A list to store tasks that need to be scheduled.
 
     Methods:
-        __init__(): Initializes the TaskManager instance.
-        register_task(name, func, interval): Registers a new task with a given name, function, and interval.
-        _schedule_task(name, func, interval): Schedules a task to run immediately if it's the first time, and then starts a new thread to run the task at the specified interval.
-        _start_task(name): Starts a new thread to run the task at the specified interval.
-        _run_task(name): The main function that runs the task at the specified interval, updating the last_run and next_run times as needed.
+        __init__(workers, telemetry): Initializes the TaskManager instance.
+        register_task(name, func, interval, overrun): Registers a new task with a given name, function, interval and overrun policy.
+        unregister_task(name): Removes a task, waiting for a run in progress to finish.
+        start(): Schedules the queued tasks and starts the scheduler thread.
+        stop(): Stops the scheduler thread, queueing the tasks to be scheduled again by start().
+        _schedule_task(name, func, interval, overrun): Adds a task to the heap, due immediately.
+        _run_scheduler(): The scheduler thread, dispatching each task when it is due.
+        _run_task(name, task): Runs a task body once, then starts any overdue runs.
     """
     
-    def __init__(self):
+    def __init__(self, workers=4, telemetry=None):
         """
         Initializes the TaskManager instance.
         
         Args:
-            None
+            workers (int): The maximum number of task bodies running at once. With at least
+                as many workers as tasks, no task can delay another. With 0, task bodies run
+                one at a time on the scheduler thread.
+            telemetry (taskStats.TaskTelemetry): Receives the telemetry of every run, or None.
         
         Returns:
             None
         """
         self.tasks = {}
         self.lock = threading.Lock()
-        self.tickrate = 1
-        self.last_tick = time.time()
+        self.cv = threading.Condition(self.lock)
+        self.heap = []
+        self.sequence = itertools.count()
+        self.workers = workers
+        self.active = 0
+        self.telemetry = telemetry
+        # The task whose body the current thread is running
+        self.local = threading.local()
+        self.pool = None
+        self.thread = None
         self.run_tasks = False
         self.stop_tasks = False
         self.queue = []
     
-    def _schedule_task(self, name, func, interval):
+    def _push(self, name, task):
+        # Must be called with the lock held
+        heapq.heappush(self.heap, (task['next_run'], next(self.sequence), name, task['generation']))
+        self.cv.notify()
+    
+    def _schedule_task(self, name, func, interval, overrun='skip'):
         """
-        Schedules a task to run immediately if it's the first time, and then starts a new thread to run the task at the specified interval.
+        Schedules a task to run immediately, and then at the specified interval. Must be called with the lock held.
         
         Args:
             name (str): The name of the task.
             func (function): The function to be executed by the task.
             interval (float): The interval at which the task should be executed (in seconds).
+            overrun (str): The overrun policy, one of OVERRUN_POLICIES.
         
         Returns:
             None
             
         Raises:
-            ValueError: If the task is already registered.
+            ValueError: If the task is already registered or the overrun policy is unknown.
         """
         if name in self.tasks:
             raise ValueError(f"Task '{name}' already registered")
+        if overrun not in OVERRUN_POLICIES:
+            raise ValueError(f"Unknown overrun policy '{overrun}'")
         print(f"Registered task: {name}")
-        self.tasks[name] = {
+        task = {
             'func': func,
             'interval': interval,
-            'thread': None,
+            'overrun': overrun,
+            'generation': next(self.sequence),
+            'running': False,
+            # When the current run was due, and when each overdue run kept by the overrun policy was due
+            'due': None,
+            'pending': [],
+            'overruns': 0,
             'last_run': None,
-            'next_run': None,
-            'fStopped': False
+            'next_run': time.monotonic()
         }
-        self._start_task(name)
+        self.tasks[name] = task
+        self._push(name, task)
     
-    def _start_task(self, name):
+    def _run_scheduler(self):
         """
-        Starts a new thread to run the task at the specified interval.
+        Scheduler thread: sleeps until the earliest task is due and dispatches it
+        when a worker is free, applying the task's overrun policy if it is still running.
+        
+        Args:
+            None
+        
+        Returns:
+            None
+        """
+        limit = max(1, self.workers)
+        with self.cv:
+            while not self.stop_tasks:
+                if not self.heap:
+                    # Nothing scheduled: sleep until a task is registered
+                    self.cv.wait()
+                    continue
+                next_run, _, name, generation = self.heap[0]
+                task = self.tasks.get(name)
+                if task is None or task['generation'] != generation:
+                    # The task was unregistered or registered again since this entry was pushed
+                    heapq.heappop(self.heap)
+                    continue
+                now = time.monotonic()
+                if next_run > now:
+                    self.cv.wait(next_run - now)
+                    continue
+                if not task['running'] and self.active >= limit:
+                    # Every worker is busy: wait for a run to finish
+                    self.cv.wait()
+                    continue
+                heapq.heappop(self.heap)
+                # Fixed rate: the next run is one interval after this one was due, but never in the past
+                task['next_run'] = max(next_run + task['interval'], now)
+                self._push(name, task)
+                if task['running']:
+                    self._overrun(name, task, next_run)
+                    continue
+                task['due'] = next_run
+                self._dispatch(name, task)
+    
+    def _overrun(self, name, task, due):
+        """
+        Applies a task's overrun policy to a run that is due while the previous one
+        is still in progress. Must be called with the lock held.
         
         Args:
             name (str): The name of the task.
+            task (dict): The task's entry in the tasks dictionary.
+            due (float): The monotonic time the run was due.
         
         Returns:
             None
-            
-        Raises:
-            ValueError: If the task is not registered.
         """
-        with self.lock:
-            if self.tasks[name]['thread'] is None:
-                raise ValueError(f"Attempted to start task '{str(name)}' that is not registered")
-            # Run the task once to initialize the last_run and next_run times
-            task = self.tasks[name]
-            task['func']()
-            task['last_run'] = time.time()
-            task['next_run'] = time.time() + task['interval']
-            task['fStopped'] = False
-            # Start a new thread to run the task at the specified interval
-            thread = threading.Thread(target=self._run_task, args=(name,), daemon=True)
-            thread.start()
-            self.tasks[name]['thread'] = weakref.ref(thread)
-            print(f"Started task: {name}")
-    def _run_task(self, name):
+        task['overruns'] += 1
+        if self.telemetry is not None:
+            self.telemetry.record_overrun(name)
+        if task['overrun'] == 'queue':
+            if len(task['pending']) < OVERRUN_QUEUE_LIMIT:
+                task['pending'].append(due)
+            else:
+                print(f"Task '{name}' has {OVERRUN_QUEUE_LIMIT} runs queued, dropping a run")
+        elif task['overrun'] == 'coalesce':
+            # The coalesced run's drift is measured from the earliest run it stands for
+            if not task['pending']:
+                task['pending'].append(due)
+        else:
+            print(f"Task '{name}' is still running, skipping a run")
+    
+    def _dispatch(self, name, task):
         """
-        Runs a task in an infinite loop, sleeping until the next scheduled run time, and then executing the task function.
+        Starts a task body on a worker, or on the scheduler thread without workers.
+        Must be called with the lock held.
         
         Args:
             name (str): The name of the task.
+            task (dict): The task's entry in the tasks dictionary.
         
         Returns:
             None
         """
-        task = self.tasks[name]
-        while True and not self.stop_tasks and not task['fStopped']:
-            with self.lock:
-                # If the next scheduled run of the task is in the past, it is time to run the task
-                if task['next_run'] < time.time():
-                    # Run the task
-                    task['func']()
-                    # Update the next scheduled run time
-                    task['last_run'] = time.time()
-                    # Update the next scheduled run time
-                    task['next_run'] = time.time() + task['interval']
-            # Update the tasks last tick time
-            self.last_tick = time.time()
-            # Sleep the thread for the tickrate duration
-            time.sleep(self.tickrate)
-    # Returns the status of a task, including its last run time, next run time, and thread status
+        task['running'] = True
+        self.active += 1
+        if self.pool is not None:
+            self.pool.submit(self._run_task, name, task)
+            return
+        self.cv.release()
+        try:
+            self._run_task(name, task)
+        finally:
+            self.cv.acquire()
+    
+    def _run_task(self, name, task):
+        """
+        Runs a task body, outside the lock, followed by any overdue runs kept by its overrun policy.
+        
+        Args:
+            name (str): The name of the task.
+            task (dict): The task's entry in the tasks dictionary.
+        
+        Returns:
+            None
+        """
+        self.local.task = task
+        due = task['due']
+        while True:
+            with self.cv:
+                # Stop if the task was unregistered after being dispatched, dropping any overdue runs
+                if self.tasks.get(name) is not task or self.stop_tasks:
+                    task['pending'] = []
+                    self._task_done(task)
+                    break
+            started = time.monotonic()
+            error = None
+            try:
+                task['func']()
+            except Exception as e:
+                print(f"Task '{name}' failed: {e}")
+                error = e
+            finished = time.monotonic()
+            if self.telemetry is not None:
+                self.telemetry.record_run(name, started - due, finished - started, error)
+            with self.cv:
+                task['last_run'] = finished
+                # Finishing in the same critical section that sees no pending runs, so an
+                # overrun arriving now is either run here or dispatched anew, never lost
+                if not task['pending']:
+                    self._task_done(task)
+                    break
+                due = task['pending'].pop(0)
+        self.local.task = None
+    
+    def _task_done(self, task):
+        """
+        Marks a task as no longer running and frees its worker. Must be called with the lock held.
+        
+        Args:
+            task (dict): The task's entry in the tasks dictionary.
+        
+        Returns:
+            None
+        """
+        task['running'] = False
+        self.active -= 1
+        self.cv.notify_all()
+    
+    # Returns the status of a task, including its last run time, next run time, and whether it is running
     def get_task_status(self, name):
         with self.lock:
             task = self.tasks.get(name)
             if task is None:
                 return None
+            # Report the monotonic schedule as wall clock times
+            offset = time.time() - time.monotonic()
             return {
-                'last_run': task['last_run'],
-                'next_run': task['next_run'],
-                'thread': task['thread']() if task['thread'] else None
+                'last_run': task['last_run'] + offset if task['last_run'] is not None else None,
+                'next_run': task['next_run'] + offset,
+                'running': task['running'],
+                'overrun': task['overrun'],
+                'overruns': task['overruns'],
+                'pending': len(task['pending'])
             }
 
-    def register_task(self, name, func, interval):
+    def register_task(self, name, func, interval, overrun='skip'):
         """
-        Registers a new task with a given name, function, and interval.
+        Registers a new task with a given name, function, interval and overrun policy.
         
         Args:
             name (str): The name of the task.
             func (function): The function to be executed by the task.
             interval (float): The interval at which the task should be executed (in seconds).
+            overrun (str): What to do when a run is due while the previous one is still
+                running: 'skip', 'coalesce' or 'queue'.
         
         Returns:
             None
@@ -166,17 +328,17 @@ class TaskManager:
         with self.lock:
             if self.run_tasks:
                 try:
-                    self._schedule_task(name, func, interval)
+                    self._schedule_task(name, func, interval, overrun)
                     print(f"Registered task: {name} to run every {interval} seconds")
-                except ValueError:
-                    print(f"Task '{name}' already registered")
+                except ValueError as e:
+                    print(e)
             else:
-                self.queue.append((name, func, interval))
+                self.queue.append((name, func, interval, overrun))
                 print(f"Queued task: {name}")
     
     def unregister_task(self, name):
         """
-        Unregisters a task, stopping its thread and removing it from the task dictionary.
+        Unregisters a task, removing it from the schedule and waiting for a run in progress to finish.
         
         Args:
             name (str): The name of the task to be unregistered.
@@ -184,20 +346,20 @@ class TaskManager:
         Returns:
             None
         """
-        with self.lock:
+        with self.cv:
             task = self.tasks.pop(name, None)
             if task is None:
                 return
             print("Unregistered task: " + name)
-            task['fStopped'] = True
-            thread = task['thread']()
-            if thread is not None:
-                print("Stopping task thread: " + name, "thread id: " + str(thread.ident))
-                thread.join()
+            # Wake the scheduler so it drops the task's heap entry
+            self.cv.notify_all()
+            # A task unregistering itself cannot wait for its own run
+            if getattr(self.local, 'task', None) is not task:
+                self.cv.wait_for(lambda: not task['running'])
     
     def start(self):
         """
-        Starts the task manager, scheduling all queued tasks and enabling task scheduling.
+        Starts the task manager, scheduling all queued tasks and starting the scheduler thread.
         
         Args:
             None
@@ -205,14 +367,26 @@ class TaskManager:
         Returns:    
             None
         """
-        self.run_tasks = True
-        while self.queue:
-            name, func, interval = self.queue.pop(0)
-            self._schedule_task(name, func, interval)
+        with self.cv:
+            if self.run_tasks:
+                return
+            self.run_tasks = True
+            self.stop_tasks = False
+            while self.queue:
+                name, func, interval, overrun = self.queue.pop(0)
+                try:
+                    self._schedule_task(name, func, interval, overrun)
+                except ValueError as e:
+                    print(e)
+            if self.workers > 0:
+                self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="task")
+            self.thread = threading.Thread(target=self._run_scheduler, daemon=True)
+            self.thread.start()
     
     def stop(self):
         """
-        Stops the task manager, stopping all task threads and disabling task scheduling.
+        Stops the task manager, stopping the scheduler thread and disabling task scheduling.
+        Runs in progress are waited for, and the tasks are queued so start() schedules them again.
         
         Args:
             None
@@ -220,48 +394,35 @@ class TaskManager:
         Returns:
             None
         """
-        self.queue.clear()
-        self.run_tasks = False
-        self.stop_tasks = True
-        for name, task in self.tasks.items():
-            print(f"Stopping task: {name}")
-            thread = task['thread']()
-            if thread is not None:
-                thread.join()
-            self.queue.append((name, task['func'], task['interval']))
+        with self.cv:
+            self.queue.clear()
+            self.run_tasks = False
+            self.stop_tasks = True
+            self.cv.notify_all()
+            thread, pool = self.thread, self.pool
+            self.thread = None
+            self.pool = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        if pool is not None:
+            pool.shutdown(wait=True)
+        with self.cv:
+            for name, task in self.tasks.items():
+                print(f"Stopping task: {name}")
+                self.queue.append((name, task['func'], task['interval'], task['overrun']))
+            self.tasks.clear()
+            self.heap.clear()
 
-def triggerFeed(fsize):
-    print("Triggering feed")
-    if feeder.display is not None: 
-        threading.Thread(target=feeder.display.feedTimeDisplayRoutine, args=(fsize*3,)).start()
-    if feeder.motor is not None:
-        threading.Thread(target=feeder.motor.forward, args=(fsize*3,)).start()
-
-def checkFeedTime():
-    print("Checking feed times")
-    from app.models import FeedTime
+def updateFeedTimes():
+    print("Updating feed times")
+    from app import get_feed_scheduler
     from app.models import Feeding
+    # Scheduled feeds are fired by the feed scheduler; this only refreshes the display strings
+    scheduler = get_feed_scheduler()
+    if scheduler is not None:
+        updateUpcomingFeeds(scheduler.upcoming())
     with app.app_context():
-        # Check the feed time database
-        feed_times = FeedTime.query.order_by(FeedTime.time).all()
-        # Get the current time
-        timeNow = datetime.datetime.now().strftime("%H:%M")
-        updateUpcomingFeeds(feed_times, timeNow)
-        # Check if the current time matches any of the feed times
-        for feed_time in feed_times:
-            if feed_time.time == timeNow:
-                size = feed_time.size
-                type = feed_time.type
-                # Trigger the feed
-                triggerFeed(size)
-                # Add the feed record to the database
-                new_feeding = Feeding(time = time.strftime("%H:%M"), type = type, date = time.strftime("%Y-%m-%d"), size = size)
-                db.session.add(new_feeding)
-                if type == 1:
-                    # Remove the feed time from the database if it is a 1 time feed
-                    FeedTime.query.filter_by(time = feed_time.time).delete()
-                db.session.commit()
-        past_feeds = Feeding.query.order_by(Feeding.time.desc()).all()
+        past_feeds = Feeding.query.order_by(Feeding.date.desc(), Feeding.time.desc()).all()
         if len(past_feeds) > 0:
             # update the feed times global variable
             updatePastFeeds(past_feeds)
@@ -289,17 +450,22 @@ def updatePastFeeds(feed_times, maxNumDisplay=3):
     global pastFeedsString
     pastFeedsString = timesString
 
-def updateUpcomingFeeds(feed_times, timeNow, maxNumDisplay=3):
-    # Get the feeding times that precede the current time
-    feed_times_past = [ft for ft in feed_times if ft.time < timeNow]
-    # Get the feeding times that follow the current time
-    feed_times_future = [ft for ft in feed_times if ft.time > timeNow]
-    # Show up to 3 feeding times, displaying the feed times after the current time first, then the feed times before the current time
-    feed_times_display = feed_times_future[:len(feed_times_future)] + feed_times_past[:len(feed_times_past)]
+def updateUpcomingFeeds(occurrences, maxNumDisplay=3):
+    """
+    Updates the global variable upcomingFeedsString with the next maxNumDisplay feed times
+    in 12 hour format with AM/PM.
+
+    Args:
+        occurrences (list): The upcoming FeedOccurrence objects from the feed scheduler, soonest first
+        maxNumDisplay (int): The maximum number of feed times to display
+
+    Returns:
+        None
+    """
     timesString = []
-    for i in range(min(maxNumDisplay, len(feed_times_display))):
+    for occurrence in occurrences[:maxNumDisplay]:
         # Display the time converted from 24 hour format to 12 hour format with AM/PM, but remove leading zero for times before 10
-        timesString.append(time.strftime("%l:%M %p", time.strptime(feed_times_display[i].time, "%H:%M")))
+        timesString.append(occurrence.when.strftime("%l:%M %p"))
     # update the upcoming feed times global variable
     global upcomingFeedsString
     upcomingFeedsString = timesString
@@ -307,36 +473,90 @@ def updateUpcomingFeeds(feed_times, timeNow, maxNumDisplay=3):
 def updateUpcomingFeedsPane():
     print("Updating LCD feed times pane")
     global upcomingFeedsString
-    paneTextArray = [[' ' for i in range(feeder.display.LCD_WIDTH)] for j in range(feeder.display.LCD_HEIGHT)]
+    paneTextArray = [[' ' for i in range(display.LCD_WIDTH)] for j in range(display.LCD_HEIGHT)]
     paneTextArray[0] = "Upcoming Feeds:"
     if len(upcomingFeedsString) > 0:
-        for i in range(min(feeder.display.LCD_HEIGHT - 1, len(upcomingFeedsString))):   
+        for i in range(min(display.LCD_HEIGHT - 1, len(upcomingFeedsString))):   
             paneTextArray[i + 1] = upcomingFeedsString[i]
     else:
         paneTextArray[1] = "No upcoming feeds"
-    feeder.display.updatePane('upcomingFeeds', paneTextArray)
+    display.updatePane('upcomingFeeds', paneTextArray)
             
 def updatePastFeedsPane():
     print("Updating LCD past feeds pane")
     global pastFeedsString
-    paneTextArray = [[' ' for i in range(feeder.display.LCD_WIDTH)] for j in range(feeder.display.LCD_HEIGHT)]
+    paneTextArray = [[' ' for i in range(display.LCD_WIDTH)] for j in range(display.LCD_HEIGHT)]
     paneTextArray[0] = "Past Feeds:"
     if len(pastFeedsString) > 0:
-        for i in range(min(feeder.display.LCD_HEIGHT - 1, len(pastFeedsString))):   
+        for i in range(min(display.LCD_HEIGHT - 1, len(pastFeedsString))):   
             paneTextArray[i + 1] = pastFeedsString[i]
     else:
         paneTextArray[1] = "No past feeds"
-    feeder.display.updatePane('pastFeeds', paneTextArray)
+    display.updatePane('pastFeeds', paneTextArray)
         
+def updateForecastPane():
+    print("Updating LCD forecast pane")
+    from app.models import FeedTime
+    from app.consumptionModel import daily_feed_counts
+    paneTextArray = [[' ' for i in range(display.LCD_WIDTH)] for j in range(display.LCD_HEIGHT)]
+    paneTextArray[0] = "Food Forecast:"
+    model = get_consumption_model()
+    if model is None:
+        paneTextArray[1] = "Not available"
+    else:
+        with app.app_context():
+            forecast = model.forecast(daily_feed_counts(FeedTime.query.all(), model.max_size))
+        if forecast['hours_to_empty'] is None:
+            paneTextArray[1] = "Learning..."
+        else:
+            paneTextArray[1] = f"Left: {forecast['remaining_grams']:.0f} g"
+            paneTextArray[2] = f"Use: {forecast['grams_per_day']:.0f} g/day"
+            # Show the empty date once it is more than a day away
+            if forecast['hours_to_empty'] < 24:
+                paneTextArray[3] = f"Empty in {forecast['hours_to_empty']:.0f} h"
+            else:
+                paneTextArray[3] = "Empty " + time.strftime("%a %b %d", time.localtime(forecast['empty_at']))
+    display.updatePane('forecast', paneTextArray)
+
 def iterateLcdPane():
     print("Iterating LCD pane")
-    feeder.display.iteratePanes()
+    display.iteratePanes()
     
-manager = TaskManager()
-manager.register_task('checkFeedTime', checkFeedTime, FEED_TIME_UPDATE_RATE_SECONDS)
-if feeder.hardwareEnabled['display']:
-    feeder.display.registerPane('upcomingFeeds', [[' ' for i in range(feeder.display.LCD_WIDTH)] for j in range(feeder.display.LCD_HEIGHT)])
-    manager.register_task('updateUpcomingFeedsPane', updateUpcomingFeedsPane, LCD_UPDATE_RATE_SECONDS)
-    feeder.display.registerPane('pastFeeds', [[' ' for i in range(feeder.display.LCD_WIDTH)] for j in range(feeder.display.LCD_HEIGHT)])
-    manager.register_task('updatePastFeedsPane', updatePastFeedsPane, LCD_UPDATE_RATE_SECONDS)
-    manager.register_task('iterateLcdPane', iterateLcdPane, LCD_ITERATE_PANES_RATE_SECONDS)
+def start_local_tasks(flask_app):
+    """
+    Registers the periodic display tasks and starts the task manager.
+
+    Args:
+        flask_app (Flask): The Flask app, used by the tasks for database access.
+
+    Returns:
+        None
+    """
+    global app, display, manager
+    app = flask_app
+    display = get_display()
+    manager = TaskManager(workers=schedConfig.TASK_MANAGER["WORKERS"], telemetry=get_task_telemetry())
+    # A display update delayed by a slow database is run again as soon as it finishes
+    manager.register_task('updateFeedTimes', updateFeedTimes, FEED_TIME_UPDATE_RATE_SECONDS, overrun='coalesce')
+    if display is not None:
+        display.registerPane('upcomingFeeds', [[' ' for i in range(display.LCD_WIDTH)] for j in range(display.LCD_HEIGHT)])
+        manager.register_task('updateUpcomingFeedsPane', updateUpcomingFeedsPane, LCD_UPDATE_RATE_SECONDS)
+        display.registerPane('pastFeeds', [[' ' for i in range(display.LCD_WIDTH)] for j in range(display.LCD_HEIGHT)])
+        manager.register_task('updatePastFeedsPane', updatePastFeedsPane, LCD_UPDATE_RATE_SECONDS)
+        display.registerPane('forecast', [[' ' for i in range(display.LCD_WIDTH)] for j in range(display.LCD_HEIGHT)])
+        manager.register_task('updateForecastPane', updateForecastPane, LCD_UPDATE_RATE_SECONDS)
+        manager.register_task('iterateLcdPane', iterateLcdPane, LCD_ITERATE_PANES_RATE_SECONDS)
+    manager.start()
+
+def stop_local_tasks():
+    """
+    Stops the task manager, waiting for the runs in progress.
+
+    Args:
+        None
+
+    Returns:
+        None
+    """
+    if manager is not None:
+        manager.stop()
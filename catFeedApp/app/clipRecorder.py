@@ -0,0 +1,317 @@
+"""
+Recording of short video clips around feed events.
+
+The recorder listens to the frames published by the live stream broadcaster
+and keeps the last few seconds of encoded JPEGs in a bounded in-memory ring
+buffer. When a feed is triggered, the buffered pre-roll plus a configurable
+post-roll are handed to a background writer thread, which stores them as an
+MJPEG AVI file without re-encoding, so recording never stalls the live stream.
+
+The broadcaster only produces frames while somebody consumes them, so with
+nobody watching there is no pre-roll. For events known in advance, such as
+scheduled feeds, the recorder arms itself shortly before the event: it keeps
+the stream running from arm_lead seconds before until the event has been
+recorded, so the pre-roll is filled even when the feed is unattended.
+"""
+from collections import deque
+import os
+import queue
+import struct
+import threading
+import time
+
+from app.videoStream import FRAME_HEADER, FRAME_TRAILER
+
+# Maximum number of finished clips waiting to be written to disk
+WRITE_QUEUE_SIZE = 2
+# How long an armed recorder keeps the stream running after the expected event time
+ARM_GRACE_SECONDS = 30
+
+def jpeg_size(jpeg):
+    """
+    Reads the image dimensions from the start-of-frame marker of a JPEG.
+
+    Args:
+        jpeg: A buffer-protocol object containing the JPEG data.
+
+    Returns:
+        tuple: The (width, height) of the image, or (0, 0) if no marker is found.
+    """
+    data = memoryview(jpeg)
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        length = (data[i + 2] << 8) | data[i + 3]
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        i += 2 + length
+    return 0, 0
+
+def write_mjpeg_avi(path, frames, fps):
+    """
+    Writes JPEG frames to an MJPEG AVI file without re-encoding them.
+
+    Args:
+        path (str): The file to write.
+        frames (list): The JPEG frames as buffer-protocol objects.
+        fps (float): The frame rate stored in the file.
+
+    Returns:
+        None
+    """
+    width, height = jpeg_size(frames[0])
+    fps = max(1, int(round(fps)))
+    sizes = [memoryview(frame).nbytes for frame in frames]
+    # Each frame is an '00dc' chunk padded to an even length
+    chunk_sizes = [8 + size + (size & 1) for size in sizes]
+    movi_size = 4 + sum(chunk_sizes)
+    idx1_size = 16 * len(frames)
+    max_size = max(sizes)
+
+    avih = struct.pack('<IIIIIIIIII4I', 1000000 // fps, max_size * fps, 0, 0x10, len(frames), 0, 1,
+                       max_size, width, height, 0, 0, 0, 0)
+    strh = struct.pack('<4s4sIHHIIIIIIIIhhhh', b'vids', b'MJPG', 0, 0, 0, 0, 1, fps, 0, len(frames),
+                       max_size, 0xFFFFFFFF, 0, 0, 0, width, height)
+    strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG', width * height * 3, 0, 0, 0, 0)
+    strl = b'strl' + b'strh' + struct.pack('<I', len(strh)) + strh + b'strf' + struct.pack('<I', len(strf)) + strf
+    hdrl = b'hdrl' + b'avih' + struct.pack('<I', len(avih)) + avih + b'LIST' + struct.pack('<I', len(strl)) + strl
+    riff_size = 4 + (8 + len(hdrl)) + (8 + movi_size) + (8 + idx1_size)
+
+    with open(path, 'wb') as f:
+        f.write(b'RIFF' + struct.pack('<I', riff_size) + b'AVI ')
+        f.write(b'LIST' + struct.pack('<I', len(hdrl)) + hdrl)
+        f.write(b'LIST' + struct.pack('<I', movi_size) + b'movi')
+        for frame, size in zip(frames, sizes):
+            f.write(b'00dc' + struct.pack('<I', size))
+            f.write(frame)
+            if size & 1:
+                f.write(b'\0')
+        f.write(b'idx1' + struct.pack('<I', idx1_size))
+        # Offsets are relative to the 'movi' list type
+        offset = 4
+        for size, chunk_size in zip(sizes, chunk_sizes):
+            f.write(struct.pack('<4sIII', b'00dc', 0x10, offset, size))
+            offset += chunk_size
+
+class ClipRecorder:
+    """
+    Keeps a pre-roll ring buffer of live stream frames and records clips around events.
+
+    Frames are stored as the multipart chunks published by the broadcaster, so
+    buffering a frame only keeps a reference and never copies it. The ring
+    buffer, each clip and the writer queue all have hard limits, so memory use
+    is bounded no matter how often feeds are triggered.
+
+    Attributes:
+        stream (videoStream.FrameBroadcaster): The live stream to record.
+        directory (str): The directory clips are written to.
+        preroll (float): Seconds of video kept before an event.
+        postroll (float): Seconds of video recorded after an event.
+        max_buffer_bytes (int): Hard limit on the size of the ring buffer.
+        max_clip_bytes (int): Hard limit on the size of a single clip.
+        arm_lead (float): Seconds before an expected event the stream is started, covering
+            the camera start up and the pre-roll.
+    """
+    def __init__(self, stream, directory, preroll=5, postroll=20, max_buffer_bytes=8 * 1024 * 1024,
+                 max_clip_bytes=32 * 1024 * 1024, arm_lead=10):
+        """
+        Initializes the recorder and registers it with the live stream.
+
+        Args:
+            stream (videoStream.FrameBroadcaster): The live stream to record.
+            directory (str): The directory clips are written to.
+            preroll (float): Seconds of video kept before an event.
+            postroll (float): Seconds of video recorded after an event.
+            max_buffer_bytes (int): Hard limit on the size of the ring buffer.
+            max_clip_bytes (int): Hard limit on the size of a single clip.
+            arm_lead (float): Seconds before an expected event the stream is started.
+
+        Returns:
+            None
+        """
+        self.stream = stream
+        self.directory = directory
+        self.preroll = preroll
+        self.postroll = postroll
+        self.max_buffer_bytes = max_buffer_bytes
+        self.max_clip_bytes = max_clip_bytes
+        self.arm_lead = arm_lead
+        self.arm_timer = None
+        self.disarm_timer = None
+        self.lock = threading.Lock()
+        self.ring = deque()
+        self.ring_bytes = 0
+        self.clip = None
+        self.clip_bytes = 0
+        self.clip_name = None
+        self.timer = None
+        self.write_queue = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.writer = threading.Thread(target=self._write_clips, daemon=True)
+        self.writer.start()
+        stream.add_listener(self._on_frame)
+
+    def _on_frame(self, sequence, frame):
+        """
+        Broadcaster listener: adds a frame to the ring buffer and the clip being recorded.
+
+        Args:
+            sequence (int): The sequence number of the frame.
+            frame (bytes): The multipart chunk of the frame.
+
+        Returns:
+            None
+        """
+        now = time.monotonic()
+        size = len(frame)
+        with self.lock:
+            self.ring.append((now, frame))
+            self.ring_bytes += size
+            # Drop frames older than the pre-roll, and enforce the memory cap
+            while self.ring and (self.ring[0][0] < now - self.preroll or self.ring_bytes > self.max_buffer_bytes):
+                self.ring_bytes -= len(self.ring.popleft()[1])
+            if self.clip is not None and self.clip_bytes + size <= self.max_clip_bytes:
+                self.clip.append((now, frame))
+                self.clip_bytes += size
+
+    def trigger(self, reason="feed"):
+        """
+        Starts recording a clip from the buffered pre-roll, or extends the clip
+        being recorded if one is already in progress. Returns immediately.
+
+        Args:
+            reason (str): Used in the clip file name.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.clip is None:
+                self.clip = list(self.ring)
+                self.clip_bytes = self.ring_bytes
+                self.clip_name = time.strftime("%Y%m%d_%H%M%S") + "_" + reason
+                # Keep frames flowing for the post-roll even if nobody is watching
+                self.stream.subscribe()
+            else:
+                self.timer.cancel()
+            self.timer = threading.Timer(self.postroll, self._finish)
+            self.timer.daemon = True
+            self.timer.start()
+        print("Recording clip: " + self.clip_name)
+
+    def arm_for(self, when):
+        """
+        Arranges for the stream to run from arm_lead seconds before an expected event,
+        so its clip has a pre-roll even if nobody is watching. Replaces the previously
+        expected event.
+
+        Args:
+            when (float): Unix time of the event, or None to cancel.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.arm_timer is not None:
+                self.arm_timer.cancel()
+                self.arm_timer = None
+            if when is None:
+                return
+            delay = max(0.0, when - self.arm_lead - time.time())
+            self.arm_timer = threading.Timer(delay, self._arm, args=(when,))
+            self.arm_timer.daemon = True
+            self.arm_timer.start()
+
+    def _arm(self, when):
+        """
+        Timer callback: starts the stream ahead of an expected event.
+
+        Args:
+            when (float): Unix time of the event.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.arm_timer is not threading.current_thread():
+                return
+            self.arm_timer = None
+            if self.disarm_timer is None:
+                self.stream.subscribe()
+            else:
+                self.disarm_timer.cancel()
+            self.disarm_timer = threading.Timer(max(0.0, when - time.time()) + ARM_GRACE_SECONDS, self._disarm)
+            self.disarm_timer.daemon = True
+            self.disarm_timer.start()
+        print("Clip recorder armed")
+
+    def _disarm(self):
+        """
+        Timer callback: releases the stream once the expected event has passed.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.disarm_timer is not threading.current_thread():
+                return
+            self.disarm_timer = None
+        self.stream.unsubscribe()
+
+    def _finish(self):
+        """
+        Timer callback: ends the clip being recorded and queues it for writing.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if self.timer is not threading.current_thread():
+                return
+            clip, name = self.clip, self.clip_name
+            self.clip = None
+            self.clip_bytes = 0
+            self.timer = None
+        self.stream.unsubscribe()
+        if not clip:
+            print("No frames recorded for clip: " + name)
+            return
+        try:
+            self.write_queue.put_nowait((name, clip))
+        except queue.Full:
+            print("Clip writer is behind, dropping clip: " + name)
+
+    def _write_clips(self):
+        """
+        Writer thread: writes queued clips to disk.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        while True:
+            name, clip = self.write_queue.get()
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, name + ".avi")
+                duration = clip[-1][0] - clip[0][0]
+                fps = (len(clip) - 1) / duration if duration > 0 else 1
+                # Strip the multipart framing without copying the JPEG data
+                frames = [memoryview(frame)[len(FRAME_HEADER):len(frame) - len(FRAME_TRAILER)] for _, frame in clip]
+                write_mjpeg_avi(path, frames, fps)
+                print(f"Wrote clip {path} ({len(frames)} frames)")
+            except Exception as e:
+                print("Error writing clip " + name + ": " + str(e))
@@ -34,7 +34,99 @@ class HardwareConfig:
         "MAX_RESOLUTION" : (1920, 1080),
         "V_FLIP" : True,
         "H_FLIP" : False,
-        "ROTATION" : 0
+        "ROTATION" : 0,
+        "FORMAT" : "YUV420",            # YUV420 lets grayscale modes use the Y plane directly
+        "LORES_RESOLUTION" : (540, 540), # Low resolution preview stream for live viewing
+        "STREAM" : "lores",             # Stream used for the live view ("lores" or "main")
+        "IDLE_GRACE_SECONDS" : 30,      # Time the camera keeps running after the last viewer leaves
+        "TRACE_ALLOCATIONS" : False,    # Report memory allocated per frame (slows the stream down)
+        "STATS_WINDOW" : 300,           # Recent frames covered by the latency and fps statistics
+        "STATS_OVERLAY" : False         # Burn the fps and latency into the live view
+    }
+    # Define live stream JPEG encoder parameters
+    ENCODER = {
+        "BACKEND" : "simplejpeg",       # "cv2", "simplejpeg" or "mjpeg" (picamera2 hardware encoder)
+        "QUALITY" : 80
+    }
+    # Define multi-core frame processing parameters
+    PARALLEL = {
+        "ENABLED" : True,
+        "WORKERS" : 3,                  # Worker processes, leaving a core for capture and encode
+        "DEPTH" : 3,                    # Frames in flight
+        "MODES" : ["enhanced"]          # Pipelines run on the worker pool
+    }
+    # Define H.264 segmented (HLS) live stream parameters. /api/videoFeed stays
+    # available as the MJPEG fallback
+    SEGMENTS = {
+        "ENABLED" : True,
+        "BACKEND" : "h264",             # "h264" (picamera2 hardware encoder) or "libx264" (PyAV software encoder)
+        "STREAM" : "main",              # Camera stream to encode ("main" or "lores")
+        "FPS" : 15,
+        "BITRATE" : 2000000,            # Bits per second
+        "SEGMENT_SECONDS" : 2,          # Keyframe interval and segment length
+        "CACHE_SEGMENTS" : 6,           # Segments kept in memory for viewers
+        "CACHE_MAX_BYTES" : 16 * 1024 * 1024,    # Hard cap on the segment cache
+        "IDLE_SECONDS" : 30             # Time the encoder keeps running after the last viewer request
+    }
+    # Define feed clip recording parameters. The camera is started ahead of scheduled feeds
+    # for the pre-roll; manual feeds only get one while the live stream is being watched
+    RECORDING = {
+        "ENABLED" : True,
+        "DIRECTORY" : os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'recordings'),
+        "PREROLL_SECONDS" : 5,
+        "POSTROLL_SECONDS" : 20,
+        "MAX_BUFFER_BYTES" : 8 * 1024 * 1024,    # Hard cap on the pre-roll ring buffer
+        "MAX_CLIP_BYTES" : 32 * 1024 * 1024,     # Hard cap on a single clip held in memory
+        "ARM_LEAD_SECONDS" : 10         # Camera started this long before a scheduled feed, for its pre-roll
+    }
+    # Define cat presence detection parameters. While enabled, the detector keeps the camera
+    # running around the clock, so the camera never idles when nobody is watching
+    PRESENCE = {
+        "ENABLED" : False,
+        "RATE_HZ" : 2,                   # Samples per second
+        "CPU_BUDGET" : 0.05,            # Maximum fraction of one CPU core
+        "DOWNSAMPLE" : 4,               # Analyse every 4th row and column of the lores stream
+        "ROI" : None,                   # Bowl region (x, y, width, height) as fractions, None for the whole frame
+        "THRESHOLD" : 25,               # Minimum pixel difference from the background
+        "MIN_FRACTION" : 0.02,          # Fraction of changed pixels that means the cat is present
+        "EXIT_SECONDS" : 10             # Time without motion before the cat is considered gone
+    }
+    # Define motor control parameters
+    MOTOR = {
+        "MODE" : "waveform",            # "waveform" (pigpio DMA waveform) or "timed" (pin writes and a timer)
+        "RAMP_SECONDS" : 0.5,           # Soft-start PWM ramp in waveform mode, 0 for none
+        "RAMP_FREQUENCY" : 500          # PWM frequency of the ramp in Hz
+    }
+    # Define feed motor queue parameters. All feeds run one at a time from this queue
+    MOTOR_QUEUE = {
+        "MAX_DEPTH" : 8,                # Queued feeds beyond this are rejected
+        "MAX_PORTION" : 5,              # Largest size a burst of manual feeds is merged into
+        "SECONDS_PER_SIZE" : 3,         # Motor run time per unit of feed size
+        "HISTORY" : 50,                 # Finished feeds kept for polling
+        "STATS_WINDOW" : 100            # Recent feeds covered by the latency statistics
+    }
+    # Define hopper distance sampling parameters. Requests read the sampler's latest filtered level
+    DSENS = {
+        "RATE_HZ" : 0.5,                # Pings per second
+        "WINDOW" : 9,                   # Recent readings covered by the median filter
+        "OUTLIER_MM" : 20               # Readings further than this from the median are rejected
+    }
+    # Define hopper level history parameters. Readings are written in batches
+    LEVEL_HISTORY = {
+        "ENABLED" : True,
+        "FLUSH_SECONDS" : 300,          # Maximum time readings stay buffered in memory
+        "RAW_HOURS" : 24,               # Raw readings kept
+        "FIVE_MINUTE_DAYS" : 30,        # 5-minute min/avg/max rollups kept
+        "HOURLY_DAYS" : 365             # Hourly min/avg/max rollups kept
+    }
+    # Define food consumption model parameters
+    FORECAST = {
+        "ENABLED" : True,
+        "GRAMS_PER_MM" : 4.0,           # Grams of food per mm of hopper level (hopper area times food density)
+        "UPDATE_SECONDS" : 300,         # Length of the intervals the model is fitted on
+        "FORGETTING" : 0.999,           # Weight of older intervals, 1 to never forget
+        "REFILL_GRAMS" : 50,            # A level rise of more than this is a refill
+        "WARM_START_DAYS" : 7            # History replayed into the model at startup
     }
     # Define hardware enablement
     HW_ENABLE = {
@@ -50,4 +142,23 @@ class DatabaseConfig:
     """
     # Define database parameters
     DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'catFeed.db')
-    DB_NAME = 'catFeed.db'
\ No newline at end of file
+    DB_NAME = 'catFeed.db'
+
+class ScheduleConfig:
+    """
+    Feed schedule configuration class
+    """
+    # Define scheduled feed parameters
+    FEED_SCHEDULE = {
+        "ENABLED" : True,
+        "CATCH_UP_SECONDS" : 300,       # Feeds missed by up to this long (restart, stall) are still given
+        "CLOCK_CHECK_SECONDS" : 60      # Longest sleep before rechecking the wall clock (NTP adjusts it after boot)
+    }
+    # Define periodic task parameters
+    TASK_MANAGER = {
+        "WORKERS" : 4                   # Task bodies running at once; with one per task, a slow LCD update never delays another task
+    }
+    TASK_TELEMETRY = {
+        "WINDOW" : 100,                 # Recent runs covered by each task's duration and drift histograms
+        "LOG_SECONDS" : 600             # Interval of the telemetry summary in the log, 0 to disable
+    }
@@ -0,0 +1,235 @@
+"""
+Food consumption model and time-to-empty forecast.
+
+The hopper loses food in two ways: the feeds dispensed by the motor, whose
+amount depends on the feed size, and a slow drain between feeds (the cat
+helping itself, food settling). Over each interval between level updates the
+food lost, from the drop in the distance reading, is modelled as
+
+    grams = drain_rate * hours + sum(grams_per_feed[size] * feeds[size])
+
+and the coefficients are fitted by recursive least squares: every update
+costs a few small NumPy matrix products and never revisits old readings. A
+forgetting factor lets the fit follow a change of food or a worn auger.
+Intervals in which the level rose are refills and only restart the interval.
+"""
+import datetime
+import threading
+import time
+import numpy as np
+
+# Initial covariance of the coefficients; large, as nothing is known about them
+INITIAL_COVARIANCE = 1e4
+
+class ConsumptionModel:
+    """
+    Incremental estimator of the drain rate and the grams dispensed per feed size.
+
+    Attributes:
+        grams_per_mm (float): Grams of food per mm of hopper level.
+        empty_mm (float): The distance reading of an empty hopper.
+        max_size (int): The largest feed size modelled; larger feeds count as this size.
+        seconds_per_size (float): Motor run time per unit of feed size.
+        update_seconds (float): Minimum length of an interval between updates.
+        forgetting (float): RLS forgetting factor, 1 to weigh all intervals equally.
+        refill_grams (float): A level rise of more than this is a refill.
+        theta (numpy.ndarray): Drain rate in grams per hour, then grams per feed of each size.
+        updates (int): The number of intervals fitted.
+    """
+    def __init__(self, grams_per_mm, empty_mm, max_size=5, seconds_per_size=3, update_seconds=300,
+                 forgetting=0.999, refill_grams=50):
+        """
+        Initializes an empty model.
+
+        Args:
+            grams_per_mm (float): Grams of food per mm of hopper level.
+            empty_mm (float): The distance reading of an empty hopper.
+            max_size (int): The largest feed size modelled.
+            seconds_per_size (float): Motor run time per unit of feed size.
+            update_seconds (float): Minimum length of an interval between updates.
+            forgetting (float): RLS forgetting factor.
+            refill_grams (float): A level rise of more than this is a refill.
+
+        Returns:
+            None
+        """
+        self.grams_per_mm = grams_per_mm
+        self.empty_mm = empty_mm
+        self.max_size = max_size
+        self.seconds_per_size = seconds_per_size
+        self.update_seconds = update_seconds
+        self.forgetting = forgetting
+        self.refill_grams = refill_grams
+        self.lock = threading.Lock()
+        self.theta = np.zeros(max_size + 1)
+        self.covariance = np.eye(max_size + 1) * INITIAL_COVARIANCE
+        # Feeds of each size dispensed during the current interval, and ever observed
+        self.feeds = np.zeros(max_size)
+        self.observed = np.zeros(max_size, dtype=np.int64)
+        self.updates = 0
+        self.refills = 0
+        self.interval_start = None
+        self.current = None
+
+    def record_feed(self, size):
+        """
+        Counts a dispensed feed in the current interval.
+
+        Args:
+            size (int): The size of the feed.
+
+        Returns:
+            None
+        """
+        index = min(max(int(size), 1), self.max_size) - 1
+        with self.lock:
+            self.feeds[index] += 1
+            self.observed[index] += 1
+
+    def record_level(self, reading):
+        """
+        Takes a distance reading, fitting the interval since the last update once it
+        is at least update_seconds long. Used as a DistanceSampler listener.
+
+        Args:
+            reading (dict): The sampler reading, with 'time' and 'mm'.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self._update(reading['time'], reading['mm'])
+
+    def _update(self, now, mm):
+        """
+        Fits one interval by recursive least squares. Must be called with the lock held.
+
+        Args:
+            now (float): Unix time of the reading.
+            mm (float): The distance reading in mm.
+
+        Returns:
+            None
+        """
+        self.current = (now, mm)
+        if self.interval_start is None:
+            self.interval_start = (now, mm)
+            return
+        start_time, start_mm = self.interval_start
+        if now - start_time < self.update_seconds:
+            return
+        # The distance to the food grows as the hopper empties
+        grams = (mm - start_mm) * self.grams_per_mm
+        if grams < -self.refill_grams:
+            self.refills += 1
+        else:
+            x = np.concatenate(([(now - start_time) / 3600.0], self.feeds))
+            px = self.covariance @ x
+            gain = px / (self.forgetting + x @ px)
+            self.theta += gain * (grams - x @ self.theta)
+            self.covariance = (self.covariance - np.outer(gain, px)) / self.forgetting
+            self.updates += 1
+        self.feeds[:] = 0
+        self.interval_start = (now, mm)
+
+    def warm_start(self, points, feedings):
+        """
+        Fits the model to past level readings and feedings, oldest first, so the
+        forecast is available right after a restart.
+
+        Args:
+            points (list): [time, min_mm, avg_mm, max_mm] level points, oldest first.
+            feedings (list): (time, size) of past feedings.
+
+        Returns:
+            None
+        """
+        feedings = sorted(feedings)
+        next_feed = 0
+        with self.lock:
+            for point in points:
+                while next_feed < len(feedings) and feedings[next_feed][0] <= point[0]:
+                    index = min(max(int(feedings[next_feed][1]), 1), self.max_size) - 1
+                    self.feeds[index] += 1
+                    self.observed[index] += 1
+                    next_feed += 1
+                self._update(point[0], point[2])
+
+    def forecast(self, daily_feeds):
+        """
+        Returns the fitted rates and the time until the hopper runs empty.
+
+        Args:
+            daily_feeds (numpy.ndarray): Scheduled feeds per day of each size, see daily_feed_counts().
+
+        Returns:
+            dict: The food remaining, the drain rate, the grams dispensed per feed and per
+            second of motor run time of each observed size, the expected consumption per
+            day and the forecast time to empty, or None for values not known yet.
+        """
+        with self.lock:
+            theta = self.theta.copy()
+            observed = self.observed.copy()
+            current = self.current
+            updates = self.updates
+        drain = max(float(theta[0]), 0.0)
+        per_feed = np.maximum(theta[1:], 0.0)
+        sizes = np.arange(1, self.max_size + 1)
+        per_second = per_feed / (sizes * self.seconds_per_size)
+        result = {
+            'updates': updates,
+            'drain_grams_per_hour': round(drain, 2) if updates else None,
+            'grams_per_feed': {int(s): round(float(g), 1) for s, g, n in zip(sizes, per_feed, observed) if n},
+            'grams_per_second': {int(s): round(float(g), 2) for s, g, n in zip(sizes, per_second, observed) if n},
+            'remaining_grams': None,
+            'grams_per_day': None,
+            'hours_to_empty': None,
+            'empty_at': None
+        }
+        if current is None or not updates:
+            return result
+        now, mm = current
+        remaining = max(self.empty_mm - mm, 0.0) * self.grams_per_mm
+        per_day = drain * 24 + float(np.dot(daily_feeds, per_feed))
+        result['remaining_grams'] = round(remaining, 1)
+        result['grams_per_day'] = round(per_day, 1)
+        if per_day > 0:
+            hours = remaining / per_day * 24
+            result['hours_to_empty'] = round(hours, 1)
+            result['empty_at'] = now + hours * 3600
+        return result
+
+def daily_feed_counts(feed_times, max_size):
+    """
+    Returns the number of recurring scheduled feeds per day of each size.
+
+    Args:
+        feed_times (list): FeedTime objects.
+        max_size (int): The largest feed size modelled.
+
+    Returns:
+        numpy.ndarray: Feeds per day, indexed by size - 1.
+    """
+    # One time feeds (type 1) do not recur
+    sizes = np.array([ft.size for ft in feed_times if ft.type != 1], dtype=np.int64)
+    sizes = np.clip(sizes, 1, max_size) - 1
+    return np.bincount(sizes, minlength=max_size).astype(np.float64)
+
+def feeding_times(feedings):
+    """
+    Converts Feeding records to (unix time, size) tuples for warm_start().
+
+    Args:
+        feedings (list): Feeding objects.
+
+    Returns:
+        list: (time, size) of each feeding.
+    """
+    result = []
+    for feeding in feedings:
+        try:
+            when = datetime.datetime.strptime(feeding.date + " " + feeding.time, "%Y-%m-%d %H:%M")
+        except ValueError:
+            continue
+        result.append((time.mktime(when.timetuple()), feeding.size))
+    return result
@@ -0,0 +1,334 @@
+"""
+Event-driven triggering of the scheduled feed times.
+
+Instead of polling the database, the scheduler keeps an in-memory sorted index
+of the upcoming feed occurrences and sleeps until the next one is due. The
+index is rebuilt only when the feed times change (the API invalidates it after
+committing) or when its time horizon runs out.
+
+Every occurrence is recorded in the FiredFeed ledger, whose unique slot key
+makes firing idempotent: an occurrence fires exactly once, even if the
+scheduler stalls past it or the app restarts around it. After a start only
+the last catch_up seconds are looked at: occurrences due in that window are
+caught up, older ones (missed while the app was stopped) are skipped without
+being recorded. Occurrences the running scheduler falls more than catch_up
+seconds behind on are recorded as missed.
+"""
+import bisect
+import datetime
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+# Time format of the FiredFeed slot key
+SLOT_FORMAT = "%Y-%m-%d %H:%M"
+# Fired occurrences older than this are pruned from the ledger
+LEDGER_RETENTION_DAYS = 7
+
+class FeedOccurrence:
+    """
+    A single occurrence of a scheduled feed time.
+
+    Attributes:
+        when (datetime.datetime): The time the feed is due.
+        feedtime_id (int): The ID of the FeedTime record.
+        size (int): The size of the feed.
+        type (int): The type of the feed time, 1 for a one time feed.
+    """
+    def __init__(self, when, feedtime_id, size, type):
+        self.when = when
+        self.feedtime_id = feedtime_id
+        self.size = size
+        self.type = type
+
+    @property
+    def slot(self):
+        """
+        The ledger key of the occurrence, unique per feed time and minute.
+        """
+        return self.when.strftime(SLOT_FORMAT)
+
+    def __lt__(self, other):
+        return (self.when, self.feedtime_id) < (other.when, other.feedtime_id)
+
+    def to_dict(self):
+        return {'time': self.when.strftime("%Y-%m-%d %H:%M"), 'size': self.size, 'type': self.type}
+
+class FeedScheduler:
+    """
+    Fires scheduled feeds at their exact time from an in-memory index of upcoming occurrences.
+
+    Attributes:
+        app (Flask): The Flask app, used for database access.
+        trigger (function): Called with the feed size and the reason to dispense a feed.
+        catch_up (float): Maximum lateness in seconds of an occurrence that is still fired.
+        clock_check (float): Maximum time in seconds the scheduler sleeps before checking
+            the wall clock again, so clock adjustments (NTP at boot) are noticed.
+        horizon (float): How far ahead the index reaches, in seconds.
+        telemetry (taskStats.TaskTelemetry): Receives the lateness and duration of every
+            feed fired ("feedSchedule") and index rebuild ("feedScheduleIndex"), or None.
+    """
+    def __init__(self, app, trigger, catch_up=300, clock_check=60, horizon=24 * 60 * 60, telemetry=None):
+        """
+        Initializes the scheduler without starting it.
+
+        Args:
+            app (Flask): The Flask app, used for database access.
+            trigger (function): Called with (size, reason) to dispense a feed.
+            catch_up (float): Maximum lateness in seconds of an occurrence that is still fired.
+            clock_check (float): Maximum time in seconds between wall clock checks.
+            horizon (float): How far ahead the index reaches, in seconds.
+            telemetry (taskStats.TaskTelemetry): Receives the telemetry of fired feeds and rebuilds, or None.
+
+        Returns:
+            None
+        """
+        self.app = app
+        self.trigger = trigger
+        self.catch_up = catch_up
+        self.clock_check = clock_check
+        self.horizon = horizon
+        self.telemetry = telemetry
+        self.cv = threading.Condition()
+        self.index = []
+        self.index_end = None
+        self.dirty = True
+        # Occurrences up to this time have been handled
+        self.processed_until = None
+        self.listeners = []
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the scheduler thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stops the scheduler thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.running = False
+            self.cv.notify_all()
+
+    def invalidate(self):
+        """
+        Marks the index as stale after the feed times changed. The scheduler
+        rebuilds it immediately and goes back to sleep until the next occurrence.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.dirty = True
+            self.cv.notify_all()
+
+    def add_listener(self, listener):
+        """
+        Registers a function called with no arguments whenever the index is rebuilt
+        or a feed fires, from the scheduler thread. Listeners must return quickly.
+
+        Args:
+            listener (function): The function to call.
+
+        Returns:
+            None
+        """
+        self.listeners.append(listener)
+
+    def upcoming(self, limit=None):
+        """
+        Returns the upcoming occurrences in the index, soonest first.
+
+        Args:
+            limit (int): The maximum number of occurrences, or None for all.
+
+        Returns:
+            list: FeedOccurrence objects.
+        """
+        with self.cv:
+            return list(self.index[:limit])
+
+    def _build_index(self, start, end):
+        """
+        Loads the feed times and the ledger and builds the sorted occurrences in [start, end).
+
+        Args:
+            start (datetime.datetime): The start of the window.
+            end (datetime.datetime): The end of the window.
+
+        Returns:
+            list: The sorted FeedOccurrence objects not yet in the ledger.
+        """
+        from app import db
+        from app.models import FeedTime, FiredFeed
+        with self.app.app_context():
+            # Copied out, the rows expire on the commit below
+            feed_times = [(row.id, row.time, row.size, row.type) for row in FeedTime.query.all()]
+            fired = {(row.feedtime_id, row.slot) for row in
+                     FiredFeed.query.filter(FiredFeed.slot >= start.strftime(SLOT_FORMAT)).all()}
+            # Prune the ledger while we are here; it only has to cover the catch-up window
+            cutoff = (start - datetime.timedelta(days=LEDGER_RETENTION_DAYS)).strftime(SLOT_FORMAT)
+            FiredFeed.query.filter(FiredFeed.slot < cutoff).delete()
+            db.session.commit()
+        index = []
+        day = start.date()
+        while day <= end.date():
+            for feedtime_id, feed_time, size, type in feed_times:
+                try:
+                    clock = datetime.datetime.strptime(feed_time, "%H:%M").time()
+                except ValueError:
+                    print(f"Ignoring feed time with invalid time '{feed_time}'")
+                    continue
+                occurrence = FeedOccurrence(datetime.datetime.combine(day, clock), feedtime_id, size, type)
+                if start <= occurrence.when < end and (occurrence.feedtime_id, occurrence.slot) not in fired:
+                    index.append(occurrence)
+            day += datetime.timedelta(days=1)
+        index.sort()
+        return index
+
+    def _fire(self, occurrence, now):
+        """
+        Records an occurrence in the ledger and, if it was not already recorded and
+        is not too late, dispenses the feed.
+
+        The ledger row, the feeding record and the removal of a one time feed are
+        committed together before the motor runs, so a crash can lose a feed but
+        never repeat one.
+
+        Args:
+            occurrence (FeedOccurrence): The due occurrence.
+            now (datetime.datetime): The current time.
+
+        Returns:
+            None
+        """
+        from app import db
+        from app.models import FeedTime, Feeding, FiredFeed
+        late = (now - occurrence.when).total_seconds()
+        missed = late > self.catch_up
+        with self.app.app_context():
+            db.session.add(FiredFeed(feedtime_id=occurrence.feedtime_id, slot=occurrence.slot,
+                                     fired_at=now.strftime("%Y-%m-%d %H:%M:%S"), missed=missed))
+            if not missed:
+                db.session.add(Feeding(time=occurrence.when.strftime("%H:%M"), type=occurrence.type,
+                                       date=occurrence.when.strftime("%Y-%m-%d"), size=occurrence.size))
+                if occurrence.type == 1:
+                    # Remove the feed time from the database if it is a 1 time feed
+                    FeedTime.query.filter_by(id=occurrence.feedtime_id).delete()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Already fired, by this process before a restart or by another one
+                db.session.rollback()
+                return
+        if missed:
+            print(f"Missed feed at {occurrence.slot}, {late:.0f} seconds late")
+            return
+        print(f"Triggering scheduled feed at {occurrence.slot}")
+        self.trigger(occurrence.size, "scheduled")
+
+    def _record(self, name, drift, started, error=None):
+        if self.telemetry is not None:
+            self.telemetry.record_run(name, drift, time.monotonic() - started, error)
+
+    def _notify_listeners(self):
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                print("Feed schedule listener error: " + str(e))
+
+    def _run(self):
+        """
+        Scheduler loop: sleeps until the next occurrence, the end of the index
+        horizon, an invalidation or the next wall clock check.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        print("Starting feed scheduler")
+        if self.processed_until is None:
+            # After a restart, occurrences within the catch-up window may not have fired yet
+            self.processed_until = datetime.datetime.now() - datetime.timedelta(seconds=self.catch_up)
+        while True:
+            with self.cv:
+                if not self.running:
+                    break
+                rebuild = self.dirty or self.index_end is None or datetime.datetime.now() >= self.index_end
+                self.dirty = False
+            try:
+                if rebuild:
+                    end = datetime.datetime.now() + datetime.timedelta(seconds=self.horizon)
+                    started = time.monotonic()
+                    index = self._build_index(self.processed_until, end)
+                    self._record("feedScheduleIndex", 0.0, started)
+                    with self.cv:
+                        self.index = index
+                        self.index_end = end
+                    self._notify_listeners()
+                now = datetime.datetime.now()
+                with self.cv:
+                    due = self.index[:bisect.bisect_right([o.when for o in self.index], now)]
+                for occurrence in due:
+                    started = time.monotonic()
+                    # Lateness of the feed against its scheduled time
+                    drift = (datetime.datetime.now() - occurrence.when).total_seconds()
+                    try:
+                        self._fire(occurrence, now)
+                    except Exception as e:
+                        self._record("feedSchedule", drift, started, e)
+                        raise
+                    self._record("feedSchedule", drift, started)
+                with self.cv:
+                    # Fired occurrences leave the index; a rebuild may have replaced it meanwhile
+                    self.index = [o for o in self.index if o not in due]
+                    self.processed_until = now
+                    if any(o.type == 1 for o in due):
+                        # One time feeds were deleted: drop their later occurrences
+                        self.dirty = True
+                if due:
+                    self._notify_listeners()
+            except Exception as e:
+                print("Feed scheduler error: " + str(e))
+                with self.cv:
+                    # Retry with a fresh index after a pause, rather than spinning on a broken database
+                    self.cv.wait(self.clock_check)
+                    self.dirty = True
+                continue
+            with self.cv:
+                if not self.running or self.dirty:
+                    continue
+                wake = self.index_end
+                if self.index:
+                    wake = min(wake, self.index[0].when)
+                delay = (wake - datetime.datetime.now()).total_seconds()
+                if delay > 0:
+                    self.cv.wait(min(delay, self.clock_check))
+        print("Stopped feed scheduler")
@@ -0,0 +1,259 @@
+"""
+End-to-end latency and frame rate statistics for the live video stream.
+
+Every frame is stamped with its capture time. The broadcaster records how
+long each stage takes (capture, processing, encoding) and every viewer
+records how long writing the frame to its socket takes and how old the frame
+was once written. The durations go into rolling windows kept per camera mode
+and resolution, so percentiles and the achieved frame rate reflect the
+recent stream rather than its whole lifetime.
+"""
+import threading
+import time
+import numpy as np
+
+# Stages timed for every frame, in pipeline order. "latency" is capture to socket write complete
+STAGES = ('capture', 'process', 'encode', 'write', 'latency')
+# Upper edges of the histogram buckets, in milliseconds
+HISTOGRAM_EDGES_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+# How often the overlay text is refreshed, in seconds
+OVERLAY_REFRESH_SECONDS = 1.0
+
+class RollingHistogram:
+    """
+    Keeps the most recent durations in a fixed-size ring buffer.
+
+    Recording a duration is O(1) and never allocates; percentiles and the
+    bucketed histogram are computed from the window when requested.
+
+    Attributes:
+        window (int): The number of most recent samples kept.
+        count (int): The total number of samples recorded.
+    """
+    def __init__(self, window=300):
+        """
+        Initializes an empty histogram.
+
+        Args:
+            window (int): The number of most recent samples kept.
+
+        Returns:
+            None
+        """
+        self.window = window
+        self.samples = np.zeros(window, dtype=np.float64)
+        self.count = 0
+
+    def record(self, duration):
+        """
+        Records a duration.
+
+        Args:
+            duration (float): The duration in seconds.
+
+        Returns:
+            None
+        """
+        self.samples[self.count % self.window] = duration
+        self.count += 1
+
+    def recent(self):
+        """
+        Returns the samples in the window, in no particular order.
+
+        Args:
+            None
+
+        Returns:
+            numpy.ndarray: The samples in seconds.
+        """
+        return self.samples[:min(self.count, self.window)]
+
+    def to_dict(self):
+        """
+        Returns the percentiles and the bucket counts of the window in milliseconds.
+
+        Args:
+            None
+
+        Returns:
+            dict: The sample count, p50/p90/p99/max in ms, and the count per bucket,
+            keyed by the bucket's upper edge in ms ("inf" for the overflow bucket).
+        """
+        recent = self.recent() * 1000
+        if not len(recent):
+            return {'count': self.count}
+        p50, p90, p99 = np.percentile(recent, (50, 90, 99))
+        counts = np.bincount(np.searchsorted(HISTOGRAM_EDGES_MS, recent), minlength=len(HISTOGRAM_EDGES_MS) + 1)
+        buckets = {str(edge): int(n) for edge, n in zip(HISTOGRAM_EDGES_MS, counts)}
+        buckets['inf'] = int(counts[-1])
+        return {
+            'count': self.count,
+            'p50_ms': round(float(p50), 3),
+            'p90_ms': round(float(p90), 3),
+            'p99_ms': round(float(p99), 3),
+            'max_ms': round(float(recent.max()), 3),
+            'buckets': buckets
+        }
+
+class StreamProfile:
+    """
+    The rolling statistics of the stream in one camera mode at one resolution.
+
+    Attributes:
+        stages (dict): RollingHistogram of each stage in STAGES.
+        published (RollingHistogram): Monotonic publish times of recent frames,
+            used for the achieved frame rate.
+    """
+    def __init__(self, window):
+        self.stages = {stage: RollingHistogram(window) for stage in STAGES}
+        self.published = RollingHistogram(window)
+
+    def fps(self):
+        """
+        Returns the frame rate achieved over the window.
+
+        Args:
+            None
+
+        Returns:
+            float: Frames per second, or 0 with fewer than two frames.
+        """
+        times = self.published.recent()
+        if len(times) < 2:
+            return 0.0
+        span = times.max() - times.min()
+        return (len(times) - 1) / span if span > 0 else 0.0
+
+    def to_dict(self):
+        """
+        Returns the frame rate and the statistics of every stage.
+
+        Args:
+            None
+
+        Returns:
+            dict: The frame count, achieved fps and per-stage statistics.
+        """
+        return {
+            'frames': self.published.count,
+            'fps': round(self.fps(), 2),
+            'stages': {stage: histogram.to_dict() for stage, histogram in self.stages.items()}
+        }
+
+class FrameStats:
+    """
+    Thread safe collection of the stream's rolling statistics, per camera mode and resolution.
+
+    The producer thread records the capture, process and encode stages and the
+    publish time; viewer threads record the write and end-to-end latency.
+
+    Attributes:
+        window (int): The number of recent frames each statistic covers.
+        profiles (dict): StreamProfile by "mode@WIDTHxHEIGHT" key.
+    """
+    def __init__(self, window=300):
+        """
+        Initializes empty statistics.
+
+        Args:
+            window (int): The number of recent frames each statistic covers.
+
+        Returns:
+            None
+        """
+        self.window = window
+        self.lock = threading.Lock()
+        self.profiles = {}
+        self.overlay_text = ""
+        self.overlay_updated = 0.0
+
+    @staticmethod
+    def key(mode, shape):
+        """
+        Returns the profile key of a camera mode and processed frame shape.
+
+        Args:
+            mode (str): The camera mode name.
+            shape (tuple): The shape of the frame, or None if unknown.
+
+        Returns:
+            str: The key, e.g. "gray@540x540".
+        """
+        if shape is None:
+            return mode
+        return f"{mode}@{shape[1]}x{shape[0]}"
+
+    def _profile(self, key):
+        profile = self.profiles.get(key)
+        if profile is None:
+            profile = StreamProfile(self.window)
+            self.profiles[key] = profile
+        return profile
+
+    def record(self, key, stage, duration):
+        """
+        Records the duration of a stage for a frame.
+
+        Args:
+            key (str): The profile key of the frame.
+            stage (str): One of STAGES.
+            duration (float): The duration in seconds.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self._profile(key).stages[stage].record(duration)
+
+    def record_published(self, key, now):
+        """
+        Records the publish time of a frame, for the achieved frame rate.
+
+        Args:
+            key (str): The profile key of the frame.
+            now (float): The monotonic publish time.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self._profile(key).published.record(now)
+
+    def overlay(self, key):
+        """
+        Returns a one line summary of a profile for burning into the frame,
+        refreshed at most once per OVERLAY_REFRESH_SECONDS.
+
+        Args:
+            key (str): The profile key of the frame.
+
+        Returns:
+            str: The summary text.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if now - self.overlay_updated >= OVERLAY_REFRESH_SECONDS:
+                profile = self._profile(key)
+                latency = profile.stages['latency'].recent() * 1000
+                if len(latency):
+                    p50, p99 = np.percentile(latency, (50, 99))
+                    self.overlay_text = f"{key} {profile.fps():.1f} fps latency p50 {p50:.0f} ms p99 {p99:.0f} ms"
+                else:
+                    self.overlay_text = f"{key} {profile.fps():.1f} fps"
+                self.overlay_updated = now
+            return self.overlay_text
+
+    def to_dict(self):
+        """
+        Returns the statistics of every profile seen so far.
+
+        Args:
+            None
+
+        Returns:
+            dict: The window size and the statistics by profile key.
+        """
+        with self.lock:
+            return {'window': self.window,
+                    'profiles': {key: profile.to_dict() for key, profile in self.profiles.items()}}
@@ -0,0 +1,264 @@
+"""
+Time series of the hopper level, with rollups for charting.
+
+Every filtered distance reading is kept as a raw point for a day. Readings
+are also aggregated into 5-minute and hourly buckets holding the minimum,
+average and maximum, which are kept much longer. All series live in one
+table keyed by resolution and bucket start, so a range query reads at most a
+few hundred rows of the coarsest resolution that is fine enough, never the
+raw points of a long range.
+
+Points are buffered in memory and written in one transaction every
+flush_seconds, so continuous sampling costs one small SQLite write every few
+minutes rather than one per ping. Buffered points are included in queries.
+"""
+import threading
+import time
+
+# Resolution of the raw points
+RAW = 0
+# Rollup resolutions in seconds, finest first
+ROLLUPS = (300, 3600)
+
+class Bucket:
+    """
+    A running min/avg/max aggregate of the readings in one bucket.
+
+    Attributes:
+        resolution (int): The bucket length in seconds, RAW for a single reading.
+        start (int): Unix time of the start of the bucket.
+        minimum (float): The smallest reading.
+        total (float): The sum of the readings.
+        maximum (float): The largest reading.
+        count (int): The number of readings.
+    """
+    def __init__(self, resolution, start, minimum, total, maximum, count):
+        self.resolution = resolution
+        self.start = start
+        self.minimum = minimum
+        self.total = total
+        self.maximum = maximum
+        self.count = count
+
+    def add(self, minimum, total, maximum, count):
+        self.minimum = min(self.minimum, minimum)
+        self.total += total
+        self.maximum = max(self.maximum, maximum)
+        self.count += count
+
+    def to_point(self):
+        return [self.start, round(self.minimum, 1), round(self.total / self.count, 1), round(self.maximum, 1)]
+
+class LevelHistory:
+    """
+    Buffered store of the hopper level series and its rollups.
+
+    Attributes:
+        app (Flask): The Flask app, used for database access.
+        flush_seconds (float): Maximum time readings stay buffered in memory.
+        sample_period (float): Expected time between readings, used to size raw queries.
+        retention (dict): Seconds each resolution is kept for, by resolution.
+    """
+    def __init__(self, app, flush_seconds=300, sample_period=2.0, raw_hours=24, five_minute_days=30, hourly_days=365):
+        """
+        Initializes an empty buffer.
+
+        Args:
+            app (Flask): The Flask app, used for database access.
+            flush_seconds (float): Maximum time readings stay buffered in memory.
+            sample_period (float): Expected time between readings in seconds.
+            raw_hours (float): Hours the raw readings are kept.
+            five_minute_days (float): Days the 5-minute rollups are kept.
+            hourly_days (float): Days the hourly rollups are kept.
+
+        Returns:
+            None
+        """
+        self.app = app
+        self.flush_seconds = flush_seconds
+        self.sample_period = sample_period
+        self.retention = {RAW: raw_hours * 3600, ROLLUPS[0]: five_minute_days * 86400, ROLLUPS[1]: hourly_days * 86400}
+        self.lock = threading.Lock()
+        # Serializes flushes, which run outside the buffer lock
+        self.flush_lock = threading.Lock()
+        # Raw points and closed rollup buckets waiting to be written
+        self.pending = []
+        # The open bucket of each rollup resolution
+        self.open = {}
+        self.last_flush = time.monotonic()
+        self.last_prune = 0.0
+
+    def record(self, reading):
+        """
+        Adds a distance reading, and flushes the buffer if it is due. Used as a
+        DistanceSampler listener.
+
+        Args:
+            reading (dict): The sampler reading, with 'time' and 'mm'.
+
+        Returns:
+            None
+        """
+        now = int(reading['time'])
+        mm = reading['mm']
+        with self.lock:
+            self.pending.append(Bucket(RAW, now, mm, mm, mm, 1))
+            for resolution in ROLLUPS:
+                start = now - now % resolution
+                bucket = self.open.get(resolution)
+                if bucket is not None and bucket.start != start:
+                    # The bucket is complete
+                    self.pending.append(bucket)
+                    bucket = None
+                if bucket is None:
+                    self.open[resolution] = Bucket(resolution, start, mm, mm, mm, 1)
+                else:
+                    bucket.add(mm, mm, mm, 1)
+            due = time.monotonic() - self.last_flush >= self.flush_seconds
+        if due:
+            self.flush()
+
+    def flush(self, final=False):
+        """
+        Writes the buffered points in one transaction. Rollup buckets already in the
+        database, from before a restart, are merged rather than duplicated.
+
+        Args:
+            final (bool): Also write the open buckets, when shutting down.
+
+        Returns:
+            None
+        """
+        from app import db
+        from app.models import LevelSample
+        with self.flush_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = []
+                if final:
+                    pending.extend(self.open.values())
+                    self.open = {}
+                self.last_flush = time.monotonic()
+            if not pending:
+                return
+            try:
+                with self.app.app_context():
+                    for bucket in pending:
+                        row = None
+                        if bucket.resolution != RAW:
+                            row = LevelSample.query.filter_by(resolution=bucket.resolution, bucket=bucket.start).first()
+                        if row is None:
+                            db.session.add(LevelSample(resolution=bucket.resolution, bucket=bucket.start,
+                                                       minimum=bucket.minimum, average=bucket.total / bucket.count,
+                                                       maximum=bucket.maximum, count=bucket.count))
+                        else:
+                            total = row.average * row.count + bucket.total
+                            row.minimum = min(row.minimum, bucket.minimum)
+                            row.maximum = max(row.maximum, bucket.maximum)
+                            row.count += bucket.count
+                            row.average = total / row.count
+                    if time.time() - self.last_prune >= 3600:
+                        self._prune()
+                    db.session.commit()
+            except Exception as e:
+                print("Level history flush error: " + str(e))
+                with self.app.app_context():
+                    db.session.rollback()
+                # Keep the points for the next flush
+                with self.lock:
+                    self.pending = pending + self.pending
+
+    def _prune(self):
+        """
+        Deletes the points older than the retention of their resolution. Must be called
+        in an app context; committed with the flush.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        from app.models import LevelSample
+        now = time.time()
+        for resolution, seconds in self.retention.items():
+            LevelSample.query.filter(LevelSample.resolution == resolution,
+                                     LevelSample.bucket < now - seconds).delete()
+        self.last_prune = now
+
+    def _resolution_for(self, start, end, max_points):
+        """
+        Returns the finest resolution that covers a range within its retention and
+        in at most max_points points, or the coarsest resolution if none does.
+
+        Args:
+            start (float): Unix time of the start of the range.
+            end (float): Unix time of the end of the range.
+            max_points (int): The maximum number of points wanted.
+
+        Returns:
+            int: The resolution.
+        """
+        now = time.time()
+        span = max(end - start, 1)
+        for resolution in (RAW,) + ROLLUPS:
+            points = span / (resolution or self.sample_period)
+            if start >= now - self.retention[resolution] and points <= max_points:
+                return resolution
+        return ROLLUPS[-1]
+
+    @staticmethod
+    def _merge(buckets, bucket):
+        # Readings within the same second, or parts of a bucket split by a restart, are combined
+        existing = buckets.get(bucket.start)
+        if existing is None:
+            buckets[bucket.start] = bucket
+        else:
+            existing.add(bucket.minimum, bucket.total, bucket.maximum, bucket.count)
+
+    def query(self, start, end, max_points=200):
+        """
+        Returns the level series over a range, downsampled to at most max_points points.
+
+        Args:
+            start (float): Unix time of the start of the range.
+            end (float): Unix time of the end of the range.
+            max_points (int): The maximum number of points.
+
+        Returns:
+            dict: The resolution of the series in seconds (0 for raw readings) and the
+            points as [time, min_mm, avg_mm, max_mm], oldest first.
+        """
+        from app.models import LevelSample
+        resolution = self._resolution_for(start, end, max_points)
+        with self.app.app_context():
+            rows = LevelSample.query.filter(LevelSample.resolution == resolution,
+                                            LevelSample.bucket >= start - resolution,
+                                            LevelSample.bucket <= end) \
+                                    .order_by(LevelSample.bucket).all()
+            buckets = {}
+            for row in rows:
+                self._merge(buckets, Bucket(resolution, row.bucket, row.minimum, row.average * row.count,
+                                            row.maximum, row.count))
+        with self.lock:
+            unwritten = [b for b in self.pending if b.resolution == resolution]
+            if resolution in self.open:
+                unwritten.append(self.open[resolution])
+            unwritten = [Bucket(b.resolution, b.start, b.minimum, b.total, b.maximum, b.count) for b in unwritten]
+        for bucket in unwritten:
+            if bucket.start + resolution < start or bucket.start > end:
+                continue
+            self._merge(buckets, bucket)
+        series = [buckets[key] for key in sorted(buckets)]
+        if len(series) > max_points:
+            # Still too many points, e.g. years of hourly rollups: merge neighbouring buckets
+            group = -(-len(series) // max_points)
+            merged = []
+            for i in range(0, len(series), group):
+                bucket = Bucket(resolution, series[i].start, series[i].minimum, series[i].total,
+                                series[i].maximum, series[i].count)
+                for other in series[i + 1:i + group]:
+                    bucket.add(other.minimum, other.total, other.maximum, other.count)
+                merged.append(bucket)
+            series = merged
+        return {'resolution': resolution, 'points': [bucket.to_point() for bucket in series]}
@@ -0,0 +1,206 @@
+"""
+Background sampling of the hopper distance sensor.
+
+A single thread owns the ultrasonic sensor and pings it at a fixed rate, so
+requests never trigger a ping themselves and pings never overlap. Readings go
+into a small ring buffer; the filtered level is the median of the buffer
+after readings far from it (a ping echoing off the auger or a cat's head) are
+rejected. Requests read the latest filtered level without touching the
+sensor. A request that needs a fresh reading asks the sampler for an early
+ping and waits for a ping started after it asked; concurrent requests share
+the same ping.
+"""
+import threading
+import time
+import numpy as np
+
+# Minimum time between pings in seconds, so the echo of the previous ping has died down
+MIN_PING_INTERVAL = 0.06
+
+class DistanceSampler:
+    """
+    Pings the distance sensor at a fixed rate and keeps a filtered hopper level.
+
+    Attributes:
+        sensor (distanceSensor.DistanceSensor): The sensor.
+        rate (float): Pings per second.
+        window (int): The number of recent readings the filter covers.
+        outlier_mm (float): Readings further than this from the median are rejected.
+        samples (int): The number of valid readings taken.
+        errors (int): The number of pings that timed out.
+    """
+    def __init__(self, sensor, rate=0.5, window=9, outlier_mm=20):
+        """
+        Initializes the sampler without starting it.
+
+        Args:
+            sensor (distanceSensor.DistanceSensor): The sensor.
+            rate (float): Pings per second.
+            window (int): The number of recent readings the filter covers.
+            outlier_mm (float): Readings further than this from the median are rejected.
+
+        Returns:
+            None
+        """
+        self.sensor = sensor
+        self.rate = rate
+        self.window = window
+        self.outlier_mm = outlier_mm
+        self.readings = np.zeros(window, dtype=np.float64)
+        self.samples = 0
+        self.errors = 0
+        self.cv = threading.Condition()
+        # The latest filtered reading, replaced as a whole so reads need no copy
+        self.latest = None
+        # Fresh reading requests made, and the requests seen by the start of the last finished ping
+        self.requested = 0
+        self.served = 0
+        self.listeners = []
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        Starts the sampler thread.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """
+        Stops the sampler thread after its current ping.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.running = False
+            self.cv.notify_all()
+
+    def add_listener(self, listener):
+        """
+        Registers a function called with each new filtered reading, from the sampler
+        thread. Listeners must return quickly.
+
+        Args:
+            listener (function): Called with the reading dict, see get_reading().
+
+        Returns:
+            None
+        """
+        self.listeners.append(listener)
+
+    def get_reading(self):
+        """
+        Returns the latest filtered reading without pinging the sensor.
+
+        Args:
+            None
+
+        Returns:
+            dict: The filtered distance in mm, the level in percent, the wall clock
+            time of the last ping and the number of readings kept by the filter,
+            or None before the first valid reading.
+        """
+        return self.latest
+
+    def read_fresh(self, timeout=2.0):
+        """
+        Asks the sampler for an early ping and waits for the reading of a ping started
+        after the request, so the reading never predates it. Concurrent callers wait
+        for the same ping.
+
+        Args:
+            timeout (float): Maximum time to wait in seconds.
+
+        Returns:
+            dict: The filtered reading, see get_reading(). On a timeout, the latest
+            reading, which may be None.
+        """
+        with self.cv:
+            self.requested += 1
+            target = self.requested
+            self.cv.notify_all()
+            self.cv.wait_for(lambda: self.served >= target or not self.running, timeout)
+            return self.latest
+
+    def _filter(self):
+        """
+        Returns the median of the buffered readings within outlier_mm of their median.
+
+        Args:
+            None
+
+        Returns:
+            tuple: The filtered distance in mm and the number of readings kept.
+        """
+        recent = self.readings[:min(self.samples, self.window)]
+        median = np.median(recent)
+        kept = recent[np.abs(recent - median) <= self.outlier_mm]
+        return float(np.median(kept)), len(kept)
+
+    def _run(self):
+        """
+        Sampler loop: pings at the configured rate, or early when a fresh reading is requested.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        print("Starting distance sampler")
+        period = 1.0 / self.rate
+        while True:
+            started = time.monotonic()
+            with self.cv:
+                # The requests this ping answers
+                requested = self.requested
+            try:
+                mm = self.sensor.ping_mm()
+            except Exception as e:
+                print("Distance sampler error: " + str(e))
+                mm = -1
+            reading = None
+            with self.cv:
+                if mm < 0:
+                    self.errors += 1
+                else:
+                    self.readings[self.samples % self.window] = mm
+                    self.samples += 1
+                    filtered, kept = self._filter()
+                    reading = {
+                        'mm': round(filtered, 1),
+                        'percent': self.sensor.to_percent(filtered),
+                        'time': time.time(),
+                        'samples': kept
+                    }
+                    self.latest = reading
+                self.served = requested
+                self.cv.notify_all()
+            if reading is not None:
+                for listener in self.listeners:
+                    try:
+                        listener(reading)
+                    except Exception as e:
+                        print("Distance sampler listener error: " + str(e))
+            with self.cv:
+                self.cv.wait_for(lambda: self.requested > self.served or not self.running,
+                                 max(0.0, started + period - time.monotonic()))
+                if not self.running:
+                    break
+            time.sleep(max(0.0, started + MIN_PING_INTERVAL - time.monotonic()))
+        print("Stopped distance sampler")
@@ -61,4 +61,75 @@ class Feeding(db.Model):
     date = db.Column(db.String(80), unique=False, nullable=False)
     
     def __repr__(self):
-        return '<Feeding %r>' % self.time
\ No newline at end of file
+        return '<Feeding %r>' % self.time
+    
+class FiredFeed(db.Model):
+    """
+    Model representing the ledger of scheduled feed occurrences that have been handled.
+    Each occurrence can only be recorded once, so it can only fire once.
+    
+    Attributes:
+        id (int): Unique ID of the ledger record.
+        feedtime_id (int): The ID of the feed time the occurrence belongs to.
+        slot (str): The date and time the occurrence was due, as "YYYY-MM-DD HH:MM".
+        fired_at (str): The date and time the occurrence was handled.
+        missed (bool): True if the occurrence was too late to be fed.
+    """
+    __tablename__ = 'firedfeeds'
+    __table_args__ = (db.UniqueConstraint('feedtime_id', 'slot'),)
+    id = db.Column(db.Integer, primary_key=True)
+    feedtime_id = db.Column(db.Integer, unique=False, nullable=False)
+    slot = db.Column(db.String(80), unique=False, nullable=False, index=True)
+    fired_at = db.Column(db.String(80), unique=False, nullable=False)
+    missed = db.Column(db.Boolean, unique=False, nullable=False, default=False)
+    
+    def __repr__(self):
+        return '<FiredFeed %r %r>' % (self.feedtime_id, self.slot)
+    
+class Presence(db.Model):
+    """
+    Model representing intervals during which the cat was detected at the bowl
+    
+    Attributes:
+        id (int): Unique ID of the presence record.
+        date (str): The date the cat arrived.
+        start (str): The time the cat arrived.
+        end (str): The time the cat was last seen.
+        duration (float): The length of the interval in seconds.
+    """
+    __tablename__ = 'presence'
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.String(80), unique=False, nullable=False)
+    start = db.Column(db.String(80), unique=False, nullable=False)
+    end = db.Column(db.String(80), unique=False, nullable=False)
+    duration = db.Column(db.Float, unique=False, nullable=False)
+    
+    def __repr__(self):
+        return '<Presence %r %r>' % (self.date, self.start)
+    
+class LevelSample(db.Model):
+    """
+    Model representing a point of the hopper level series, either a raw distance
+    reading or a rollup of the readings in a 5-minute or hourly bucket
+    
+    Attributes:
+        id (int): Unique ID of the sample record.
+        resolution (int): The bucket length in seconds, 0 for a raw reading.
+        bucket (int): Unix time of the reading, or of the start of the bucket.
+        minimum (float): The smallest distance reading in mm.
+        average (float): The average distance reading in mm.
+        maximum (float): The largest distance reading in mm.
+        count (int): The number of readings in the bucket.
+    """
+    __tablename__ = 'levelsamples'
+    __table_args__ = (db.Index('ix_levelsamples_resolution_bucket', 'resolution', 'bucket'),)
+    id = db.Column(db.Integer, primary_key=True)
+    resolution = db.Column(db.Integer, unique=False, nullable=False)
+    bucket = db.Column(db.Integer, unique=False, nullable=False)
+    minimum = db.Column(db.Float, unique=False, nullable=False)
+    average = db.Column(db.Float, unique=False, nullable=False)
+    maximum = db.Column(db.Float, unique=False, nullable=False)
+    count = db.Column(db.Integer, unique=False, nullable=False)
+    
+    def __repr__(self):
+        return '<LevelSample %r %r>' % (self.resolution, self.bucket)
@@ -0,0 +1,292 @@
+"""
+A single worker that owns the feed motor.
+
+Every feed, scheduled or manual, is submitted as a command to a bounded
+queue and run one at a time, so two feeds close together can never drive
+the motor at the same time. The motor runs without blocking and reports
+completion through a callback, which starts the next command; no thread
+waits for the motor. Manual feeds submitted while an earlier
+manual feed is still waiting are merged into it, up to a maximum portion,
+so a burst of button presses becomes one longer run. Each command carries a
+future the API can wait on, and is kept for a while after it finishes so
+its state can be polled by ID.
+"""
+import collections
+import concurrent.futures
+import itertools
+import threading
+import time
+
+from app.frameStats import RollingHistogram
+
+class MotorCommand:
+    """
+    A feed command for the motor worker.
+
+    Attributes:
+        id (int): The ID of the command.
+        size (int): The size of the feed, including merged commands.
+        reason (str): Why the feed was given, "scheduled" or "manual".
+        merged (int): The number of submissions the command stands for.
+        state (str): "queued", "running", "done" or "failed".
+        submitted (float): Wall clock time the command was submitted.
+        started (float): Wall clock time the motor started, or None.
+        finished (float): Wall clock time the motor stopped, or None.
+        error (str): The error if the command failed, or None.
+        future (concurrent.futures.Future): Resolved with the command once it has finished.
+    """
+    def __init__(self, id, size, reason):
+        self.id = id
+        self.size = size
+        self.reason = reason
+        self.merged = 1
+        self.state = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.future = concurrent.futures.Future()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'size': self.size,
+            'reason': self.reason,
+            'merged': self.merged,
+            'state': self.state,
+            'submitted': self.submitted,
+            'started': self.started,
+            'finished': self.finished,
+            'error': self.error
+        }
+
+class MotorQueue:
+    """
+    Runs feed commands on the motor one at a time from a bounded queue.
+
+    Attributes:
+        motor (DCMotor.DCMotor): The motor.
+        max_depth (int): The maximum number of queued commands; manual feeds beyond it are rejected.
+            Scheduled feeds are always queued, as they are already recorded as given.
+        max_portion (int): The largest size a burst of manual feeds is merged into.
+        seconds_per_size (float): Motor run time per unit of feed size.
+    """
+    def __init__(self, motor, max_depth=8, max_portion=5, seconds_per_size=3, history=50, stats_window=100):
+        """
+        Initializes an idle queue.
+
+        Args:
+            motor (DCMotor.DCMotor): The motor.
+            max_depth (int): The maximum number of queued commands.
+            max_portion (int): The largest size a burst of manual feeds is merged into.
+            seconds_per_size (float): Motor run time per unit of feed size.
+            history (int): The number of finished commands kept for polling.
+            stats_window (int): The number of recent commands the latency statistics cover.
+
+        Returns:
+            None
+        """
+        self.motor = motor
+        self.max_depth = max_depth
+        self.max_portion = max_portion
+        self.seconds_per_size = seconds_per_size
+        self.history = history
+        self.cv = threading.Condition()
+        self.queue = collections.deque()
+        # Recent commands by ID, oldest first
+        self.commands = collections.OrderedDict()
+        self.ids = itertools.count(1)
+        self.current = None
+        self.current_started = None
+        self.wait_time = RollingHistogram(stats_window)
+        self.run_time = RollingHistogram(stats_window)
+        self.submitted = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.failed = 0
+        self.max_seen_depth = 0
+        self.depth_total = 0
+        self.listeners = []
+        self.stopped = False
+
+    def submit(self, size, reason):
+        """
+        Queues a feed. A manual feed is merged into the last queued manual feed if
+        the merged size stays within max_portion, and rejected if the queue is full.
+        Returns immediately.
+
+        Args:
+            size (int): The size of the feed.
+            reason (str): Why the feed was given, "scheduled" or "manual".
+
+        Returns:
+            MotorCommand: The command the feed is part of, or None if the queue is full or stopped.
+
+        Raises:
+            ValueError: If the size is not an integer from 1 to max_portion.
+        """
+        if isinstance(size, bool) or not isinstance(size, int) or not 1 <= size <= self.max_portion:
+            raise ValueError(f"Invalid feed size {size!r}, must be an integer from 1 to {self.max_portion}")
+        with self.cv:
+            if self.stopped:
+                print(f"Motor queue stopped, rejecting {reason} feed of size {size}")
+                return None
+            self.submitted += 1
+            if reason == "manual" and self.queue:
+                last = self.queue[-1]
+                if last.reason == "manual" and last.size + size <= self.max_portion:
+                    last.size += size
+                    last.merged += 1
+                    self.coalesced += 1
+                    return last
+            if reason == "manual" and len(self.queue) >= self.max_depth:
+                self.rejected += 1
+                print(f"Motor queue full, rejecting {reason} feed of size {size}")
+                return None
+            command = MotorCommand(next(self.ids), size, reason)
+            self.queue.append(command)
+            self.commands[command.id] = command
+            while len(self.commands) > self.history + self.max_depth:
+                self.commands.popitem(last=False)
+            # Queue depth seen by each new command, including itself
+            self.depth_total += len(self.queue)
+            self.max_seen_depth = max(self.max_seen_depth, len(self.queue))
+            finished = self._start_next()
+        self._resolve(finished)
+        return command
+
+    def stop(self):
+        """
+        Stops the queue on shutdown: fails the queued commands, rejects new ones and
+        stops the motor if it is running.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.stopped = True
+            cancelled = list(self.queue)
+            self.queue.clear()
+            for command in cancelled:
+                command.state = "failed"
+                command.error = "Motor queue stopped"
+                command.finished = time.time()
+            self.failed += len(cancelled)
+            running = self.current is not None
+        self._resolve(cancelled)
+        if running:
+            # Calls _done() through the completion callback
+            self.motor.stop()
+
+    def add_listener(self, listener):
+        """
+        Registers a function called with each command that finished successfully,
+        from the motor's completion callback. Listeners must return quickly.
+
+        Args:
+            listener (function): Called with the MotorCommand.
+
+        Returns:
+            None
+        """
+        self.listeners.append(listener)
+
+    def get(self, command_id):
+        """
+        Returns a recent command by ID.
+
+        Args:
+            command_id (int): The ID of the command.
+
+        Returns:
+            MotorCommand: The command, or None if it is unknown or too old.
+        """
+        with self.cv:
+            return self.commands.get(command_id)
+
+    def get_stats(self):
+        """
+        Returns the queue depth, counters and latency statistics.
+
+        Args:
+            None
+
+        Returns:
+            dict: The current and maximum depth, the mean depth seen by new commands,
+            the counters, and the queue wait and motor run time statistics in ms.
+        """
+        with self.cv:
+            queued = self.submitted - self.coalesced - self.rejected
+            return {
+                'depth': len(self.queue),
+                'max_depth': self.max_depth,
+                'max_seen_depth': self.max_seen_depth,
+                'mean_depth': round(self.depth_total / queued, 2) if queued else 0.0,
+                'running': self.current.to_dict() if self.current is not None else None,
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'rejected': self.rejected,
+                'failed': self.failed,
+                'wait': self.wait_time.to_dict(),
+                'run': self.run_time.to_dict()
+            }
+
+    def _start_next(self):
+        """
+        Starts the next queued command if the motor is idle. Must be called with the lock held.
+
+        Args:
+            None
+
+        Returns:
+            list: Commands that failed to start, whose futures must be resolved outside the lock.
+        """
+        failed = []
+        while self.current is None and self.queue:
+            command = self.queue.popleft()
+            command.state = "running"
+            command.started = time.time()
+            self.wait_time.record(command.started - command.submitted)
+            print(f"Running motor for {command.reason} feed of size {command.size}")
+            try:
+                self.motor.run(command.size * self.seconds_per_size, on_done=lambda command=command: self._done(command))
+                self.current = command
+                self.current_started = time.monotonic()
+            except Exception as e:
+                print("Motor error: " + str(e))
+                command.state = "failed"
+                command.error = str(e)
+                command.finished = time.time()
+                self.failed += 1
+                failed.append(command)
+        return failed
+
+    def _done(self, command):
+        """
+        Completion callback of the motor: records the finished command and starts the next one.
+
+        Args:
+            command (MotorCommand): The command that finished.
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.run_time.record(time.monotonic() - self.current_started)
+            command.state = "done"
+            command.finished = time.time()
+            self.current = None
+            finished = [command] + self._start_next()
+        for listener in self.listeners:
+            try:
+                listener(command)
+            except Exception as e:
+                print("Motor queue listener error: " + str(e))
+        self._resolve(finished)
+
+    def _resolve(self, commands):
+        for command in commands:
+            command.future.set_result(command)
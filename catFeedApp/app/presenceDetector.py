@@ -0,0 +1,238 @@
+"""
+Cat presence detection at the food bowl.
+
+A low rate analysis thread, separate from the live stream, samples the Y plane
+of the camera's lores stream, downsamples it with a strided view and compares
+it against a running background model using vectorized NumPy operations.
+Presence intervals are recorded to the database, giving eating durations
+without anybody watching the live stream.
+"""
+import datetime
+import threading
+import time
+import numpy as np
+
+from hardware.frameSources import SOURCE_LUMA
+
+class PresenceDetector:
+    """
+    Frame differencing presence detector with a selectively updated background model.
+
+    Pixels that differ from the background by more than the threshold are
+    foreground. The background only learns from non-foreground pixels, so a cat
+    sitting still at the bowl is not absorbed into it. The detector keeps its own
+    CPU use under a fixed fraction of one core by measuring the thread CPU time
+    of each sample and stretching the sample period when needed.
+
+    Attributes:
+        camera (PiCam.Camera): The camera to sample.
+        rate (float): Target samples per second.
+        cpu_budget (float): Maximum fraction of one CPU core the detector may use.
+        present (bool): True while the cat is considered present.
+        fraction (float): Foreground fraction of the region of interest in the last sample.
+    """
+    def __init__(self, app, camera, rate=2.0, cpu_budget=0.05, downsample=4, roi=None, threshold=25,
+                 min_fraction=0.02, enter_samples=3, exit_seconds=10, learning_rate=0.05):
+        """
+        Initializes the detector without starting it.
+
+        Args:
+            app (Flask): The Flask app, used for database access.
+            camera (PiCam.Camera): The camera to sample.
+            rate (float): Target samples per second.
+            cpu_budget (float): Maximum fraction of one CPU core the detector may use.
+            downsample (int): Only every n-th row and column of the lores frame is analysed.
+            roi (tuple): (x, y, width, height) of the bowl region as fractions of
+                the frame, or None for the whole frame.
+            threshold (int): Minimum difference from the background for a foreground pixel.
+            min_fraction (float): Foreground fraction of the region that means presence.
+            enter_samples (int): Consecutive samples above min_fraction to start presence.
+            exit_seconds (float): Time below min_fraction to end presence.
+            learning_rate (float): Rate at which the background follows the scene.
+
+        Returns:
+            None
+        """
+        self.app = app
+        self.camera = camera
+        self.rate = rate
+        self.cpu_budget = cpu_budget
+        self.downsample = downsample
+        self.roi = roi
+        self.threshold = threshold
+        self.min_fraction = min_fraction
+        self.enter_samples = enter_samples
+        self.exit_seconds = exit_seconds
+        self.learning_rate = learning_rate
+        self.present = False
+        self.fraction = 0.0
+        self.present_since = None
+        self.last_seen = None
+        self.above_count = 0
+        self.background = None
+        self.capture_buffer = None
+        self.running = False
+        self.thread = None
+        # Set by stop() to cut the wait between samples short
+        self.stopping = threading.Event()
+
+    def start(self):
+        """
+        Starts the detector thread. The thread holds the camera open while it runs.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self.running:
+            return
+        self.running = True
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stops the detector thread after its current sample and waits for it, so the
+        camera is released before it is closed.
+
+        Args:
+            timeout (float): Maximum time to wait for the thread to exit in seconds.
+
+        Returns:
+            None
+        """
+        self.running = False
+        self.stopping.set()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    def _allocate(self, shape):
+        """
+        Allocates the background model and work buffers for a frame shape.
+
+        Args:
+            shape (tuple): The shape of the downsampled frame.
+
+        Returns:
+            None
+        """
+        self.background = None
+        self.diff = np.empty(shape, dtype=np.float32)
+        self.magnitude = np.empty(shape, dtype=np.float32)
+        self.foreground = np.empty(shape, dtype=bool)
+        self.background_mask = np.empty(shape, dtype=bool)
+        height, width = shape
+        if self.roi is None:
+            self.roi_slice = (slice(None), slice(None))
+        else:
+            x, y, w, h = self.roi
+            self.roi_slice = (slice(int(y * height), max(int((y + h) * height), int(y * height) + 1)),
+                              slice(int(x * width), max(int((x + w) * width), int(x * width) + 1)))
+
+    def analyse(self, luma):
+        """
+        Updates the background model with a frame and returns the foreground fraction.
+
+        Args:
+            luma (numpy.ndarray): The 8-bit grayscale frame.
+
+        Returns:
+            float: The foreground fraction of the region of interest.
+        """
+        # Strided view, no copy
+        small = luma[::self.downsample, ::self.downsample]
+        if self.background is None or self.background.shape != small.shape:
+            self._allocate(small.shape)
+            self.background = small.astype(np.float32)
+            return 0.0
+        np.subtract(small, self.background, out=self.diff)
+        np.abs(self.diff, out=self.magnitude)
+        np.greater(self.magnitude, self.threshold, out=self.foreground)
+        if self.foreground.mean() > 0.9:
+            # A global change such as the lights turning on: restart the model
+            self.background[...] = small
+            return 0.0
+        # Only background pixels are learned, so a still cat is not absorbed
+        np.logical_not(self.foreground, out=self.background_mask)
+        self.diff *= self.learning_rate
+        np.add(self.background, self.diff, out=self.background, where=self.background_mask)
+        return float(self.foreground[self.roi_slice].mean())
+
+    def _update_presence(self, fraction, now):
+        """
+        Applies hysteresis to the foreground fraction and records finished presence intervals.
+
+        Args:
+            fraction (float): The foreground fraction of the latest sample.
+            now (datetime.datetime): The time of the sample.
+
+        Returns:
+            None
+        """
+        if fraction >= self.min_fraction:
+            self.above_count += 1
+            self.last_seen = now
+            if not self.present and self.above_count >= self.enter_samples:
+                self.present = True
+                self.present_since = now
+                print("Cat detected at the bowl")
+        else:
+            self.above_count = 0
+            if self.present and (now - self.last_seen).total_seconds() >= self.exit_seconds:
+                self.present = False
+                self._record(self.present_since, self.last_seen)
+
+    def _record(self, start, end):
+        """
+        Records a presence interval to the database.
+
+        Args:
+            start (datetime.datetime): When the cat arrived.
+            end (datetime.datetime): When the cat was last seen.
+
+        Returns:
+            None
+        """
+        from app import db
+        from app.models import Presence
+        duration = (end - start).total_seconds()
+        print(f"Cat left the bowl after {duration:.0f} seconds")
+        with self.app.app_context():
+            db.session.add(Presence(date=start.strftime("%Y-%m-%d"), start=start.strftime("%H:%M:%S"),
+                                    end=end.strftime("%H:%M:%S"), duration=duration))
+            db.session.commit()
+
+    def _run(self):
+        """
+        Detector loop: samples the lores stream at the target rate, within the CPU budget.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        print("Starting presence detector")
+        self.camera.acquire()
+        try:
+            while self.running:
+                started = time.monotonic()
+                cpu_started = time.thread_time()
+                try:
+                    # Capture into the same buffer every sample
+                    self.capture_buffer = self.camera.capture(SOURCE_LUMA, "lores", out=self.capture_buffer)
+                    self.fraction = self.analyse(self.capture_buffer)
+                    self._update_presence(self.fraction, datetime.datetime.now())
+                except Exception as e:
+                    print("Presence detector error: " + str(e))
+                # Stretch the period if this sample used more than the CPU budget
+                cpu_used = time.thread_time() - cpu_started
+                period = max(1.0 / self.rate, cpu_used / self.cpu_budget)
+                self.stopping.wait(max(0.0, started + period - time.monotonic()))
+        finally:
+            self.camera.release()
+            print("Stopped presence detector")
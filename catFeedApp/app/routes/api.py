@@ -2,15 +2,40 @@ from flask import(
     Blueprint, Flask, render_template, Response, request, jsonify, redirect, url_for, session
 )
 from functools import wraps
-from app import get_db, get_camera, get_motor, get_distance_sensor
+from app import trigger_feed, get_motor_queue, get_db, get_camera, get_stream, get_segment_stream, get_feed_scheduler, get_task_telemetry, get_presence_detector, get_distance_sampler, get_level_history, get_consumption_model
 from .auth import login_required
-from app.models import Feeding, FeedTime
-import time, threading, cv2
-
-from hardware import DCMotor, distanceSensor
+from app.configuration import HardwareConfig as hwConfig
+from app.models import Feeding, FeedTime, Presence
+from app.consumptionModel import daily_feed_counts
+from app.videoStream import FRAME_HEADER, FRAME_TRAILER
+import time
+import concurrent.futures
 
 bp = Blueprint('api', __name__, url_prefix='/api')
-camera_mode = 0
+
+def parseFeedSize(value):
+    """
+    Validates a feed size from a request.
+
+    Parameters:
+        value: The size from the JSON request.
+
+    Returns:
+        The size as an int, or None unless it is an integer from 1 to the largest portion
+        the motor queue dispenses.
+    """
+    if isinstance(value, bool):
+        return None
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return None
+    if size != value and str(size) != str(value).strip():
+        # Reject fractions such as 2.5 or "2.5"
+        return None
+    if size < 1 or size > hwConfig.MOTOR_QUEUE["MAX_PORTION"]:
+        return None
+    return size
 
 @bp.route("/getFeedingTimes", methods=['GET'])
 @login_required
@@ -52,6 +77,38 @@ def getFeedTimes():
     print(feed_times_list)
     return jsonify({'feed_times': feed_times_list})
 
+@bp.route("/getUpcomingFeeds", methods=['GET'])
+@login_required
+def getUpcomingFeeds():
+    """
+    API endpoint to get the upcoming scheduled feeds from the feed scheduler's index.
+
+    Parameters:
+        None
+
+    Returns:
+        A JSON object containing the upcoming feeds within the next day, soonest first.
+    """
+    scheduler = get_feed_scheduler()
+    if scheduler is None:
+        return Response("Feed scheduler not enabled", status=404)
+    return jsonify({'upcoming_feeds': [occurrence.to_dict() for occurrence in scheduler.upcoming()]})
+
+@bp.route("/getTaskStats", methods=['GET'])
+@login_required
+def getTaskStats():
+    """
+    API endpoint to get the telemetry of the periodic tasks and the feed scheduler.
+
+    Parameters:
+        None
+
+    Returns:
+        A JSON object with, per task, the run count, overruns, exceptions, last error and
+        the run duration and start drift percentiles and histograms in milliseconds.
+    """
+    return jsonify(get_task_telemetry().to_dict())
+
 @bp.route("/videoFeed")
 @login_required
 def videoFeed():
@@ -64,73 +121,196 @@ def videoFeed():
     Returns:
         A response object containing the live video feed.
     """
-    if get_camera() is None:
+    stream = get_stream()
+    if stream is None:
         # Return an error message
         return Response("Camera not found", status=500)
     print("Starting live video feed")
-    return Response(gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+    # Every viewer shares the frames encoded by the single broadcaster thread
+    return Response(stream.gen_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
 
-# Initialize camera using libcamera (OpenCV interface)
+# Maximum time a viewer request waits for a segment that is still being encoded
+SEGMENT_WAIT_SECONDS = 10
 
-def processFrame(frame_raw, setting):
+@bp.route("/hls/stream.m3u8", methods=['GET'])
+@login_required
+def hlsPlaylist():
     """
-    Processes the raw frame and returns the processed frame.
-    
+    API endpoint to get the HLS playlist of the H.264 live stream.
+
+    Requesting the playlist starts the shared encoder, and keeps it running
+    while viewers keep polling. The first request waits for the first segment.
+
     Parameters:
-        frame_raw: the raw frame
-        setting: the processing setting
-        
+        None
+
     Returns:
-        the processed frame
-    """
-    if setting == 0:
-        # Convert the frame to grayscale
-        gray = cv2.cvtColor(frame_raw, cv2.COLOR_BGR2GRAY)
-        return gray 
-    if setting == 1:
-        # Convert the frame to YUV
-        frame_yuv = cv2.cvtColor(frame_raw, cv2.COLOR_BGR2YUV)
-        frame_y = frame_yuv[:, :, 0]
-        frame_y_bilateral = cv2.bilateralFilter(frame_y, 5, 150, 150)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        frame_processed = clahe.apply(frame_y_bilateral)
-        return frame_processed
-    if setting == 2:
-        # Convert the frame to RGB
-        rgb = cv2.cvtColor(frame_raw, cv2.COLOR_BGR2RGB)
-        return rgb
-
-def gen_frames():
-    """
-    Generates frames for the live video feed.
-    
+        The live media playlist.
+    """
+    segments = get_segment_stream()
+    if segments is None:
+        return Response("H.264 streaming not enabled", status=404)
+    segments.touch()
+    playlist = segments.cache.playlist(segments.segment_seconds, timeout=SEGMENT_WAIT_SECONDS)
+    if playlist is None:
+        return Response("No segment available", status=503)
+    response = Response(playlist, mimetype='application/vnd.apple.mpegurl')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@bp.route("/hls/init/<int:epoch>.mp4", methods=['GET'])
+@login_required
+def hlsInit(epoch):
+    """
+    API endpoint to get the initialization segment of an H.264 encoder run.
+
+    Parameters:
+        epoch (int): The encoder run named in the playlist.
+
+    Returns:
+        The fragmented MP4 initialization segment.
+    """
+    segments = get_segment_stream()
+    if segments is None:
+        return Response("H.264 streaming not enabled", status=404)
+    data = segments.cache.get_init(epoch)
+    if data is None:
+        return Response("Segment not found", status=404)
+    return Response(data, mimetype='video/mp4')
+
+@bp.route("/hls/segment/<int:sequence>.m4s", methods=['GET'])
+@login_required
+def hlsSegment(sequence):
+    """
+    API endpoint to get a media segment of the H.264 live stream from the segment cache.
+
+    Parameters:
+        sequence (int): The sequence number named in the playlist.
+
+    Returns:
+        The fragmented MP4 media segment.
+    """
+    segments = get_segment_stream()
+    if segments is None:
+        return Response("H.264 streaming not enabled", status=404)
+    segments.touch()
+    data = segments.cache.get_segment(sequence, timeout=SEGMENT_WAIT_SECONDS)
+    if data is None:
+        return Response("Segment not found", status=404)
+    # Segments never change once published
+    response = Response(data, mimetype='video/iso.segment')
+    response.headers['Cache-Control'] = 'max-age=60'
+    return response
+
+@bp.route("/getSegmentStats", methods=['GET'])
+@login_required
+def getSegmentStats():
+    """
+    API endpoint to get the state of the H.264 encoder and its segment cache.
+
     Parameters:
         None
-    
+
     Returns:
-        A response object containing the live video feed.
+        A JSON object containing the encoder settings and the cache occupancy.
     """
-    global camera_mode
-    print("Generating frames. Camera mode: " + str(camera_mode))
-    try:
-        cam = get_camera()
-        # Start the camera feed
-        while True:
-            # Capture the raw frame from the Pi Camera
-            frame_raw = cam.camera.capture_array()
-            # TODO: Configurable rotation
-            frame_raw = cv2.flip(frame_raw, 0)
-            # Perform processing
-            frame_processed = processFrame(frame_raw, camera_mode)
-            # Convert the processed and rotated frame to a JPEG image
-            _, jpeg = cv2.imencode('.jpg', frame_processed)
-            # Convert the JPEG image to bytes
-            frame = jpeg.tobytes()
-            # Yield the frame in MJPEG format
-            yield (b'--frame\r\n'
-                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-    except Exception as e:
-        print(e)
+    segments = get_segment_stream()
+    if segments is None:
+        return Response("H.264 streaming not enabled", status=404)
+    return jsonify(segments.get_stats())
+
+@bp.route("/snapshot", methods=['GET'])
+@login_required
+def snapshot():
+    """
+    API endpoint to get a single still image from the camera.
+
+    The most recently encoded live stream frame is served from memory, tagged
+    with an ETag derived from its frame sequence number. Requests whose
+    If-None-Match matches the current frame get a 304 without a body.
+
+    Parameters:
+        None
+
+    Returns:
+        A JPEG image, or a 304 response if the client already has the current frame.
+    """
+    stream = get_stream()
+    if stream is None:
+        # Return an error message
+        return Response("Camera not found", status=500)
+    sequence, frame = stream.snapshot()
+    if frame is None:
+        return Response("No frame available", status=503)
+    etag = stream.snapshot_etag(sequence)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        # Strip the multipart framing from the cached chunk
+        jpeg = memoryview(frame)[len(FRAME_HEADER):len(frame) - len(FRAME_TRAILER)]
+        response = Response(bytes(jpeg), mimetype='image/jpeg')
+    response.set_etag(etag)
+    # Let clients keep the image but always revalidate it
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@bp.route("/getPipelineStats", methods=['GET'])
+@login_required
+def getPipelineStats():
+    """
+    API endpoint to get the per-stage timing of the current frame processing pipeline.
+
+    Parameters:
+        None
+
+    Returns:
+        A JSON object containing the camera mode, pipeline name and stage timings.
+    """
+    stream = get_stream()
+    if stream is None:
+        # Return an error message
+        return Response("Camera not found", status=500)
+    return jsonify(stream.get_stats())
+
+@bp.route("/getStreamStats", methods=['GET'])
+@login_required
+def getStreamStats():
+    """
+    API endpoint to get the live stream's frame rate and per-stage latency.
+
+    Parameters:
+        None
+
+    Returns:
+        A JSON object containing the achieved fps and the p50/p90/p99 durations of
+        capture, processing, encoding, socket writes and end-to-end latency, per
+        camera mode and resolution.
+    """
+    stream = get_stream()
+    if stream is None:
+        # Return an error message
+        return Response("Camera not found", status=500)
+    return jsonify(stream.get_frame_stats())
+
+@bp.route("/toggleStatsOverlay", methods=['POST'])
+@login_required
+def toggleStatsOverlay():
+    """
+    API endpoint to toggle burning the frame rate and latency into the live view.
+
+    Parameters:
+        None
+
+    Returns:
+        A JSON object containing the new overlay state.
+    """
+    stream = get_stream()
+    if stream is None:
+        # Return an error message
+        return Response("Camera not found", status=500)
+    stream.stats_overlay = not stream.stats_overlay
+    return jsonify({'overlay': stream.stats_overlay})
 
 @bp.route("/manualFeed", methods=['POST'])
 @login_required
@@ -142,31 +322,79 @@ def manualFeed():
         None
     
     Returns:
-        A response object containing the result of the manual feed.
+        A JSON object describing the queued motor command, whose ID can be polled
+        with /api/getMotorCommand/<id>.
     """
     if request.method == 'POST':
-        m = get_motor()
         db = get_db()
-        if m is None:
+        if get_motor_queue() is None:
             # Return an error message
             return Response("Motor not configured or not found", status=500)
         # Parse the JSON response
         data = request.get_json()
-        print(data)
-        # Get the time and type from the JSON response
-        size = data['size']
-        if size is None:
-            return Response("error, no size parameter for manual feed", status=500)
-        sizeInt = int(size)
-        # Run the motor in a separate thread and return a success response immediately
-        t1 = threading.Thread(target=m.forward, args=(sizeInt*3,)).start()
+        # Get the size from the JSON response
+        sizeInt = parseFeedSize(data.get('size'))
+        if sizeInt is None:
+            return Response(f"error, size must be an integer from 1 to {hwConfig.MOTOR_QUEUE['MAX_PORTION']}", status=400)
+        # Queue the feed for the motor worker, which may merge it with a waiting manual feed,
+        # and record the cat coming to the bowl
+        command = trigger_feed(sizeInt, "manual")
+        if command is None:
+            return Response("Too many feeds queued, try again later", status=503)
         # Add the feed record to the database
         new_feeding = Feeding(time = time.strftime("%H:%M"), type = 0, date = time.strftime("%Y-%m-%d"), size = sizeInt)
         db.session.add(new_feeding)
         db.session.commit()
-        return Response("Success", status=200)
+        return jsonify(command.to_dict())
     else:
         return Response("Error", status=500)
+
+# Maximum time a poll waits for a queued feed to finish
+MOTOR_WAIT_SECONDS = 30
+
+@bp.route("/getMotorCommand/<int:command_id>", methods=['GET'])
+@login_required
+def getMotorCommand(command_id):
+    """
+    API endpoint to poll the state of a queued feed.
+
+    Parameters:
+        command_id (int): The ID returned by /api/manualFeed.
+        wait (float): Optional query parameter, seconds to wait for the feed to finish.
+
+    Returns:
+        A JSON object describing the motor command.
+    """
+    motor_queue = get_motor_queue()
+    if motor_queue is None:
+        return Response("Motor not configured or not found", status=500)
+    command = motor_queue.get(command_id)
+    if command is None:
+        return Response("Unknown motor command", status=404)
+    wait = min(request.args.get('wait', 0, type=float), MOTOR_WAIT_SECONDS)
+    if wait > 0:
+        try:
+            command.future.result(timeout=wait)
+        except concurrent.futures.TimeoutError:
+            pass
+    return jsonify(command.to_dict())
+
+@bp.route("/getMotorStats", methods=['GET'])
+@login_required
+def getMotorStats():
+    """
+    API endpoint to get the motor queue depth, counters and latency statistics.
+
+    Parameters:
+        None
+
+    Returns:
+        A JSON object containing the motor queue statistics.
+    """
+    motor_queue = get_motor_queue()
+    if motor_queue is None:
+        return Response("Motor not configured or not found", status=500)
+    return jsonify(motor_queue.get_stats())
     
 @bp.route("/toggleCamera", methods=['POST'])
 @login_required
@@ -181,20 +409,66 @@ def toggleCamera():
         A response object containing the result of the camera toggle.
     """
     if request.method == 'POST':
-        cam = get_camera()
-        if cam is None:
+        stream = get_stream()
+        if stream is None:
             # Return an error message
             return Response("Camera not found", status=500)
-        global camera_mode
-        if camera_mode + 1 > 2:
-            camera_mode = 0
-        else:
-            camera_mode += 1
-        print(camera_mode)
+        stream.set_mode(stream.mode + 1)
+        print(stream.mode)
         return Response("Success", status=200)
     else:
         return Response("Error", status=500)
 
+@bp.route("/getResolutions", methods=['GET'])
+@login_required
+def getResolutions():
+    """
+    API endpoint to get the current camera resolution and the resolutions it can be switched to.
+
+    Parameters:
+        None
+
+    Returns:
+        A JSON object containing the current and allowed resolutions as [width, height].
+    """
+    camera = get_camera()
+    if camera is None:
+        # Return an error message
+        return Response("Camera not found", status=500)
+    return jsonify({'resolution': list(camera.res), 'resolutions': [list(r) for r in camera.allowed_resolutions()]})
+
+@bp.route("/setResolution", methods=['POST'])
+@login_required
+def setResolution():
+    """
+    API endpoint to switch the camera resolution while the live stream is running.
+
+    Connected viewers keep their stream and receive frames at the new
+    resolution from the next frame on.
+
+    Parameters:
+        None
+
+    Returns:
+        A response object containing the result of the resolution change.
+    """
+    camera = get_camera()
+    if camera is None:
+        # Return an error message
+        return Response("Camera not found", status=500)
+    data = request.get_json()
+    if data is None or data.get('width') is None or data.get('height') is None:
+        return Response("error, no width or height parameter", status=400)
+    try:
+        resolution = (int(data['width']), int(data['height']))
+    except (ValueError, TypeError):
+        return Response("error, width and height must be integers", status=400)
+    if resolution not in camera.allowed_resolutions():
+        return Response("error, resolution not allowed", status=400)
+    if not camera.setResolution(resolution):
+        return Response("error, the camera is busy with a hardware encoder", status=409)
+    return Response("Success", status=200)
+
 @bp.route("/addFeedTime", methods=['POST'])
 @login_required
 def addFeedTime():
@@ -219,15 +493,18 @@ def addFeedTime():
         if type is None:
             return Response("error, no type parameter", status=500)
         typeInt = int(type)
-        size = data['size']
-        if size is None:
-            return Response("error, no size parameter", status=500)
-        sizeInt = int(size)
+        sizeInt = parseFeedSize(data.get('size'))
+        if sizeInt is None:
+            return Response(f"error, size must be an integer from 1 to {hwConfig.MOTOR_QUEUE['MAX_PORTION']}", status=400)
         # Add the feed time record to the database
         new_feedtime = FeedTime(time = timeStr, type = typeInt, size = sizeInt)
         db = get_db()
         db.session.add(new_feedtime)
         db.session.commit()
+        # Let the scheduler pick up the new feed time
+        scheduler = get_feed_scheduler()
+        if scheduler is not None:
+            scheduler.invalidate()
         return Response("Success", status=200)
     
 @bp.route("/deleteFeedTime", methods=['POST'])
@@ -255,31 +532,90 @@ def deleteFeedTime():
         db = get_db()
         db.session.delete(feedtime)
         db.session.commit()
+        # Drop the deleted feed time from the scheduler's index
+        scheduler = get_feed_scheduler()
+        if scheduler is not None:
+            scheduler.invalidate()
         return Response("Success", status=200)
     
+# Maximum time a request waits for a fresh distance reading
+DISTANCE_WAIT_SECONDS = 2
+
 @bp.route("/getDistance", methods=['GET'])
 @login_required
 def getDistance():
     """
-    Returns the distance reading from the food distance sensor. If the sensor is not
-    initialized or enabled, an error message is returned.
+    Returns the latest filtered reading of the food distance sensor. If the sensor is not
+    initialized or enabled, or has no valid reading yet, an error message is returned.
     
     Parameters:
-        None
+        fresh (bool): Optional query parameter, wait for a new ping instead of
+            returning the latest reading.
     
     Returns:
         A JSON object containing the distance reading.
     """
-    sens = get_distance_sensor()
-    if sens is None:
+    sampler = get_distance_sampler()
+    if sampler is None:
         # Return an error message if the food distance sensor is not initialized or not enabled
         return jsonify({'distance': "Sensor not available"})
-    distance_percent = sens.getReading_percent()
-    # Round to the nearest 5%
-    distance_percent = round(distance_percent/20)*20
-    print(distance_percent)
+    if request.args.get('fresh', 'false').lower() in ('1', 'true'):
+        reading = sampler.read_fresh(timeout=DISTANCE_WAIT_SECONDS)
+    else:
+        reading = sampler.get_reading()
+    if reading is None:
+        return jsonify({'distance': "Sensor not available"})
+    # Round to the nearest 20%
+    distance_percent = round(reading['percent']/20)*20
     return jsonify({'distance': distance_percent})
 
+# Upper bound on the points of a level history query
+LEVEL_HISTORY_MAX_POINTS = 2000
+
+@bp.route("/getLevelHistory", methods=['GET'])
+@login_required
+def getLevelHistory():
+    """
+    API endpoint to get the hopper level over a time range, downsampled for charting.
+    
+    Parameters:
+        start (float): Optional query parameter, Unix time of the start of the range. Defaults to a day ago.
+        end (float): Optional query parameter, Unix time of the end of the range. Defaults to now.
+        points (int): Optional query parameter, the maximum number of points. Defaults to 200.
+    
+    Returns:
+        A JSON object with the resolution of the series in seconds (0 for raw readings) and
+        the points as [time, min, avg, max] distance readings in mm, oldest first.
+    """
+    history = get_level_history()
+    if history is None:
+        return Response("Level history not enabled", status=404)
+    end = request.args.get('end', time.time(), type=float)
+    start = request.args.get('start', end - 24 * 60 * 60, type=float)
+    points = min(max(request.args.get('points', 200, type=int), 1), LEVEL_HISTORY_MAX_POINTS)
+    if start >= end:
+        return Response("start must be before end", status=400)
+    return jsonify(history.query(start, end, points))
+
+@bp.route("/getForecast", methods=['GET'])
+@login_required
+def getForecast():
+    """
+    API endpoint to get the fitted food consumption rates and the time-to-empty forecast.
+    
+    Parameters:
+        None
+    
+    Returns:
+        A JSON object with the food remaining, the drain rate, the grams dispensed per feed
+        and per second for each feed size, the grams eaten per day with the current feed
+        schedule, and the hours until the hopper is empty. Values not fitted yet are null.
+    """
+    model = get_consumption_model()
+    if model is None:
+        return Response("Consumption model not enabled", status=404)
+    return jsonify(model.forecast(daily_feed_counts(FeedTime.query.all(), model.max_size)))
+
 @bp.route("/getLastFeed", methods=['GET'])
 @login_required
 def getLastFeed():
@@ -300,3 +636,23 @@ def getLastFeed():
     print(last_feed)
     return jsonify({'last_feed': last_feed})
 
+@bp.route("/getPresence", methods=['GET'])
+@login_required
+def getPresence():
+    """
+    API endpoint to get the recorded intervals the cat spent at the bowl, and
+    whether the cat is at the bowl right now.
+    
+    Parameters:
+        None
+    
+    Returns:
+        A JSON object containing the presence intervals, most recent first.
+    """
+    intervals = Presence.query.order_by(Presence.date.desc(), Presence.start.desc()).limit(50).all()
+    intervals_list = []
+    for interval in intervals:
+        intervals_list.append((interval.date, interval.start, interval.end, interval.duration))
+    detector = get_presence_detector()
+    present = detector.present if detector is not None else None
+    return jsonify({'present': present, 'intervals': intervals_list})
@@ -0,0 +1,692 @@
+"""
+H.264 segmented live streaming (HLS with fragmented MP4 segments).
+
+A single encoder thread encodes a camera stream to H.264, either with the
+picamera2 hardware encoder or with libx264 through PyAV, and muxes it into
+fragmented MP4 with one fragment per keyframe interval. The fragments are
+kept in a bounded in-memory segment cache and served to any number of viewers
+as an HLS playlist, so every viewer shares the one encode and a viewer only
+costs the HTTP requests for the segments. The encoder runs while viewers keep
+requesting the playlist and stops once they have been gone for a while.
+
+The MJPEG stream of videoStream stays available as the fallback for clients
+without HLS support.
+"""
+from collections import deque
+from fractions import Fraction
+import math
+import struct
+import threading
+import time
+
+from hardware.frameSources import SOURCE_YUV420
+
+# Time base of the packets passed to the muxer, in seconds per tick
+TIME_BASE = Fraction(1, 90000)
+# Muxer options producing a fragment, and so a segment, per keyframe. Each
+# packet is flushed immediately so a fragment is emitted as soon as it is complete
+MP4_OPTIONS = {
+    'movflags': 'frag_keyframe+empty_moov+default_base_moof',
+    'flush_packets': '1'
+}
+# Box types belonging to the initialization segment
+INIT_BOXES = (b'ftyp', b'moov')
+# How often an idle encoder checks whether its viewers have gone, in seconds
+IDLE_POLL_SECONDS = 1.0
+
+class SegmentCache:
+    """
+    Bounded in-memory cache of the most recent media segments, shared by all viewers.
+
+    Segments are numbered with a sequence number that keeps increasing across
+    encoder restarts. Each encoder run is an epoch with its own initialization
+    segment; starting a new epoch drops the segments of the previous one.
+
+    Attributes:
+        max_segments (int): Maximum number of segments kept.
+        max_bytes (int): Maximum total size of the segments kept.
+        epoch (int): The current encoder run.
+        init (bytes): The initialization segment of the current epoch, or None.
+        segments (collections.deque): (sequence, duration, data) of the cached segments, oldest first.
+    """
+    def __init__(self, max_segments=6, max_bytes=16 * 1024 * 1024):
+        """
+        Initializes an empty cache.
+
+        Args:
+            max_segments (int): Maximum number of segments kept.
+            max_bytes (int): Maximum total size of the segments kept.
+
+        Returns:
+            None
+        """
+        self.max_segments = max_segments
+        self.max_bytes = max_bytes
+        self.cv = threading.Condition()
+        self.epoch = 0
+        self.init = None
+        self.segments = deque()
+        self.bytes = 0
+        self.next_sequence = 0
+        # The sequence number of the first segment of the current epoch
+        self.epoch_start = 0
+
+    def begin(self):
+        """
+        Starts a new epoch, dropping the initialization segment and the segments of the previous one.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.epoch += 1
+            self.epoch_start = self.next_sequence
+            self.init = None
+            self.segments.clear()
+            self.bytes = 0
+            self.cv.notify_all()
+
+    def set_init(self, epoch, data):
+        """
+        Stores the initialization segment of the current epoch.
+
+        Args:
+            epoch (int): The epoch the segment was encoded in.
+            data (bytes): The ftyp and moov boxes.
+
+        Returns:
+            None
+        """
+        with self.cv:
+            if epoch != self.epoch:
+                return
+            self.init = data
+            self.cv.notify_all()
+
+    def add_segment(self, epoch, duration, data):
+        """
+        Adds a media segment, evicting the oldest segments beyond the limits.
+        Segments flushed by the encoder of a previous epoch are dropped.
+
+        Args:
+            epoch (int): The epoch the segment was encoded in.
+            duration (float): The duration of the segment in seconds.
+            data (bytes): The moof and mdat boxes.
+
+        Returns:
+            int: The sequence number of the segment, or None if it was dropped.
+        """
+        with self.cv:
+            if epoch != self.epoch:
+                return None
+            sequence = self.next_sequence
+            self.next_sequence += 1
+            self.segments.append((sequence, duration, data))
+            self.bytes += len(data)
+            # Always keep the newest segment, even if it alone exceeds the byte limit
+            while len(self.segments) > 1 and (len(self.segments) > self.max_segments or self.bytes > self.max_bytes):
+                self.bytes -= len(self.segments.popleft()[2])
+            self.cv.notify_all()
+            return sequence
+
+    def get_init(self, epoch):
+        """
+        Returns the initialization segment of an epoch.
+
+        Args:
+            epoch (int): The epoch named in the playlist.
+
+        Returns:
+            bytes: The initialization segment, or None if the epoch is not current.
+        """
+        with self.cv:
+            return self.init if epoch == self.epoch else None
+
+    def get_segment(self, sequence, timeout=0):
+        """
+        Returns a cached segment, waiting for it if it has not been produced yet.
+
+        Args:
+            sequence (int): The sequence number of the segment.
+            timeout (float): Maximum time to wait for a segment that is still being encoded.
+
+        Returns:
+            bytes: The segment, or None if it was evicted or did not arrive in time.
+        """
+        with self.cv:
+            # Only wait for the segment being encoded, not for arbitrary future ones
+            if sequence == self.next_sequence:
+                self.cv.wait_for(lambda: self.next_sequence > sequence, timeout)
+            if not self.segments:
+                return None
+            index = sequence - self.segments[0][0]
+            if 0 <= index < len(self.segments):
+                return self.segments[index][2]
+            return None
+
+    def playlist(self, target_duration, timeout=0):
+        """
+        Builds the live HLS media playlist of the cached segments.
+
+        Args:
+            target_duration (float): The nominal segment duration.
+            timeout (float): Maximum time to wait for the first segment of an epoch.
+
+        Returns:
+            str: The playlist, or None if no segment arrived in time.
+        """
+        with self.cv:
+            if not self.cv.wait_for(lambda: self.segments and self.init is not None, timeout):
+                return None
+            longest = max(duration for _, duration, _ in self.segments)
+            # Every epoch after the first starts with a discontinuity, marked on its first
+            # segment while that is listed and counted by the discontinuity sequence after
+            discontinuity = self.epoch > 1 and self.segments[0][0] == self.epoch_start
+            lines = [
+                "#EXTM3U",
+                "#EXT-X-VERSION:7",
+                f"#EXT-X-TARGETDURATION:{math.ceil(max(target_duration, longest))}",
+                f"#EXT-X-MEDIA-SEQUENCE:{self.segments[0][0]}",
+                f"#EXT-X-DISCONTINUITY-SEQUENCE:{self.epoch - 1 - int(discontinuity)}"
+            ]
+            if discontinuity:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines.append(f'#EXT-X-MAP:URI="init/{self.epoch}.mp4"')
+            for sequence, duration, _ in self.segments:
+                lines.append(f"#EXTINF:{duration:.3f},")
+                lines.append(f"segment/{sequence}.m4s")
+            return "\n".join(lines) + "\n"
+
+    def get_stats(self):
+        """
+        Returns the cache occupancy.
+
+        Args:
+            None
+
+        Returns:
+            dict: The epoch, segment count and bytes, and the sequence range.
+        """
+        with self.cv:
+            return {
+                'epoch': self.epoch,
+                'segments': len(self.segments),
+                'bytes': self.bytes,
+                'first_sequence': self.segments[0][0] if self.segments else None,
+                'next_sequence': self.next_sequence
+            }
+
+class Fmp4Splitter:
+    """
+    Write-only file object that splits the fragmented MP4 written by the muxer
+    into the initialization segment and one media segment per fragment.
+
+    The producer calls mark() with the presentation time of each packet before
+    muxing it. A fragment is flushed when the keyframe starting the next one is
+    muxed, so the marked time then is the end of the fragment.
+    """
+    def __init__(self, cache):
+        """
+        Initializes the splitter for the cache's current epoch.
+
+        Args:
+            cache (SegmentCache): The cache the segments are added to.
+
+        Returns:
+            None
+        """
+        self.cache = cache
+        self.epoch = cache.epoch
+        self.pending = bytearray()
+        self.init = []
+        self.fragment = []
+        self.time = 0.0
+        self.segment_start = None
+
+    def mark(self, seconds):
+        """
+        Records the presentation time of the packet about to be muxed.
+
+        Args:
+            seconds (float): The presentation time in seconds.
+
+        Returns:
+            None
+        """
+        self.time = seconds
+        if self.segment_start is None:
+            self.segment_start = seconds
+
+    def write(self, data):
+        """
+        Receives muxer output and emits every complete top-level box.
+
+        Args:
+            data: A buffer-protocol object.
+
+        Returns:
+            int: The number of bytes consumed.
+        """
+        self.pending += data
+        offset = 0
+        while len(self.pending) - offset >= 8:
+            size, box_type = struct.unpack_from('>I4s', self.pending, offset)
+            header = 8
+            if size == 1:
+                if len(self.pending) - offset < 16:
+                    break
+                size = struct.unpack_from('>Q', self.pending, offset + 8)[0]
+                header = 16
+            if size < header:
+                raise ValueError(f"Invalid MP4 box size {size}")
+            if len(self.pending) - offset < size:
+                break
+            self._box(box_type, bytes(self.pending[offset:offset + size]))
+            offset += size
+        del self.pending[:offset]
+        return len(data)
+
+    def _box(self, box_type, box):
+        """
+        Sorts a complete box into the initialization segment or the current fragment.
+
+        Args:
+            box_type (bytes): The four character box type.
+            box (bytes): The whole box.
+
+        Returns:
+            None
+        """
+        if box_type in INIT_BOXES:
+            self.init.append(box)
+            if box_type == b'moov':
+                self.cache.set_init(self.epoch, b''.join(self.init))
+                self.init = []
+        elif box_type == b'mfra':
+            # Random access index written with the trailer, not needed for streaming
+            return
+        else:
+            self.fragment.append(box)
+            if box_type == b'mdat':
+                duration = self.time - self.segment_start if self.segment_start is not None else 0.0
+                self.cache.add_segment(self.epoch, duration, b''.join(self.fragment))
+                self.fragment = []
+                self.segment_start = self.time
+
+    def flush(self):
+        """
+        Nothing is buffered beyond incomplete boxes, which cannot be emitted yet.
+        """
+
+class SegmentStreamer:
+    """
+    Base class for the H.264 segment encoders.
+
+    Subclasses implement _encode(), which encodes until _stop_if_idle() returns
+    True. The encoder is started by the first viewer request and runs until no
+    viewer has requested anything for idle_seconds.
+
+    Attributes:
+        name (str): The name of the backend in SEGMENT_STREAMERS.
+        hardware (bool): True if the backend uses the picamera2 hardware encoder.
+        camera (PiCam.Camera): The camera to encode from.
+        cache (SegmentCache): The cache the segments are served from.
+        stream (str): The camera stream to encode ("main" or "lores").
+        fps (float): The nominal frame rate.
+        segment_seconds (float): The nominal segment duration.
+        bitrate (int): The target bitrate in bits per second.
+        idle_seconds (float): Time without viewer requests before the encoder stops.
+    """
+    name = "base"
+    hardware = False
+
+    def __init__(self, camera, cache, stream="main", fps=15, segment_seconds=2, bitrate=2000000, idle_seconds=30):
+        """
+        Initializes the streamer without starting it.
+
+        Args:
+            camera (PiCam.Camera): The camera to encode from.
+            cache (SegmentCache): The cache the segments are served from.
+            stream (str): The camera stream to encode ("main" or "lores").
+            fps (float): The nominal frame rate.
+            segment_seconds (float): The nominal segment duration.
+            bitrate (int): The target bitrate in bits per second.
+            idle_seconds (float): Time without viewer requests before the encoder stops.
+
+        Returns:
+            None
+        """
+        import av
+        self.av = av
+        self.camera = camera
+        self.cache = cache
+        self.stream = stream
+        self.fps = fps
+        self.segment_seconds = segment_seconds
+        self.bitrate = bitrate
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+        self.last_request = 0.0
+
+    def gop_size(self):
+        """
+        Returns the keyframe interval in frames, which is also the segment length.
+
+        Args:
+            None
+
+        Returns:
+            int: Frames per keyframe interval.
+        """
+        return max(1, int(round(self.fps * self.segment_seconds)))
+
+    def touch(self):
+        """
+        Records a viewer request, starting the encoder if it is not running.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self.last_request = time.monotonic()
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+
+    def stop(self, timeout=5.0):
+        """
+        Stops the encoder without waiting for the idle timeout. Used on shutdown.
+
+        Args:
+            timeout (float): Maximum time to wait for the encoder to exit in seconds.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            # Makes the encoder idle as of its next check
+            self.last_request = float('-inf')
+            thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _stop_if_idle(self):
+        """
+        Decides whether the encoder should stop, under the lock so a request
+        arriving at the same time starts a new encoder instead of being missed.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if the encoder should stop.
+        """
+        with self.lock:
+            if time.monotonic() - self.last_request < self.idle_seconds:
+                return False
+            self.running = False
+            return True
+
+    def _open_container(self, splitter):
+        """
+        Opens the fragmented MP4 muxer writing into a splitter.
+
+        Args:
+            splitter (Fmp4Splitter): The splitter receiving the muxer output.
+
+        Returns:
+            av.container.OutputContainer: The muxer.
+        """
+        return self.av.open(splitter, mode='w', format='mp4', options=MP4_OPTIONS)
+
+    def _run(self):
+        """
+        Encoder thread: holds the camera open and encodes one epoch, and a new
+        epoch each time the stream size changes.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        print(f"Starting H.264 segment encoder ({self.name})")
+        try:
+            self.camera.acquire()
+            try:
+                self.cache.begin()
+                while self._encode():
+                    print("Camera stream size changed, restarting H.264 segment encoder")
+                    self.cache.begin()
+            finally:
+                self.camera.release()
+        except Exception as e:
+            print("H.264 segment encoder error: " + str(e))
+        finally:
+            with self.lock:
+                # Only clear the state if a newer encoder has not taken over
+                if self.thread is threading.current_thread():
+                    self.running = False
+                    self.thread = None
+            print("Stopped H.264 segment encoder")
+
+    def _encode(self):
+        """
+        Encodes the camera stream into the cache until _stop_if_idle() returns True,
+        or until the size of the camera stream changes.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if encoding stopped because the stream size changed.
+        """
+        raise NotImplementedError
+
+    def get_stats(self):
+        """
+        Returns the encoder state and the cache occupancy.
+
+        Args:
+            None
+
+        Returns:
+            dict: The backend, running flag, stream settings and cache statistics.
+        """
+        stats = self.cache.get_stats()
+        stats.update({'backend': self.name, 'running': self.running, 'stream': self.stream,
+                      'fps': self.fps, 'segment_seconds': self.segment_seconds, 'bitrate': self.bitrate})
+        return stats
+
+class Libx264SegmentStreamer(SegmentStreamer):
+    """
+    Encodes YUV420 frames captured from the camera with libx264 through PyAV.
+    Works without the hardware encoder, at the cost of CPU time.
+    """
+    name = "libx264"
+
+    def _encode(self):
+        splitter = Fmp4Splitter(self.cache)
+        container = self._open_container(splitter)
+        video = None
+        frame_buffer = None
+        started = time.monotonic()
+        last_pts = -1
+        try:
+            while not self._stop_if_idle():
+                frame_buffer = self.camera.capture(SOURCE_YUV420, self.stream, out=frame_buffer)
+                if video is not None and frame_buffer.shape != (video.height * 3 // 2, video.width):
+                    # The camera was reconfigured; the new size needs a new stream and init segment
+                    return True
+                if video is None:
+                    height, width = frame_buffer.shape[0] * 2 // 3, frame_buffer.shape[1]
+                    video = container.add_stream('libx264', rate=self.fps)
+                    video.width = width
+                    video.height = height
+                    video.pix_fmt = 'yuv420p'
+                    video.bit_rate = self.bitrate
+                    video.codec_context.time_base = TIME_BASE
+                    # Fixed keyframe interval without scene cuts, so every segment has the same length
+                    gop = self.gop_size()
+                    video.options = {'preset': 'ultrafast', 'tune': 'zerolatency',
+                                     'x264-params': f'keyint={gop}:min-keyint={gop}:scenecut=0'}
+                    started = time.monotonic()
+                frame = self.av.VideoFrame.from_ndarray(frame_buffer, format='yuv420p')
+                # Timestamps follow the capture time so segment durations are real time
+                pts = max(last_pts + 1, int((time.monotonic() - started) / TIME_BASE))
+                frame.pts = pts
+                frame.time_base = TIME_BASE
+                last_pts = pts
+                for packet in video.encode(frame):
+                    splitter.mark(float(packet.pts * packet.time_base))
+                    container.mux(packet)
+                # Pace the capture to the nominal frame rate
+                time.sleep(max(0.0, started + (pts * float(TIME_BASE)) + 1.0 / self.fps - time.monotonic()))
+            return False
+        finally:
+            if video is not None:
+                splitter.mark(last_pts * float(TIME_BASE) + 1.0 / self.fps)
+                for packet in video.encode(None):
+                    container.mux(packet)
+            container.close()
+
+class HardwareH264SegmentStreamer(SegmentStreamer):
+    """
+    Encodes a camera stream with the picamera2 hardware H.264 encoder. PyAV
+    only muxes the encoded frames, it does not encode.
+    """
+    name = "h264"
+    hardware = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        from picamera2.encoders import H264Encoder
+        from picamera2.outputs import Output
+        self.encoder_class = H264Encoder
+        self.output_class = Output
+
+    @staticmethod
+    def _parameter_sets(frame):
+        """
+        Extracts the SPS and PPS NAL units from an Annex B keyframe.
+
+        Args:
+            frame (bytes): The encoded keyframe.
+
+        Returns:
+            bytes: The parameter sets in Annex B format, used as the stream's extradata.
+        """
+        data = bytes(frame)
+        units = []
+        for nal in data.split(b'\x00\x00\x01'):
+            nal = nal.rstrip(b'\x00')
+            # NAL unit types 7 (SPS) and 8 (PPS)
+            if nal and nal[0] & 0x1F in (7, 8):
+                units.append(b'\x00\x00\x00\x01' + nal)
+        return b''.join(units)
+
+    def _encode(self):
+        splitter = Fmp4Splitter(self.cache)
+        state = {'container': None, 'video': None, 'first': None}
+        width, height = self.camera.stream_size(self.stream)
+        streamer = self
+
+        class MuxOutput(self.output_class):
+            def outputframe(self, frame, keyframe=True, timestamp=None, *args, **kwargs):
+                streamer._mux(splitter, state, frame, keyframe, timestamp, width, height)
+
+        encoder = self.encoder_class(bitrate=self.bitrate, repeat=True, iperiod=self.gop_size())
+        self.camera.camera.start_encoder(encoder, MuxOutput(), name=self.stream)
+        try:
+            # The camera cannot be reconfigured while the encoder is attached
+            while not self._stop_if_idle():
+                time.sleep(IDLE_POLL_SECONDS)
+            return False
+        finally:
+            self.camera.camera.stop_encoder(encoder)
+            if state['container'] is not None:
+                splitter.mark(splitter.time + 1.0 / self.fps)
+                state['container'].close()
+
+    def _mux(self, splitter, state, frame, keyframe, timestamp, width, height):
+        """
+        Encoder callback: muxes one encoded frame. The muxer is opened on the first
+        keyframe, whose parameter sets become the stream's extradata.
+
+        Args:
+            splitter (Fmp4Splitter): The splitter receiving the muxer output.
+            state (dict): The muxer, its video stream and the first timestamp.
+            frame (bytes): The encoded frame in Annex B format.
+            keyframe (bool): True if the frame is a keyframe.
+            timestamp (int): The capture time in microseconds.
+            width (int): The frame width.
+            height (int): The frame height.
+
+        Returns:
+            None
+        """
+        if state['container'] is None:
+            if not keyframe:
+                return
+            container = self._open_container(splitter)
+            video = container.add_stream('h264', rate=self.fps)
+            video.width = width
+            video.height = height
+            video.pix_fmt = 'yuv420p'
+            video.codec_context.time_base = TIME_BASE
+            video.codec_context.extradata = self._parameter_sets(frame)
+            state.update(container=container, video=video, first=timestamp)
+        video = state['video']
+        pts = int(Fraction(timestamp - state['first'], 1000000) / TIME_BASE)
+        packet = self.av.Packet(bytes(frame))
+        packet.stream = video
+        packet.time_base = TIME_BASE
+        packet.pts = packet.dts = pts
+        packet.is_keyframe = keyframe
+        splitter.mark(float(pts * TIME_BASE))
+        state['container'].mux(packet)
+
+# Segment encoder backends, by name
+SEGMENT_STREAMERS = {
+    Libx264SegmentStreamer.name: Libx264SegmentStreamer,
+    HardwareH264SegmentStreamer.name: HardwareH264SegmentStreamer
+}
+
+def create_segment_streamer(name, camera, cache, **kwargs):
+    """
+    Creates a segment encoder backend, falling back to libx264 if the hardware
+    encoder cannot be loaded.
+
+    Args:
+        name (str): The name of the backend in SEGMENT_STREAMERS.
+        camera (PiCam.Camera): The camera to encode from.
+        cache (SegmentCache): The cache the segments are served from.
+        **kwargs: Passed to the backend.
+
+    Returns:
+        SegmentStreamer: The streamer.
+
+    Raises:
+        ValueError: If no backend is registered under the name.
+        ImportError: If PyAV is not installed.
+    """
+    streamer_class = SEGMENT_STREAMERS.get(name)
+    if streamer_class is None:
+        raise ValueError(f"Unknown H.264 segment encoder '{name}'")
+    try:
+        return streamer_class(camera, cache, **kwargs)
+    except ImportError as e:
+        if streamer_class is Libx264SegmentStreamer:
+            raise
+        print(f"H.264 segment encoder '{name}' not available ({e}), using libx264")
+        return Libx264SegmentStreamer(camera, cache, **kwargs)
@@ -0,0 +1,182 @@
+"""
+Run time telemetry of the periodic tasks and the feed scheduler.
+
+Each run reports how late it started relative to its schedule and how long
+it took. The values go into the same fixed-size rolling windows as the stream
+statistics, so recording costs one array store under a short lock and the
+percentiles are only computed when the statistics are read or logged.
+"""
+import threading
+import time
+
+from app.frameStats import RollingHistogram
+
+class TaskStats:
+    """
+    The telemetry of a single task.
+
+    Attributes:
+        runs (int): The number of completed runs.
+        duration (RollingHistogram): Run durations of recent runs.
+        drift (RollingHistogram): Delay between when recent runs were due and when they started.
+        overruns (int): The number of runs that were due while the previous one was still running.
+        exceptions (int): The number of runs that raised an exception.
+        last_error (str): The last exception, or None.
+        last_error_time (float): Wall clock time of the last exception, or None.
+    """
+    def __init__(self, window):
+        self.runs = 0
+        self.duration = RollingHistogram(window)
+        self.drift = RollingHistogram(window)
+        self.overruns = 0
+        self.exceptions = 0
+        self.last_error = None
+        self.last_error_time = None
+
+    def to_dict(self):
+        """
+        Returns the counters and the duration and drift statistics.
+
+        Args:
+            None
+
+        Returns:
+            dict: The task's telemetry.
+        """
+        return {
+            'runs': self.runs,
+            'overruns': self.overruns,
+            'exceptions': self.exceptions,
+            'last_error': self.last_error,
+            'last_error_time': self.last_error_time,
+            'duration': self.duration.to_dict(),
+            'drift': self.drift.to_dict()
+        }
+
+class TaskTelemetry:
+    """
+    Thread safe collection of the telemetry of named tasks, with an optional periodic log summary.
+
+    Attributes:
+        window (int): The number of recent runs each histogram covers.
+        tasks (dict): TaskStats by task name.
+    """
+    def __init__(self, window=100):
+        """
+        Initializes empty telemetry.
+
+        Args:
+            window (int): The number of recent runs each histogram covers.
+
+        Returns:
+            None
+        """
+        self.window = window
+        self.lock = threading.Lock()
+        self.tasks = {}
+        self.log_interval = None
+        self.thread = None
+
+    def _task(self, name):
+        # Must be called with the lock held
+        stats = self.tasks.get(name)
+        if stats is None:
+            stats = TaskStats(self.window)
+            self.tasks[name] = stats
+        return stats
+
+    def record_run(self, name, drift, duration, error=None):
+        """
+        Records a finished run of a task.
+
+        Args:
+            name (str): The name of the task.
+            drift (float): Seconds between when the run was due and when it started.
+            duration (float): Seconds the run took.
+            error (Exception): The exception the run raised, or None.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            stats = self._task(name)
+            stats.runs += 1
+            stats.drift.record(max(0.0, drift))
+            stats.duration.record(duration)
+            if error is not None:
+                stats.exceptions += 1
+                stats.last_error = f"{type(error).__name__}: {error}"
+                stats.last_error_time = time.time()
+
+    def record_overrun(self, name):
+        """
+        Records a run that was due while the previous run of the task was still in progress.
+
+        Args:
+            name (str): The name of the task.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            self._task(name).overruns += 1
+
+    def to_dict(self):
+        """
+        Returns the telemetry of every task seen so far.
+
+        Args:
+            None
+
+        Returns:
+            dict: The window size and the telemetry by task name.
+        """
+        with self.lock:
+            return {'window': self.window,
+                    'tasks': {name: stats.to_dict() for name, stats in self.tasks.items()}}
+
+    def summary(self):
+        """
+        Returns a one line per task summary for the log.
+
+        Args:
+            None
+
+        Returns:
+            list: The summary lines, sorted by task name.
+        """
+        lines = []
+        for name, stats in sorted(self.to_dict()['tasks'].items()):
+            duration, drift = stats['duration'], stats['drift']
+            line = f"{name}: {stats['runs']} runs"
+            if 'p50_ms' in duration:
+                line += (f", duration p50 {duration['p50_ms']:.1f} ms p99 {duration['p99_ms']:.1f} ms"
+                         f", drift p50 {drift['p50_ms']:.1f} ms max {drift['max_ms']:.1f} ms")
+            line += f", {stats['overruns']} overruns, {stats['exceptions']} exceptions"
+            if stats['last_error'] is not None:
+                line += f", last error: {stats['last_error']}"
+            lines.append(line)
+        return lines
+
+    def start_log(self, interval):
+        """
+        Starts a thread printing the summary every interval seconds.
+
+        Args:
+            interval (float): Seconds between summaries.
+
+        Returns:
+            None
+        """
+        if self.thread is not None:
+            return
+        self.log_interval = interval
+        self.thread = threading.Thread(target=self._log, daemon=True)
+        self.thread.start()
+
+    def _log(self):
+        while True:
+            time.sleep(self.log_interval)
+            lines = self.summary()
+            if lines:
+                print("Task telemetry:\n  " + "\n  ".join(lines))
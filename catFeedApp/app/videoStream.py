@@ -0,0 +1,764 @@
+"""
+Shared live video stream for the Pi camera.
+
+A single background thread captures, processes and JPEG-encodes frames from
+the camera and publishes the most recent encoded frame to every connected
+viewer, so the capture and encode cost does not grow with the number of
+viewers.
+
+Each viewer tracks how long writing a frame to its socket takes. Viewers that
+fall behind are moved to a lower frame rate and a lower JPEG quality tier and
+always receive the newest frame, so stale frames are skipped rather than
+queued for them.
+
+Every frame is stamped with its capture time, and the time spent capturing,
+processing, encoding and writing it is recorded in frameStats, per camera
+mode and resolution.
+"""
+from collections import deque
+import sys
+import threading
+import time
+import tracemalloc
+import cv2
+
+from app import frameStats
+from video import framePipeline, frameEncoder, parallelPipeline
+
+# Maximum time a viewer waits for a new frame before giving up
+FRAME_TIMEOUT_SECONDS = 5
+# Multipart framing around each JPEG in the MJPEG stream
+FRAME_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+FRAME_TRAILER = b'\r\n'
+# JPEG quality of each tier a slow viewer can be moved to. Tier 0 uses the encoder's own quality
+QUALITY_TIERS = [None, 60, 40, 25]
+# A viewer is behind when writing a frame takes longer than this fraction of its frame interval
+SLOW_WRITE_FRACTION = 0.5
+# Writes faster than this fraction of the frame interval count towards recovering
+FAST_WRITE_FRACTION = 0.2
+# Number of consecutive fast writes before a viewer steps back up
+RECOVER_FRAMES = 30
+# Slowest frame interval a viewer can be throttled to, in seconds
+MAX_FRAME_INTERVAL_SECONDS = 2.0
+# Weight of the newest write duration in the running average
+WRITE_TIME_SMOOTHING = 0.3
+# Cached frames older than this are refreshed before being served as a snapshot
+SNAPSHOT_MAX_AGE_SECONDS = 10
+
+class StreamClient:
+    """
+    Per-viewer flow control state.
+
+    Attributes:
+        interval (float): Minimum time between frames sent to the viewer in seconds.
+        tier (int): Index into QUALITY_TIERS.
+        write_time (float): Smoothed time taken to write a frame in seconds.
+        fast_writes (int): Consecutive writes well within the frame interval.
+        next_due (float): Monotonic time at which the next frame may be sent.
+    """
+    def __init__(self):
+        """
+        Initializes a viewer at full frame rate and quality.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.interval = 0.0
+        self.tier = 0
+        self.write_time = 0.0
+        self.fast_writes = 0
+        self.next_due = 0.0
+
+    def record_write(self, duration, frame_interval):
+        """
+        Records how long a frame took to write and adapts the frame rate and quality tier.
+
+        Args:
+            duration (float): The time taken to write the frame in seconds.
+            frame_interval (float): The producer's current frame interval in seconds.
+
+        Returns:
+            None
+        """
+        self.write_time += WRITE_TIME_SMOOTHING * (duration - self.write_time)
+        budget = max(self.interval, frame_interval)
+        if budget > 0 and self.write_time > budget * SLOW_WRITE_FRACTION:
+            # Falling behind: halve the frame rate and drop a quality tier
+            self.interval = min(MAX_FRAME_INTERVAL_SECONDS, max(self.interval * 2, self.write_time * 2, frame_interval * 2))
+            self.tier = min(len(QUALITY_TIERS) - 1, self.tier + 1)
+            self.fast_writes = 0
+        elif budget > 0 and self.write_time < budget * FAST_WRITE_FRACTION:
+            self.fast_writes += 1
+            if self.fast_writes >= RECOVER_FRAMES and (self.tier > 0 or self.interval > 0):
+                # Caught up for a while: step the quality and frame rate back up
+                self.tier = max(0, self.tier - 1)
+                self.interval = self.interval / 2 if self.interval > frame_interval else 0.0
+                self.fast_writes = 0
+        else:
+            self.fast_writes = 0
+        self.next_due = time.monotonic() + self.interval
+
+class AllocationTracker:
+    """
+    Measures memory allocated while producing each frame, using tracemalloc.
+
+    tracemalloc sees NumPy and OpenCV array buffers as well as Python objects.
+    It traces every thread and slows allocation down, so it is only enabled
+    for diagnosis.
+
+    Attributes:
+        frames (int): The number of frames measured.
+        peak_bytes (int): Total of the per-frame peak bytes above the frame's starting point.
+        last_peak_bytes (int): Peak bytes above the starting point for the last frame.
+        blocks (int): Total change in allocated Python memory blocks.
+    """
+    def __init__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.frames = 0
+        self.peak_bytes = 0
+        self.last_peak_bytes = 0
+        self.blocks = 0
+        self.base = 0
+        self.base_blocks = 0
+
+    def begin(self):
+        """
+        Marks the start of a frame.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        tracemalloc.reset_peak()
+        self.base = tracemalloc.get_traced_memory()[0]
+        self.base_blocks = sys.getallocatedblocks()
+
+    def end(self):
+        """
+        Marks the end of a frame and records its allocations.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        peak = tracemalloc.get_traced_memory()[1]
+        self.frames += 1
+        self.last_peak_bytes = peak - self.base
+        self.peak_bytes += self.last_peak_bytes
+        self.blocks += sys.getallocatedblocks() - self.base_blocks
+
+    def to_dict(self):
+        """
+        Returns the per-frame allocation statistics.
+
+        Args:
+            None
+
+        Returns:
+            dict: The frame count, average and last peak bytes, and average block change.
+        """
+        return {
+            'frames': self.frames,
+            'avg_peak_bytes': self.peak_bytes // self.frames if self.frames else 0,
+            'last_peak_bytes': self.last_peak_bytes,
+            'avg_blocks': round(self.blocks / self.frames, 2) if self.frames else 0.0
+        }
+
+class FrameBroadcaster:
+    """
+    Single producer of encoded frames for all live video viewers.
+
+    The producer thread is started when the first viewer subscribes and exits
+    once the last viewer unsubscribes. Each published frame is tagged with an
+    increasing sequence number; viewers wait for a sequence number newer than
+    the last one they sent and then write the shared bytes.
+
+    Attributes:
+        camera (PiCam.Camera): The camera frames are captured from.
+        stream (str): The camera stream ("lores" or "main") that is broadcast.
+        encoder (frameEncoder.JpegEncoder): The JPEG encoder backend.
+        mode (int): The current camera mode, an index into framePipeline.CAMERA_MODES.
+        pipeline (framePipeline.Pipeline): The prebuilt pipeline for the current mode.
+        frame (bytes): The most recent encoded multipart frame.
+        sequence (int): The sequence number of the most recent frame.
+        frame_interval (float): Smoothed time between produced frames in seconds.
+        published_at (float): Monotonic time the most recent frame was published.
+        epoch (int): Creation time of the broadcaster, used to keep snapshot ETags
+            unique across restarts.
+        tier_frames (dict): Lower quality encodes of recent frames, by tier, as
+            (sequence, frame, stamp). Only encoded while a viewer in that tier is waiting.
+        subscribers (int): The number of connected viewers.
+        stats (frameStats.FrameStats): Rolling latency and frame rate statistics.
+        stats_overlay (bool): Burn the frame rate and latency into each frame.
+    """
+    def __init__(self, camera, mode=0, stream="lores", encoder=None, pool=None, parallel_modes=(), parallel_depth=3,
+                 trace_allocations=False, stats_window=300, stats_overlay=False):
+        """
+        Initializes the broadcaster without starting the producer thread.
+
+        Args:
+            camera (PiCam.Camera): The camera to capture frames from.
+            mode (int): The initial processing mode.
+            stream (str): The camera stream to broadcast. Defaults to the low
+                resolution preview stream, keeping the full resolution main
+                stream for snapshots and analysis.
+            encoder (frameEncoder.JpegEncoder): The JPEG encoder backend. Defaults
+                to cv2. The hardware MJPEG encoder bypasses the processing pipeline.
+            pool (multiprocessing.pool.Pool): Worker pool for the parallel pipelines,
+                or None to process every frame on the producer thread.
+            parallel_modes (tuple): Names of the pipelines that are run on the pool.
+            parallel_depth (int): Number of frames kept in flight by a parallel pipeline.
+            trace_allocations (bool): Measure the memory allocated per frame.
+            stats_window (int): Number of recent frames the latency statistics cover.
+            stats_overlay (bool): Burn the frame rate and latency into each frame.
+
+        Returns:
+            None
+        """
+        self.camera = camera
+        self.stream = stream
+        self.encoder = encoder or frameEncoder.Cv2Encoder()
+        self.pool = pool
+        self.parallel_modes = tuple(parallel_modes)
+        self.parallel_depth = parallel_depth
+        self.mode = mode
+        # Pipelines by mode, each built once and reused when the mode is selected again
+        self.pipelines = {}
+        self.pipeline = self._build_pipeline(mode)
+        self.pipelines[mode % framePipeline.NUM_CAMERA_MODES] = self.pipeline
+        self.capture_buffer = None
+        self.allocations = AllocationTracker() if trace_allocations else None
+        self.stats = frameStats.FrameStats(stats_window)
+        self.stats_overlay = stats_overlay
+        self.frame = None
+        self.frame_stamp = None
+        self.sequence = 0
+        self.frame_interval = 0.0
+        self.published_at = None
+        self.epoch = int(time.time())
+        self.tier_frames = {}
+        self.tier_waiting = [0] * len(QUALITY_TIERS)
+        self.listeners = []
+        self.subscribers = 0
+        self.running = False
+        self.thread = None
+        self.cv = threading.Condition()
+
+    def set_mode(self, mode):
+        """
+        Selects a camera mode. The pipeline is built here the first time the mode
+        is selected and swapped in, so the producer picks it up on its next frame.
+
+        Args:
+            mode (int): Index into framePipeline.CAMERA_MODES.
+
+        Returns:
+            None
+        """
+        mode = mode % framePipeline.NUM_CAMERA_MODES
+        pipeline = self.pipelines.get(mode)
+        if pipeline is None:
+            pipeline = self._build_pipeline(mode)
+            self.pipelines[mode] = pipeline
+        # A single reference assignment, so the producer sees either the old or the new pipeline
+        self.pipeline = pipeline
+        self.mode = mode
+
+    def _build_pipeline(self, mode):
+        """
+        Builds the pipeline for a camera mode, on the worker pool if the mode is
+        one of the parallel modes.
+
+        Args:
+            mode (int): Index into framePipeline.CAMERA_MODES.
+
+        Returns:
+            framePipeline.Pipeline or parallelPipeline.ParallelPipeline: The pipeline.
+        """
+        name = framePipeline.CAMERA_MODES[mode % framePipeline.NUM_CAMERA_MODES]
+        if self.pool is not None and name in self.parallel_modes:
+            return parallelPipeline.ParallelPipeline(self.pool, name, self.parallel_depth)
+        return framePipeline.build_pipeline(name)
+
+    def get_stats(self):
+        """
+        Returns the per-stage timing statistics of the current pipeline, and the
+        per-frame allocations if they are traced.
+
+        Args:
+            None
+
+        Returns:
+            dict: The camera mode and the pipeline statistics.
+        """
+        stats = self.pipeline.get_stats()
+        stats['mode'] = self.mode
+        if self.allocations is not None:
+            stats['allocations'] = self.allocations.to_dict()
+        return stats
+
+    def get_frame_stats(self):
+        """
+        Returns the rolling per-stage latency and frame rate statistics.
+
+        Args:
+            None
+
+        Returns:
+            dict: The statistics by "mode@WIDTHxHEIGHT", plus the current mode and overlay state.
+        """
+        stats = self.stats.to_dict()
+        stats['mode'] = self.pipeline.name
+        stats['overlay'] = self.stats_overlay
+        return stats
+
+    def subscribe(self):
+        """
+        Registers a viewer, starting the producer thread if it is not running.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.subscribers += 1
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+
+    def unsubscribe(self):
+        """
+        Unregisters a viewer. The producer thread exits on its next iteration
+        once no viewers remain.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.subscribers = max(0, self.subscribers - 1)
+            self.cv.notify_all()
+
+    def close(self, timeout=5.0):
+        """
+        Stops the producer regardless of viewers and frees the shared memory of the
+        parallel pipelines. Used on shutdown.
+
+        Args:
+            timeout (float): Maximum time to wait for the producer to exit in seconds.
+
+        Returns:
+            None
+        """
+        with self.cv:
+            self.subscribers = 0
+            thread = self.thread
+            self.cv.notify_all()
+        if thread is not None:
+            thread.join(timeout)
+        for pipeline in self.pipelines.values():
+            if getattr(pipeline, 'parallel', False):
+                pipeline.close()
+
+    def next_frame(self, last_sequence, tier=0, timeout=FRAME_TIMEOUT_SECONDS):
+        """
+        Blocks until a frame newer than last_sequence has been published.
+
+        Args:
+            last_sequence (int): The sequence number of the last frame the caller received.
+            tier (int): The quality tier to receive, an index into QUALITY_TIERS.
+            timeout (float): The maximum time to wait in seconds.
+
+        Returns:
+            tuple: (sequence, frame, stamp) where stamp is the (capture time,
+            statistics key) of the frame, or (last_sequence, None, None) if the
+            wait timed out or the producer stopped.
+        """
+        if self.encoder.hardware:
+            # The hardware encoder produces a single quality
+            tier = 0
+        with self.cv:
+            if tier == 0:
+                self.cv.wait_for(lambda: self.sequence > last_sequence or not self.running, timeout)
+                if self.sequence <= last_sequence:
+                    return last_sequence, None, None
+                return self.sequence, self.frame, self.frame_stamp
+            # Lower tiers are only encoded while someone is waiting for them
+            self.tier_waiting[tier] += 1
+            try:
+                self.cv.wait_for(lambda: self.tier_frames.get(tier, (0, None, None))[0] > last_sequence or not self.running, timeout)
+            finally:
+                self.tier_waiting[tier] -= 1
+            sequence, frame, stamp = self.tier_frames.get(tier, (0, None, None))
+            if sequence <= last_sequence:
+                return last_sequence, None, None
+            return sequence, frame, stamp
+
+    def snapshot(self, max_age=SNAPSHOT_MAX_AGE_SECONDS, timeout=FRAME_TIMEOUT_SECONDS):
+        """
+        Returns the most recently encoded frame as a still image.
+
+        The cached frame is served as long as it is at most max_age seconds old,
+        so polling clients do not cause any capture or encode while the stream
+        is running. Only when the cache is empty or stale is the producer briefly
+        started to publish a fresh frame.
+
+        Args:
+            max_age (float): The maximum age of the cached frame in seconds.
+            timeout (float): The maximum time to wait for a fresh frame in seconds.
+
+        Returns:
+            tuple: (sequence, frame) where frame is the multipart chunk of the
+            frame, or (0, None) if no frame could be captured.
+        """
+        with self.cv:
+            if self.frame is not None and self.published_at is not None and time.monotonic() - self.published_at <= max_age:
+                return self.sequence, self.frame
+            last_sequence = self.sequence
+        self.subscribe()
+        try:
+            sequence, frame, _ = self.next_frame(last_sequence, timeout=timeout)
+        finally:
+            self.unsubscribe()
+        if frame is None:
+            return 0, None
+        return sequence, frame
+
+    def snapshot_etag(self, sequence):
+        """
+        Returns the ETag of a published frame.
+
+        Args:
+            sequence (int): The sequence number of the frame.
+
+        Returns:
+            str: The unquoted entity tag.
+        """
+        return f"{self.epoch}-{sequence}"
+
+    def gen_frames(self):
+        """
+        Generator yielding multipart MJPEG chunks for a single viewer.
+
+        Args:
+            None
+
+        Returns:
+            generator: Yields the multipart chunk for each new frame.
+        """
+        self.subscribe()
+        client = StreamClient()
+        try:
+            sequence = 0
+            while True:
+                # Throttled viewers wait here, without holding any frame
+                delay = client.next_due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                sequence, frame, stamp = self.next_frame(sequence, client.tier)
+                if frame is None:
+                    return
+                # The server pulls the next chunk once this one has been written to
+                # the socket, so the time spent suspended here is the write time
+                start = time.monotonic()
+                yield frame
+                now = time.monotonic()
+                client.record_write(now - start, self.frame_interval)
+                captured_at, key = stamp
+                self.stats.record(key, 'write', now - start)
+                self.stats.record(key, 'latency', now - captured_at)
+        finally:
+            self.unsubscribe()
+
+    def _publish(self, jpeg, tiers=None, captured_at=None, key=None):
+        """
+        Publishes an encoded frame and wakes all waiting viewers.
+
+        Args:
+            jpeg: A buffer-protocol object containing the JPEG encoded frame.
+            tiers (dict): Lower quality encodes of the same frame, by tier.
+            captured_at (float): Monotonic capture time of the frame. Defaults to now.
+            key (str): The statistics key of the frame. Defaults to the stream's mode.
+
+        Returns:
+            None
+        """
+        # The JPEG is copied exactly once, into the multipart chunk shared by all viewers
+        frame = b''.join((FRAME_HEADER, jpeg, FRAME_TRAILER))
+        now = time.monotonic()
+        stamp = (captured_at if captured_at is not None else now, key or self.pipeline.name)
+        self.stats.record_published(stamp[1], now)
+        with self.cv:
+            if self.published_at is not None and now - self.published_at < MAX_FRAME_INTERVAL_SECONDS:
+                self.frame_interval += WRITE_TIME_SMOOTHING * ((now - self.published_at) - self.frame_interval)
+            self.published_at = now
+            self.frame = frame
+            self.frame_stamp = stamp
+            self.sequence += 1
+            if tiers:
+                for tier, tier_jpeg in tiers.items():
+                    self.tier_frames[tier] = (self.sequence, b''.join((FRAME_HEADER, tier_jpeg, FRAME_TRAILER)), stamp)
+            sequence = self.sequence
+            self.cv.notify_all()
+        for listener in self.listeners:
+            try:
+                listener(sequence, frame)
+            except Exception as e:
+                print("Frame listener error: " + str(e))
+
+    def add_listener(self, listener):
+        """
+        Registers a function called with (sequence, frame) for every published
+        frame, from the producer thread. Listeners must return quickly.
+
+        Args:
+            listener (function): The function to call.
+
+        Returns:
+            None
+        """
+        self.listeners.append(listener)
+
+    def _encode_tiers(self, frame):
+        """
+        Encodes a frame at each lower quality tier that has a viewer waiting.
+
+        Args:
+            frame (numpy.ndarray): The processed frame.
+
+        Returns:
+            dict: The JPEG data by tier.
+        """
+        with self.cv:
+            waiting = [tier for tier in range(1, len(QUALITY_TIERS)) if self.tier_waiting[tier] > 0]
+        return {tier: self.encoder.encode(frame, QUALITY_TIERS[tier]) for tier in waiting}
+
+    def _stop_if_idle(self):
+        """
+        Marks the producer as stopped if no viewers remain. Must be called with
+        self.cv held, so a new subscriber either sees the producer still running
+        or starts a fresh one.
+
+        Args:
+            None
+
+        Returns:
+            bool: True if the producer should exit.
+        """
+        if self.subscribers > 0:
+            return False
+        self.running = False
+        self.thread = None
+        self.cv.notify_all()
+        return True
+
+    def _run(self):
+        """
+        Producer thread: holds the camera open while viewers are connected and
+        runs the software or hardware encoding loop.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        print("Starting frame broadcaster. Camera mode: " + str(self.mode) + ", encoder: " + self.encoder.name)
+        try:
+            # Starts the camera if this is its first consumer
+            self.camera.acquire()
+            try:
+                if self.encoder.hardware:
+                    self._produce_hardware()
+                else:
+                    self._produce()
+            finally:
+                # Lets the camera stop once it has been idle for its grace period
+                self.camera.release()
+        except Exception as e:
+            print("Frame broadcaster error: " + str(e))
+        finally:
+            with self.cv:
+                # Only clear the state if a newer producer has not taken over
+                if self.thread is threading.current_thread():
+                    self.running = False
+                    self.thread = None
+                self.cv.notify_all()
+            print("Stopped frame broadcaster")
+
+    def _produce(self):
+        """
+        Producer loop: captures, processes and encodes frames until no viewers remain.
+
+        Parallel pipelines keep several frames in flight on the worker pool, so
+        capturing the next frame and encoding the previous one overlap with
+        processing. Frames are published in capture order.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        in_flight = None
+        # (capture time, capture duration, submit time) of each frame in flight
+        stamps = deque()
+        try:
+            while True:
+                with self.cv:
+                    if self._stop_if_idle():
+                        return
+                pipeline = self.pipeline
+                if in_flight is not None and in_flight is not pipeline:
+                    # The mode changed: publish the frames still queued on the old pipeline
+                    self._drain(in_flight, stamps)
+                    in_flight = None
+                if self.allocations is not None:
+                    self.allocations.begin()
+                # Capture the raw frame from the Pi Camera in the layout the pipeline
+                # consumes, into the buffer used for the previous frame. Flips are
+                # applied by the sensor
+                captured_at = time.monotonic()
+                frame_raw = self.camera.capture(pipeline.source, self.stream, out=self.capture_buffer)
+                self.capture_buffer = frame_raw
+                processing_start = time.monotonic()
+                if getattr(pipeline, 'parallel', False):
+                    if pipeline.pending() and not pipeline.matches(frame_raw):
+                        # The camera resolution changed: finish the frames of the old size first
+                        self._drain(pipeline, stamps)
+                    in_flight = pipeline
+                    pipeline.submit(frame_raw)
+                    stamps.append((captured_at, processing_start - captured_at, processing_start))
+                    if pipeline.pending() >= pipeline.depth:
+                        self._collect_and_publish(pipeline, stamps)
+                else:
+                    # Perform processing with the prebuilt pipeline for the current mode.
+                    # Every stage writes into its own reused output buffer
+                    frame_processed = pipeline.process(frame_raw)
+                    self._encode_and_publish(frame_processed, pipeline.name, captured_at,
+                                             processing_start - captured_at, time.monotonic() - processing_start)
+                if self.allocations is not None:
+                    self.allocations.end()
+        finally:
+            if in_flight is not None:
+                in_flight.discard()
+
+    def _collect_and_publish(self, pipeline, stamps):
+        """
+        Collects the oldest frame in flight on a parallel pipeline, publishes it
+        and frees its slot. Processing time is measured from submission, so it
+        includes the time the frame waited for a worker.
+
+        Args:
+            pipeline (parallelPipeline.ParallelPipeline): The pipeline to collect from.
+            stamps (collections.deque): The stamps of the frames in flight, in submission order.
+
+        Returns:
+            None
+        """
+        captured_at, capture_time, submitted_at = stamps.popleft()
+        frame_processed, slot = pipeline.collect()
+        try:
+            self._encode_and_publish(frame_processed, pipeline.name, captured_at, capture_time,
+                                     time.monotonic() - submitted_at)
+        finally:
+            pipeline.release(slot)
+
+    def _drain(self, pipeline, stamps):
+        """
+        Publishes every frame still in flight on a parallel pipeline and frees its slots.
+
+        Args:
+            pipeline (parallelPipeline.ParallelPipeline): The pipeline to drain.
+            stamps (collections.deque): The stamps of the frames in flight, in submission order.
+
+        Returns:
+            None
+        """
+        while pipeline.pending():
+            self._collect_and_publish(pipeline, stamps)
+        pipeline.close()
+
+    def _draw_overlay(self, frame, key):
+        """
+        Burns the frame rate and latency of the stream into a processed frame.
+
+        Args:
+            frame (numpy.ndarray): The processed frame, drawn on in place.
+            key (str): The statistics key of the frame.
+
+        Returns:
+            None
+        """
+        if not frame.flags.c_contiguous:
+            # OpenCV can only draw on contiguous frames
+            return
+        text = self.stats.overlay(key)
+        scale = max(0.4, frame.shape[1] / 1600)
+        origin = (8, int(30 * scale) + 8)
+        white = 255 if frame.ndim == 2 else (255,) * frame.shape[2]
+        black = 0 if frame.ndim == 2 else (0,) * frame.shape[2]
+        # A dark outline keeps the text readable on bright frames
+        cv2.putText(frame, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, black, 3, cv2.LINE_AA)
+        cv2.putText(frame, text, origin, cv2.FONT_HERSHEY_SIMPLEX, scale, white, 1, cv2.LINE_AA)
+
+    def _encode_and_publish(self, frame_processed, mode, captured_at, capture_time, process_time):
+        """
+        Encodes a processed frame, plus any lower quality tiers that slow viewers
+        are waiting for, and publishes it.
+
+        Args:
+            frame_processed (numpy.ndarray): The processed frame.
+            mode (str): The name of the pipeline that processed the frame.
+            captured_at (float): Monotonic time the capture of the frame started.
+            capture_time (float): Time spent capturing the frame in seconds.
+            process_time (float): Time spent processing the frame in seconds.
+
+        Returns:
+            None
+        """
+        key = frameStats.FrameStats.key(mode, frame_processed.shape)
+        if self.stats_overlay:
+            self._draw_overlay(frame_processed, key)
+        start = time.monotonic()
+        jpeg = self.encoder.encode(frame_processed)
+        tiers = self._encode_tiers(frame_processed)
+        self.stats.record(key, 'capture', capture_time)
+        self.stats.record(key, 'process', process_time)
+        self.stats.record(key, 'encode', time.monotonic() - start)
+        self._publish(jpeg, tiers, captured_at, key)
+
+    def _produce_hardware(self):
+        """
+        Producer loop for the hardware MJPEG encoder: the encoder publishes frames
+        from its own thread while this thread waits for the last viewer to leave.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        # Frames are stamped when the encoder delivers them, so capture and
+        # encode are not measured separately and no overlay can be drawn
+        width, height = self.camera.stream_size(self.stream)
+        key = frameStats.FrameStats.key(self.encoder.name, (height, width))
+        self.encoder.start(self.camera, self.stream, lambda jpeg: self._publish(jpeg, key=key))
+        try:
+            with self.cv:
+                self.cv.wait_for(self._stop_if_idle)
+        finally:
+            self.encoder.stop()
@@ -1,9 +1,20 @@
 import time
+import threading
 import pigpio
 
+# Motor control modes of DCMotor.run()
+MODE_WAVEFORM = "waveform"      # The whole on/off sequence is one pigpio DMA waveform
+MODE_TIMED = "timed"            # The pins are written directly and switched off by a timer
+MOTOR_MODES = (MODE_WAVEFORM, MODE_TIMED)
+# Shortest pulse of the soft-start ramp in microseconds. Shorter low pulses are merged into the
+# high pulse and shorter high pulses are left out, as pigpio samples edges every 5 us and could miss them
+MIN_PULSE_US = 20
+# Time after the end of a waveform run at which the run is ended even if its last edge was missed
+WAVEFORM_MARGIN_SECONDS = 0.5
+
 # Define the DCMotor class, which will be used to control the motor
 class DCMotor:
-    def __init__(self, en_1_pin = 19, en_2_pin = 26):
+    def __init__(self, en_1_pin = 19, en_2_pin = 26, mode = MODE_WAVEFORM, ramp = 0, ramp_frequency = 500):
         """
         Initializes the DCMotor object with the specified GPIO pins
         
@@ -12,13 +23,34 @@ class DCMotor:
                 The GPIO pin for the first enable signal (EN1)
             en_2_pin : int
                 The GPIO pin for the second enable signal (EN2)
+            mode : str
+                How run() drives the motor, MODE_WAVEFORM or MODE_TIMED
+            ramp : float
+                Duration in seconds of the soft-start PWM ramp in waveform mode, 0 for none
+            ramp_frequency : int
+                PWM frequency of the soft-start ramp in Hz
             
         Returns:
             None
         """
         self.en1 = en_1_pin
         self.en2 = en_2_pin
+        if mode not in MOTOR_MODES:
+            raise ValueError(f"Unknown motor mode '{mode}'")
+        self.mode = mode
+        self.ramp = ramp
+        self.ramp_frequency = ramp_frequency
         self.initialized = False
+        # State of the run in progress
+        self.lock = threading.Lock()
+        self.busy = False
+        # Incremented by every run, so timers and callbacks of an earlier run are ignored
+        self.run_id = 0
+        self.on_done = None
+        self.wave_id = None
+        self.edge_callback = None
+        self.edges_left = 0
+        self.timer = None
 
     def initialize(self):
         """
@@ -71,6 +103,175 @@ class DCMotor:
         time.sleep(t)
         self.rpi.write(self.en2, 0)
         
+    def run(self, t, forward=True, on_done=None):
+        """
+        Starts the motor for a specified duration and returns immediately.
+
+        In waveform mode the whole sequence, including the optional soft-start ramp,
+        is a single pigpio waveform timed by DMA, so the run time is exact and no
+        Python thread waits for it. Completion is detected from the falling edges of
+        the driven pin, reported by pigpio's callback thread, with a
+        timer as a fallback should an edge be missed. In timed mode the pins
+        are written directly and a timer switches them off.
+
+        Args:
+            t : float
+                The duration to run the motor in seconds
+            forward : bool
+                True to run forward (EN1), False to run backward (EN2)
+            on_done : function
+                Called with no arguments once the motor has stopped, from a pigpio or timer thread
+
+        Returns:
+            None
+
+        Raises:
+            ValueError if the duration is not positive.
+            RuntimeError if the motor is already running.
+        """
+        if not t > 0:
+            raise ValueError(f"Invalid motor run time {t}")
+        pin, other = (self.en1, self.en2) if forward else (self.en2, self.en1)
+        with self.lock:
+            if self.busy:
+                raise RuntimeError("Motor is already running")
+            self.busy = True
+            self.run_id += 1
+            run = self.run_id
+            self.on_done = on_done
+        try:
+            if self.mode == MODE_WAVEFORM:
+                self._start_waveform(pin, other, t, run)
+            else:
+                self.rpi.write(other, 0)
+                self.rpi.write(pin, 1)
+                self.timer = threading.Timer(t, self._finish, args=(run,))
+                self.timer.daemon = True
+                self.timer.start()
+        except Exception:
+            self.setup()
+            with self.lock:
+                self.busy = False
+                self.on_done = None
+            raise
+
+    def _start_waveform(self, pin, other, t, run):
+        """
+        Builds and sends the waveform of a run: the soft-start ramp, the full speed
+        section and the switch off.
+
+        Args:
+            pin : int
+                The GPIO pin driven
+            other : int
+                The GPIO pin held low
+            t : float
+                The duration of the run in seconds
+            run : int
+                The ID of the run
+
+        Returns:
+            None
+        """
+        ramp = min(self.ramp, t)
+        period = int(1000000 / self.ramp_frequency)
+        steps = int(ramp * self.ramp_frequency)
+        pulses = []
+        edges = 1
+        for i in range(steps):
+            # The duty cycle rises linearly to full speed over the ramp
+            high = period * (i + 1) // steps
+            if high < MIN_PULSE_US:
+                # Too short to be seen: the motor stays off for this step
+                pulses.append(pigpio.pulse(0, (1 << pin) | (1 << other), period))
+                continue
+            if period - high < MIN_PULSE_US:
+                high = period
+            pulses.append(pigpio.pulse(1 << pin, 1 << other, high))
+            if period - high > 0:
+                pulses.append(pigpio.pulse(0, 1 << pin, period - high))
+                edges += 1
+        remaining = max(0, int(t * 1000000) - steps * period)
+        pulses.append(pigpio.pulse(1 << pin, 1 << other, remaining))
+        pulses.append(pigpio.pulse(0, 1 << pin, 0))
+        self.rpi.wave_clear()
+        self.rpi.wave_add_generic(pulses)
+        self.wave_id = self.rpi.wave_create()
+        if self.wave_id < 0:
+            raise RuntimeError(f"Could not create motor waveform: {self.wave_id}")
+        # The last falling edge of the driven pin is the end of the run
+        self.edges_left = edges
+        self.edge_callback = self.rpi.callback(pin, pigpio.FALLING_EDGE,
+                                               lambda gpio, level, tick: self._edge(run))
+        # Ends the run if an edge is missed, so the motor can never stay busy for good
+        self.timer = threading.Timer(t + WAVEFORM_MARGIN_SECONDS, self._finish, args=(run,))
+        self.timer.daemon = True
+        self.rpi.wave_send_once(self.wave_id)
+        self.timer.start()
+
+    def _edge(self, run):
+        """
+        Called from the pigpio callback thread on each falling edge of the driven pin
+
+        Args:
+            run (int): The ID of the run the callback was registered for
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if run != self.run_id:
+                return
+            self.edges_left -= 1
+            last = self.edges_left == 0
+        if last:
+            self._finish(run)
+
+    def _finish(self, run=None):
+        """
+        Ends the run in progress: switches the motor off, releases the waveform and
+        calls the completion callback.
+
+        Args:
+            run (int): The ID of the run to end, ignored if another run has started
+                since. None for the run in progress.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if not self.busy or (run is not None and run != self.run_id):
+                return
+            on_done = self.on_done
+            if self.edge_callback is not None:
+                self.edge_callback.cancel()
+                self.edge_callback = None
+            if self.wave_id is not None:
+                if self.rpi.wave_tx_busy():
+                    self.rpi.wave_tx_stop()
+                self.rpi.wave_delete(self.wave_id)
+                self.wave_id = None
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.setup()
+            self.busy = False
+            self.on_done = None
+        if on_done is not None:
+            on_done()
+
+    def stop(self):
+        """
+        Stops a run started with run() early. The completion callback is still called.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self._finish()
+
     def setup(self):
         """
         Sets both enable signals (EN1 and EN2) to low
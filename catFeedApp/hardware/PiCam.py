@@ -1,24 +1,180 @@
-from picamera2 import Picamera2
+from picamera2 import Picamera2, MappedArray
+from libcamera import Transform
+import threading
+import numpy as np
+import cv2
+
+from hardware.frameSources import SOURCE_LUMA, SOURCE_YUV420, SOURCE_BGR
 
 VALID_RESOLUTIONS = [(640, 480), (1280, 720), (1920, 1080)]
+# Rotations that have to be applied in software because the sensor can only flip.
+# 180 degrees is the same as a horizontal plus vertical flip and is done by the sensor.
+SOFTWARE_ROTATIONS = {
+    90: cv2.ROTATE_90_CLOCKWISE,
+    270: cv2.ROTATE_90_COUNTERCLOCKWISE
+}
 
 class Camera:
     """
     Class wrapping a Picamera2 object
     """
-    def __init__(self, resolution=(640, 480)):
+    def __init__(self, resolution=(640, 480), hflip=False, vflip=False, rotation=0, format="YUV420", lores_resolution=None, idle_grace=30):
         """
         Initialize the camera object basic properties
         
         Args:
             resolution: The resolution of the camera in pixels (width, height)
+            hflip: Mirror the image horizontally
+            vflip: Flip the image vertically
+            rotation: Clockwise rotation of the image in degrees (0, 90, 180 or 270)
+            format: The Picamera2 pixel format to capture in. With "YUV420" the
+                grayscale Y plane is available as a view without any conversion
+            lores_resolution: The resolution of the low resolution "lores" stream used
+                for live viewing, or None to configure only the main stream. The lores
+                stream is always YUV420 and is clamped to the main resolution
+            idle_grace: Seconds the camera keeps running after its last consumer
+                releases it, so quick reconnects do not pay the restart cost
             
         Returns:
             None
         """
+        if rotation % 90 != 0:
+            raise ValueError("Camera rotation must be a multiple of 90 degrees")
         self.res = resolution
+        self.default_res = tuple(resolution)
+        self.hflip = hflip
+        self.vflip = vflip
+        self.rotation = rotation % 360
+        self.format = format
+        self.lores_res = lores_resolution
+        self.idle_grace = idle_grace
         self.camera = None
         self.initialized = False
+        self.running = False
+        self.consumers = 0
+        self._lifecycle_lock = threading.Lock()
+        self._stop_timer = None
+        self._rotate_code = None
+        # Prebuilt configurations by main resolution
+        self._configs = {}
+        # Captures in progress, and whether a reconfiguration is waiting for them to finish
+        self._capture_cv = threading.Condition()
+        self._capturing = 0
+        self._reconfiguring = False
+    
+    def _sensor_transform(self):
+        """
+        Builds the libcamera transform applied by the sensor, and selects the
+        software rotation needed for anything the sensor cannot do
+        
+        Args:
+            None
+            
+        Returns:
+            libcamera.Transform: The transform to configure the camera with
+        """
+        hflip = bool(self.hflip)
+        vflip = bool(self.vflip)
+        if self.rotation == 180:
+            # A 180 degree rotation is a horizontal and a vertical flip
+            hflip = not hflip
+            vflip = not vflip
+        self._rotate_code = SOFTWARE_ROTATIONS.get(self.rotation)
+        return Transform(hflip=int(hflip), vflip=int(vflip))
+    
+    def _fill(self, frame, out):
+        """
+        Copies a frame into out if out has the same shape and type, otherwise
+        into a newly allocated array
+        
+        Args:
+            frame: The frame to copy, usually a view of mapped camera memory
+            out: The array to reuse, or None
+            
+        Returns:
+            The copy of the frame
+        """
+        if out is not None and out.shape == frame.shape and out.dtype == frame.dtype:
+            np.copyto(out, frame)
+            return out
+        return frame.copy()
+    
+    def _reusable(self, out, shape):
+        """
+        Returns out if it can be passed as the dst of an OpenCV call producing
+        an 8-bit frame of the given shape, otherwise None
+        
+        Args:
+            out: The array to reuse, or None
+            shape: The shape of the output frame
+            
+        Returns:
+            out or None
+        """
+        if out is not None and out.shape == shape and out.dtype == np.uint8:
+            return out
+        return None
+    
+    def _create_config(self, resolution):
+        """
+        Builds a Picamera2 configuration for the given main resolution, with the
+        lores stream if one is configured
+        
+        Args:
+            resolution: The main stream resolution in pixels (width, height)
+            
+        Returns:
+            dict: The Picamera2 camera configuration
+        """
+        lores = None
+        if self.lores_res is not None:
+            # The lores stream cannot be larger than the main stream
+            lores = {"size": (min(self.lores_res[0], resolution[0]), min(self.lores_res[1], resolution[1])), "format": "YUV420"}
+        # Flips (and 180 degree rotations) are applied by the sensor at no per-frame cost
+        return self.camera.create_preview_configuration(main={"size": resolution, "format": self.format}, lores=lores, transform=self._sensor_transform())
+    
+    def allowed_resolutions(self):
+        """
+        Returns the main resolutions the camera can be switched to at runtime
+        
+        Args:
+            None
+            
+        Returns:
+            list: VALID_RESOLUTIONS plus the resolution given to the constructor, as (width, height) tuples
+        """
+        resolutions = [tuple(resolution) for resolution in VALID_RESOLUTIONS]
+        if self.default_res not in resolutions:
+            resolutions.append(self.default_res)
+        return resolutions
+    
+    def _config_for(self, resolution):
+        """
+        Returns the cached configuration for a main resolution, building it on first use
+        
+        Args:
+            resolution: The main stream resolution in pixels (width, height)
+            
+        Returns:
+            dict: The Picamera2 camera configuration
+        """
+        config = self._configs.get(tuple(resolution))
+        if config is None:
+            config = self._create_config(tuple(resolution))
+            self._configs[tuple(resolution)] = config
+        return config
+    
+    def stream_size(self, stream="main"):
+        """
+        Returns the size of a configured stream
+        
+        Args:
+            stream: "main" or "lores"
+            
+        Returns:
+            tuple: The (width, height) of the stream
+        """
+        return self.cam_config[stream]["size"]
     
     def initialize(self):
         """
@@ -35,10 +191,15 @@ class Camera:
             if self.camera:
                 self.camera.stop()
                 self.camera.close()
+                self.running = False
             self.camera = Picamera2()
-            self.cam_config = self.camera.create_preview_configuration(main={"size": self.res})
+            # Build every allowed configuration up front, so switching resolution
+            # at runtime only has to apply one
+            self._configs = {}
+            for resolution in self.allowed_resolutions():
+                self._config_for(resolution)
+            self.cam_config = self._config_for(self.res)
             self.camera.configure(self.cam_config)
-            # self.camera.set_preview_transform(picamera2.PreviewTransform(hflip=True, vflip=True, rotation=picamera2.Transform.Rotation.ROTATION_90))
             self.initialized = True
             return True
         except Exception as e:
@@ -54,7 +215,151 @@ class Camera:
         Returns:
             None
         """
-        self.camera.start()
+        with self._lifecycle_lock:
+            self._start()
+    
+    def _start(self):
+        # Must be called with the lifecycle lock held. The configuration built in
+        # initialize() is kept while stopped, so restarting does not rebuild it
+        if not self.running:
+            self.camera.start()
+            self.running = True
+    
+    def _stop(self):
+        # Must be called with the lifecycle lock held
+        if self.running:
+            self.camera.stop()
+            self.running = False
+    
+    def acquire(self):
+        """
+        Registers a consumer of camera frames, starting capture if the camera is stopped
+        
+        Every call must be matched by a call to release().
+        
+        Args:
+            None
+            
+        Returns:
+            None
+        """
+        with self._lifecycle_lock:
+            self.consumers += 1
+            if self._stop_timer is not None:
+                self._stop_timer.cancel()
+                self._stop_timer = None
+            self._start()
+    
+    def release(self):
+        """
+        Unregisters a consumer of camera frames. Once no consumers remain the
+        camera is stopped after the idle grace period
+        
+        Args:
+            None
+            
+        Returns:
+            None
+        """
+        with self._lifecycle_lock:
+            self.consumers = max(0, self.consumers - 1)
+            if self.consumers > 0 or not self.running:
+                return
+            if self._stop_timer is not None:
+                self._stop_timer.cancel()
+            self._stop_timer = threading.Timer(self.idle_grace, self._idle_stop)
+            self._stop_timer.daemon = True
+            self._stop_timer.start()
+    
+    def _idle_stop(self):
+        """
+        Timer callback stopping the camera if it is still unused
+        
+        Args:
+            None
+            
+        Returns:
+            None
+        """
+        with self._lifecycle_lock:
+            if self.consumers == 0 and self._stop_timer is threading.current_thread():
+                print("Stopping idle camera")
+                self._stop()
+                self._stop_timer = None
+        
+    def capture(self, source=SOURCE_BGR, stream="main", out=None):
+        """
+        Captures a frame from a stream in the requested layout, correctly oriented
+        
+        The frame is read straight from the camera's mapped buffer. When the stream
+        is YUV420, the luma source copies only the Y plane and the yuv420 source
+        copies the raw frame, so neither needs a color conversion. Rotations the
+        sensor cannot do are applied while copying out of the mapped buffer.
+        
+        Args:
+            source: One of SOURCE_LUMA, SOURCE_YUV420 or SOURCE_BGR
+            stream: "main" for full resolution, or "lores" for the low resolution
+                preview stream. Falls back to main if no lores stream is configured
+            out: The array returned by a previous call with the same source and
+                stream. If its shape still matches, the frame is written into it
+                and it is returned, so steady-state capture allocates no frame memory
+            
+        Returns:
+            The captured frame
+        """
+        with self._capture_cv:
+            # Captures wait while a reconfiguration is being applied
+            self._capture_cv.wait_for(lambda: not self._reconfiguring)
+            self._capturing += 1
+        try:
+            return self._capture(source, stream, out)
+        finally:
+            with self._capture_cv:
+                self._capturing -= 1
+                self._capture_cv.notify_all()
+    
+    def _capture(self, source, stream, out):
+        # Must be called between the capture bookkeeping in capture()
+        if stream == "lores" and self.cam_config.get("lores") is None:
+            stream = "main"
+        width, height = self.stream_size(stream)
+        yuv = self.cam_config[stream]["format"] == "YUV420"
+        rotate = self._rotate_code
+        # Output shapes are transposed by 90/270 degree rotations
+        out_width, out_height = (height, width) if rotate is not None else (width, height)
+        request = self.camera.capture_request()
+        try:
+            with MappedArray(request, stream) as mapped:
+                array = mapped.array
+                if yuv and source == SOURCE_LUMA:
+                    # The Y plane is the first `height` rows of the planar frame
+                    luma = array[:height, :width]
+                    if rotate is None:
+                        return self._fill(luma, out)
+                    return cv2.rotate(luma, rotate, dst=self._reusable(out, (out_height, out_width)))
+                if yuv and source == SOURCE_YUV420 and rotate is None and array.shape[1] == width:
+                    return self._fill(array, out)
+                # The remaining combinations need a color conversion
+                if yuv:
+                    if array.shape[1] != width:
+                        # Padded rows: let Picamera2 unpack the planes
+                        array = request.make_array(stream)
+                    if source == SOURCE_BGR and rotate is None:
+                        return cv2.cvtColor(array, cv2.COLOR_YUV2BGR_I420, dst=self._reusable(out, (height, width, 3)))
+                    frame = cv2.cvtColor(array, cv2.COLOR_YUV2BGR_I420)
+                else:
+                    frame = array[:height, :width]
+                if rotate is not None:
+                    frame = cv2.rotate(frame, rotate)
+                if source == SOURCE_LUMA:
+                    code = cv2.COLOR_BGR2GRAY if frame.shape[2] == 3 else cv2.COLOR_BGRA2GRAY
+                    return cv2.cvtColor(frame, code, dst=self._reusable(out, (out_height, out_width)))
+                if source == SOURCE_YUV420:
+                    code = cv2.COLOR_BGR2YUV_I420 if frame.shape[2] == 3 else cv2.COLOR_BGRA2YUV_I420
+                    return cv2.cvtColor(frame, code, dst=self._reusable(out, (out_height * 3 // 2, out_width)))
+                return self._fill(frame, out)
+        finally:
+            request.release()
         
     def cleanup(self):
         """
@@ -66,27 +371,53 @@ class Camera:
         Returns:
             None
         """
-        if self.camera:
-            self.camera.stop()
-            self.camera.close()
+        with self._lifecycle_lock:
+            if self._stop_timer is not None:
+                self._stop_timer.cancel()
+                self._stop_timer = None
+            if self.camera:
+                self._stop()
+                self.camera.close()
             
         self.initialized = False
         
     def setResolution(self, resolution):
         """
-        Sets the resolution of the camera
+        Sets the resolution of the camera, while it is running
+        
+        The prebuilt configuration for the resolution is applied between frames:
+        new captures wait, the captures in progress finish, and the camera is
+        switched to the new configuration without being closed, so consumers
+        keep running and simply receive frames of the new size. Not possible
+        while a hardware encoder is attached to the camera.
         
         Args:
             resolution: The resolution of the camera in pixels (width, height)
             
         Returns:
-            True if the resolution is valid, False otherwise
+            True if the resolution was applied, False if it is not allowed or an encoder is running
         """
+        resolution = tuple(resolution)
         # Verify that the resolution is valid
-        if resolution in self.VALID_RESOLUTIONS:
-            self.res = resolution
-            self.cam_config = self.camera.create_preview_configuration(main={"size": resolution})
-            self.camera.configure(self.cam_config)
-            return True
-        else:
+        if resolution not in self.allowed_resolutions():
             return False
+        config = self._config_for(resolution)
+        with self._lifecycle_lock:
+            if getattr(self.camera, "encoders", None):
+                return False
+            with self._capture_cv:
+                self._reconfiguring = True
+                self._capture_cv.wait_for(lambda: self._capturing == 0)
+            try:
+                if self.running:
+                    self.camera.switch_mode(config)
+                else:
+                    self.camera.configure(config)
+                self.res = resolution
+                self.cam_config = config
+            finally:
+                with self._capture_cv:
+                    self._reconfiguring = False
+                    self._capture_cv.notify_all()
+        print("Camera resolution set to: " + str(resolution))
+        return True
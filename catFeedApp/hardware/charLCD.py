@@ -30,6 +30,13 @@ class CharLCD:
         
         self.initialized = False
         
+        self.screen_buffer = [[' ' for i in range(width)] for j in range(height)]
+        # Named screens shown one at a time, in registration order
+        self.panes = {}
+        self.pane_order = []
+        self.pane_index = 0
+        self.lock = threading.Lock()
+        
     def _write_byte(self, data):
         """
         Write a single byte to the PCF8574 via I2C interface
@@ -220,6 +227,61 @@ class CharLCD:
             self.screen_buffer[i] = array[i]
             self._writeRow(i, array[i])
     
+    @staticmethod
+    def _paneRows(array):
+        # Pane rows may be strings or lists of characters
+        return [row if isinstance(row, str) else ''.join(row) for row in array]
+    
+    def registerPane(self, name, array):
+        """
+        Adds a named pane to the panes cycled through by iteratePanes()
+        
+        Args:
+            name (str): The name of the pane
+            array (list): The rows of the pane, strings or lists of characters
+            
+        Returns:
+            None
+        """
+        with self.lock:
+            if name not in self.panes:
+                self.pane_order.append(name)
+            self.panes[name] = self._paneRows(array)
+    
+    def updatePane(self, name, array):
+        """
+        Replaces the contents of a pane, redrawing the screen if the pane is shown
+        
+        Args:
+            name (str): The name of the pane
+            array (list): The rows of the pane, strings or lists of characters
+            
+        Returns:
+            None
+        """
+        with self.lock:
+            if name not in self.panes:
+                self.pane_order.append(name)
+            self.panes[name] = self._paneRows(array)
+            if self.initialized and self.pane_order[self.pane_index] == name:
+                self._writeScreen(self.panes[name])
+    
+    def iteratePanes(self):
+        """
+        Shows the next pane
+        
+        Args:
+            None
+            
+        Returns:
+            None
+        """
+        with self.lock:
+            if not self.pane_order or not self.initialized:
+                return
+            self.pane_index = (self.pane_index + 1) % len(self.pane_order)
+            self._writeScreen(self.panes[self.pane_order[self.pane_index]])
+    
     def initialize(self):
         """
         Initializes the character LCD display by sending initialization commands
@@ -17,9 +17,12 @@ class DistanceSensor:
         self.trig_pin = trig_pin
         self.echo_pin = echo_pin
         self.initialized = False
+        self.high = None
         self.low = 0
+        # Only one ping may be in flight, or the echoes of overlapping pings mix up high and low
+        self.ping_lock = threading.Lock()
 
-    def _rise(self, tick):
+    def _rise(self, gpio, level, tick):
         """
         Callback function for the pigpio library, called when the echo pin rises
 
@@ -33,7 +36,7 @@ class DistanceSensor:
         """
         self.high = tick
 
-    def _fall(self, tick):
+    def _fall(self, gpio, level, tick):
         """
         Callback function for the pigpio library, called when the echo pin falls
 
@@ -45,23 +48,39 @@ class DistanceSensor:
         Returns:
             None
         """
-        self.low = tick - self.high
+        if self.high is None:
+            # A stray edge, or the echo of a ping that already timed out
+            return
+        self.low = pigpio.tickDiff(self.high, tick)
+        self.high = None
         self.done.set()
 
     def _read_distance_mm(self):
+        """
+        Trigger a single measurement of the distance sensor and return the distance in mm, see ping_mm()
+
+        Returns:
+            float: The measured distance in mm, or -1 if a timeout occurred
+        """
+        return self.ping_mm()
+
+    def ping_mm(self):
         """
         Trigger a single measurement of the distance sensor and return the distance in mm
 
-        This function blocks until the measurement is complete or a timeout occurs
+        This function blocks until the measurement is complete or a timeout occurs.
+        Concurrent calls are serialized.
 
         Returns:
             float: The measured distance in mm, or -1 if a timeout occurred
         """
-        self.done.clear()
-        self.pi.gpio_trigger(self.trig_pin, 50, 1)
-        if self.done.wait(timeout=5):
-            return self.low / 58.0 / 100.0 * self.METERS_TO_MM
-        return -1
+        with self.ping_lock:
+            self.high = None
+            self.done.clear()
+            self.pi.gpio_trigger(self.trig_pin, 50, 1)
+            if self.done.wait(timeout=self.PING_TIMEOUT_SECONDS):
+                return self.low / 58.0 / 100.0 * self.METERS_TO_MM
+            return -1
     
     def setFull_mm(self, mm):
         """
@@ -122,7 +141,19 @@ class DistanceSensor:
             float: The average distance reading as a percentage.
         """
 
-        percent = (self.MAX_DISTANCE -self.getReading_mm(samples)) / self.MAX_DISTANCE * 100
+        return self.to_percent(self.getReading_mm(samples))
+
+    def to_percent(self, mm):
+        """
+        Converts a distance reading in mm to the fill level in percent.
+
+        Args:
+            mm (float): The distance reading in mm.
+
+        Returns:
+            float: The fill level, rounded and clamped to 0-100.
+        """
+        percent = (self.MAX_DISTANCE - mm) / self.MAX_DISTANCE * 100
         if percent > 100:
             percent = 100
         elif percent < 0:
@@ -170,5 +201,6 @@ class DistanceSensor:
     R_DELAY = 0.01
     CAL_MEASUREMENTS = 3
     CAL_MEASUREMENT_TIMEOUT_SECONDS = 1
+    PING_TIMEOUT_SECONDS = 0.1
 
 
@@ -0,0 +1,7 @@
+"""
+Frame sources that can be requested from Camera.capture(). Kept apart from
+PiCam so frame processing code can use them without picamera2.
+"""
+SOURCE_LUMA = "luma"        # Single channel 8-bit grayscale (the Y plane)
+SOURCE_YUV420 = "yuv420"    # Planar I420 frame, (height * 3/2, width)
+SOURCE_BGR = "bgr"          # 3 or 4 channel color frame in OpenCV channel order
@@ -0,0 +1,88 @@
+"""
+Unit tests of the food consumption model, fitted to synthetic level readings.
+
+Usage:
+    python3 -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+import numpy as np
+
+# Add the parent directory to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.consumptionModel import ConsumptionModel, daily_feed_counts
+
+# The true rates of the synthetic hopper
+DRAIN = 2.0
+GRAMS = {1: 10.0, 2: 18.0}
+
+def simulate(model, hours, seed=1, start_mm=20.0):
+    """
+    Feeds the model hourly readings of a hopper draining at the true rates.
+    """
+    rng = np.random.default_rng(seed)
+    now, mm = 0.0, start_mm
+    model.record_level({'time': now, 'mm': mm})
+    for _ in range(hours):
+        grams = DRAIN
+        for size in (1, 2):
+            for _ in range(rng.integers(0, 3)):
+                model.record_feed(size)
+                grams += GRAMS[size]
+        now += 3600
+        mm += grams / model.grams_per_mm
+        model.record_level({'time': now, 'mm': mm})
+    return now, mm
+
+class ConsumptionModelTest(unittest.TestCase):
+    def test_converges(self):
+        model = ConsumptionModel(grams_per_mm=1.0, empty_mm=5000.0, forgetting=1.0)
+        simulate(model, 50)
+        self.assertEqual(model.updates, 50)
+        np.testing.assert_allclose(model.theta[:3], [DRAIN, GRAMS[1], GRAMS[2]], atol=0.01)
+
+    def test_forecast(self):
+        model = ConsumptionModel(grams_per_mm=1.0, empty_mm=5000.0, forgetting=1.0)
+        now, mm = simulate(model, 50)
+        result = model.forecast(np.array([2.0, 1.0, 0.0, 0.0, 0.0]))
+        per_day = DRAIN * 24 + 2 * GRAMS[1] + GRAMS[2]
+        self.assertEqual(set(result['grams_per_feed']), {1, 2})
+        self.assertAlmostEqual(result['grams_per_day'], per_day, delta=0.5)
+        self.assertAlmostEqual(result['remaining_grams'], 5000.0 - mm, delta=0.1)
+        self.assertAlmostEqual(result['hours_to_empty'], (5000.0 - mm) / per_day * 24, delta=0.5)
+        self.assertAlmostEqual(result['empty_at'], now + result['hours_to_empty'] * 3600, delta=200)
+
+    def test_no_forecast_before_an_update(self):
+        model = ConsumptionModel(grams_per_mm=1.0, empty_mm=500.0)
+        model.record_level({'time': 0.0, 'mm': 100.0})
+        result = model.forecast(np.zeros(5))
+        self.assertIsNone(result['drain_grams_per_hour'])
+        self.assertIsNone(result['hours_to_empty'])
+
+    def test_refill_restarts_the_interval(self):
+        model = ConsumptionModel(grams_per_mm=1.0, empty_mm=500.0, refill_grams=50)
+        model.record_level({'time': 0.0, 'mm': 300.0})
+        model.record_feed(1)
+        model.record_level({'time': 3600.0, 'mm': 100.0})
+        self.assertEqual(model.refills, 1)
+        self.assertEqual(model.updates, 0)
+        self.assertEqual(model.feeds.sum(), 0)
+
+    def test_short_intervals_are_not_fitted(self):
+        model = ConsumptionModel(grams_per_mm=1.0, empty_mm=500.0, update_seconds=300)
+        model.record_level({'time': 0.0, 'mm': 100.0})
+        model.record_level({'time': 100.0, 'mm': 101.0})
+        self.assertEqual(model.updates, 0)
+
+    def test_daily_feed_counts(self):
+        feed_times = [SimpleNamespace(size=1, type=0), SimpleNamespace(size=1, type=0),
+                      SimpleNamespace(size=9, type=0), SimpleNamespace(size=2, type=1)]
+        np.testing.assert_array_equal(daily_feed_counts(feed_times, 5), [2, 0, 0, 0, 1])
+        np.testing.assert_array_equal(daily_feed_counts([], 5), np.zeros(5))
+
+if __name__ == '__main__':
+    unittest.main()
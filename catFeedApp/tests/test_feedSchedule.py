@@ -0,0 +1,77 @@
+"""
+Unit tests of the feed scheduler's index and fired-feed ledger, on an in-memory database.
+
+Usage:
+    python3 -m unittest discover -s tests
+"""
+import datetime
+import os
+import sys
+import unittest
+
+# Add the parent directory to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+from app import db
+from app.models import FeedTime, Feeding, FiredFeed
+from app.feedSchedule import FeedScheduler
+
+def create_test_app():
+    flask_app = Flask(__name__)
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(flask_app)
+    with flask_app.app_context():
+        db.create_all()
+    return flask_app
+
+class FeedSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        self.fed = []
+        self.scheduler = FeedScheduler(self.app, lambda size, reason: self.fed.append((size, reason)), catch_up=300)
+        with self.app.app_context():
+            db.session.add(FeedTime(time="08:00", size=2, type=0))
+            db.session.add(FeedTime(time="18:30", size=1, type=1))
+            db.session.commit()
+
+    def build(self, start, end):
+        return self.scheduler._build_index(start, end)
+
+    def test_index_is_sorted_and_windowed(self):
+        start = datetime.datetime(2026, 1, 1, 12, 0)
+        index = self.build(start, start + datetime.timedelta(days=1))
+        self.assertEqual([o.slot for o in index], ["2026-01-01 18:30", "2026-01-02 08:00"])
+
+    def test_fires_once(self):
+        start = datetime.datetime(2026, 1, 1, 7, 0)
+        occurrence = self.build(start, start + datetime.timedelta(hours=2))[0]
+        now = occurrence.when + datetime.timedelta(seconds=5)
+        self.scheduler._fire(occurrence, now)
+        # A second attempt, e.g. after a restart, hits the ledger's unique key
+        self.scheduler._fire(occurrence, now)
+        self.assertEqual(self.fed, [(2, "scheduled")])
+        with self.app.app_context():
+            self.assertEqual(FiredFeed.query.count(), 1)
+            self.assertEqual(Feeding.query.count(), 1)
+        # Fired occurrences are left out of the index
+        self.assertEqual(self.build(start, start + datetime.timedelta(hours=2)), [])
+
+    def test_late_occurrence_is_recorded_as_missed(self):
+        start = datetime.datetime(2026, 1, 1, 7, 0)
+        occurrence = self.build(start, start + datetime.timedelta(hours=2))[0]
+        self.scheduler._fire(occurrence, occurrence.when + datetime.timedelta(seconds=301))
+        self.assertEqual(self.fed, [])
+        with self.app.app_context():
+            self.assertTrue(FiredFeed.query.one().missed)
+            self.assertEqual(Feeding.query.count(), 0)
+
+    def test_one_time_feed_is_removed_once_fired(self):
+        start = datetime.datetime(2026, 1, 1, 18, 0)
+        occurrence = self.build(start, start + datetime.timedelta(hours=1))[0]
+        self.scheduler._fire(occurrence, occurrence.when)
+        with self.app.app_context():
+            self.assertEqual([ft.time for ft in FeedTime.query.all()], ["08:00"])
+
+if __name__ == '__main__':
+    unittest.main()
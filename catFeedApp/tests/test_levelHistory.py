@@ -0,0 +1,84 @@
+"""
+Unit tests of the hopper level history and its rollups, on an in-memory database.
+
+Usage:
+    python3 -m unittest discover -s tests
+"""
+import os
+import sys
+import time
+import unittest
+
+# Add the parent directory to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from flask import Flask
+from app import db
+from app.models import LevelSample
+from app.levelHistory import LevelHistory, RAW, ROLLUPS
+
+def create_test_app():
+    flask_app = Flask(__name__)
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(flask_app)
+    with flask_app.app_context():
+        db.create_all()
+    return flask_app
+
+class LevelHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.app = create_test_app()
+        # The start of the current hour, so all readings fall in one hourly bucket
+        now = int(time.time())
+        self.hour = now - now % 3600
+
+    def record(self, history, offset, mm):
+        history.record({'time': self.hour + offset, 'mm': mm})
+
+    def rows(self, resolution):
+        with self.app.app_context():
+            return [(row.bucket, row.minimum, row.average, row.maximum, row.count) for row in
+                    LevelSample.query.filter_by(resolution=resolution).order_by(LevelSample.bucket).all()]
+
+    def test_rollups(self):
+        history = LevelHistory(self.app, flush_seconds=3600)
+        for offset, mm in ((0, 100.0), (10, 200.0), (300, 50.0)):
+            self.record(history, offset, mm)
+        history.flush(final=True)
+        self.assertEqual(len(self.rows(RAW)), 3)
+        self.assertEqual(self.rows(ROLLUPS[0]), [(self.hour, 100.0, 150.0, 200.0, 2),
+                                                 (self.hour + 300, 50.0, 50.0, 50.0, 1)])
+        self.assertEqual(self.rows(ROLLUPS[1]), [(self.hour, 50.0, 350.0 / 3, 200.0, 3)])
+
+    def test_rollups_merge_across_restarts(self):
+        history = LevelHistory(self.app, flush_seconds=3600)
+        self.record(history, 0, 100.0)
+        self.record(history, 10, 200.0)
+        history.flush(final=True)
+        # A new instance, as after a restart, writes to the same buckets
+        history = LevelHistory(self.app, flush_seconds=3600)
+        self.record(history, 20, 30.0)
+        history.flush(final=True)
+        self.assertEqual(self.rows(ROLLUPS[0]), [(self.hour, 30.0, 110.0, 200.0, 3)])
+        self.assertEqual(self.rows(ROLLUPS[1]), [(self.hour, 30.0, 110.0, 200.0, 3)])
+
+    def test_query_includes_buffered_points(self):
+        history = LevelHistory(self.app, flush_seconds=3600)
+        self.record(history, 0, 100.0)
+        history.flush()
+        self.record(history, 10, 200.0)
+        result = history.query(self.hour - 60, self.hour + 60)
+        self.assertEqual(result['resolution'], RAW)
+        self.assertEqual(result['points'], [[self.hour, 100.0, 100.0, 100.0], [self.hour + 10, 200.0, 200.0, 200.0]])
+
+    def test_query_downsamples(self):
+        history = LevelHistory(self.app, flush_seconds=3600, sample_period=2.0)
+        for offset in range(0, 600, 2):
+            self.record(history, offset, float(offset))
+        result = history.query(self.hour, self.hour + 600, max_points=10)
+        self.assertLessEqual(len(result['points']), 10)
+        self.assertEqual(result['resolution'], ROLLUPS[0])
+        self.assertEqual(result['points'][0][1], 0.0)
+
+if __name__ == '__main__':
+    unittest.main()
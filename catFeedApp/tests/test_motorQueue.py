@@ -0,0 +1,111 @@
+"""
+Unit tests of the motor command queue, with a motor that finishes when told to.
+
+Usage:
+    python3 -m unittest discover -s tests
+"""
+import os
+import sys
+import unittest
+
+# Add the parent directory to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.motorQueue import MotorQueue
+
+class FakeMotor:
+    """
+    Records the runs it is given and completes them on finish().
+    """
+    def __init__(self):
+        self.runs = []
+        self.on_done = None
+
+    def run(self, t, on_done=None):
+        if self.on_done is not None:
+            raise RuntimeError("Motor is already running")
+        self.runs.append(t)
+        self.on_done = on_done
+
+    def stop(self):
+        self.finish()
+
+    def finish(self):
+        on_done, self.on_done = self.on_done, None
+        on_done()
+
+class MotorQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.motor = FakeMotor()
+        self.queue = MotorQueue(self.motor, max_depth=2, max_portion=5, seconds_per_size=3)
+
+    def test_runs_one_command_at_a_time(self):
+        first = self.queue.submit(1, "scheduled")
+        second = self.queue.submit(2, "scheduled")
+        self.assertEqual(self.motor.runs, [3])
+        self.assertEqual(first.state, "running")
+        self.assertEqual(second.state, "queued")
+        self.motor.finish()
+        self.assertEqual(first.state, "done")
+        self.assertTrue(first.future.done())
+        self.assertEqual(self.motor.runs, [3, 6])
+        self.motor.finish()
+        self.assertEqual(second.state, "done")
+
+    def test_coalesces_queued_manual_feeds(self):
+        self.queue.submit(1, "manual")
+        waiting = self.queue.submit(2, "manual")
+        merged = self.queue.submit(3, "manual")
+        self.assertIs(merged, waiting)
+        self.assertEqual(waiting.size, 5)
+        self.assertEqual(waiting.merged, 2)
+        self.assertEqual(self.queue.get_stats()['coalesced'], 1)
+
+    def test_coalescing_stops_at_max_portion(self):
+        self.queue.submit(1, "manual")
+        waiting = self.queue.submit(4, "manual")
+        other = self.queue.submit(2, "manual")
+        self.assertIsNot(other, waiting)
+        self.assertEqual(waiting.size, 4)
+        self.assertEqual(other.size, 2)
+
+    def test_scheduled_feeds_are_not_merged(self):
+        self.queue.submit(1, "manual")
+        waiting = self.queue.submit(1, "manual")
+        scheduled = self.queue.submit(1, "scheduled")
+        self.assertIsNot(scheduled, waiting)
+        self.assertEqual(waiting.size, 1)
+
+    def test_rejects_manual_feeds_when_full(self):
+        self.queue.submit(1, "scheduled")
+        self.queue.submit(5, "manual")
+        self.queue.submit(5, "manual")
+        self.assertIsNone(self.queue.submit(5, "manual"))
+        self.assertEqual(self.queue.get_stats()['rejected'], 1)
+        # Scheduled feeds are queued even when the queue is full
+        self.assertIsNotNone(self.queue.submit(1, "scheduled"))
+
+    def test_rejects_invalid_sizes(self):
+        for size in (0, 6, -1, 1.5, "2", True, None):
+            with self.assertRaises(ValueError):
+                self.queue.submit(size, "manual")
+        self.assertEqual(self.motor.runs, [])
+
+    def test_motor_error_fails_the_command(self):
+        self.motor.on_done = lambda: None
+        command = self.queue.submit(1, "scheduled")
+        self.assertEqual(command.state, "failed")
+        self.assertTrue(command.future.done())
+        self.assertEqual(self.queue.get_stats()['failed'], 1)
+
+    def test_stop_fails_queued_commands_and_stops_the_motor(self):
+        running = self.queue.submit(1, "scheduled")
+        queued = self.queue.submit(1, "scheduled")
+        self.queue.stop()
+        self.assertEqual(running.state, "done")
+        self.assertEqual(queued.state, "failed")
+        self.assertIsNone(self.queue.submit(1, "manual"))
+        self.assertEqual(self.motor.runs, [3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+"""
+Unit tests of the HLS segment cache and the fragmented MP4 splitter.
+
+Usage:
+    python3 -m unittest discover -s tests
+"""
+import os
+import struct
+import sys
+import unittest
+
+# Add the parent directory to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.segmentStream import SegmentCache, Fmp4Splitter
+
+def box(box_type, payload=b'', large=False):
+    """
+    Builds an MP4 box, with a 64-bit size if large is True.
+    """
+    if large:
+        return struct.pack('>I4sQ', 1, box_type, 16 + len(payload)) + payload
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+class Fmp4SplitterTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = SegmentCache()
+        self.cache.begin()
+        self.splitter = Fmp4Splitter(self.cache)
+
+    def test_splits_init_and_fragments(self):
+        init = box(b'ftyp', b'isom') + box(b'moov', b'm' * 20)
+        first = box(b'moof', b'a' * 10) + box(b'mdat', b'A' * 100)
+        second = box(b'moof', b'b' * 10) + box(b'mdat', b'B' * 50, large=True)
+        self.splitter.mark(0.0)
+        self.splitter.write(init)
+        self.splitter.mark(2.0)
+        self.splitter.write(first)
+        self.splitter.mark(4.5)
+        self.splitter.write(second + box(b'mfra', b'x' * 8))
+        self.assertEqual(self.cache.get_init(1), init)
+        self.assertEqual(self.cache.get_segment(0), first)
+        self.assertEqual(self.cache.get_segment(1), second)
+        self.assertEqual([duration for _, duration, _ in self.cache.segments], [2.0, 2.5])
+
+    def test_boxes_split_across_writes(self):
+        data = box(b'ftyp') + box(b'moov') + box(b'moof', b'a' * 10) + box(b'mdat', b'A' * 100, large=True)
+        for i in range(0, len(data), 3):
+            self.assertEqual(self.splitter.write(data[i:i + 3]), len(data[i:i + 3]))
+        self.assertEqual(self.cache.get_segment(0), data[16:])
+        self.assertEqual(len(self.splitter.pending), 0)
+
+    def test_invalid_box_size(self):
+        with self.assertRaises(ValueError):
+            self.splitter.write(struct.pack('>I4s', 4, b'moof'))
+
+    def test_stale_epoch_is_dropped(self):
+        self.cache.begin()
+        self.splitter.write(box(b'ftyp') + box(b'moov') + box(b'moof') + box(b'mdat'))
+        self.assertIsNone(self.cache.init)
+        self.assertEqual(len(self.cache.segments), 0)
+
+class SegmentCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        cache = SegmentCache(max_segments=3, max_bytes=25)
+        cache.begin()
+        for i in range(5):
+            cache.add_segment(1, 2.0, bytes(10))
+        # The byte limit keeps two of the three segments allowed
+        self.assertEqual([s[0] for s in cache.segments], [3, 4])
+        self.assertIsNone(cache.get_segment(2))
+        self.assertEqual(cache.get_stats()['bytes'], 20)
+        # The newest segment is kept even if it alone exceeds the limit
+        cache.add_segment(1, 2.0, bytes(100))
+        self.assertEqual([s[0] for s in cache.segments], [5])
+
+    def test_playlist(self):
+        cache = SegmentCache()
+        cache.begin()
+        self.assertIsNone(cache.playlist(2))
+        cache.set_init(1, b'init')
+        cache.add_segment(1, 2.0, b'a')
+        cache.add_segment(1, 2.4, b'b')
+        lines = cache.playlist(2).splitlines()
+        self.assertIn("#EXT-X-TARGETDURATION:3", lines)
+        self.assertIn("#EXT-X-MEDIA-SEQUENCE:0", lines)
+        self.assertIn("#EXT-X-DISCONTINUITY-SEQUENCE:0", lines)
+        self.assertNotIn("#EXT-X-DISCONTINUITY", lines)
+        self.assertEqual(lines[-4:], ["#EXTINF:2.000,", "segment/0.m4s", "#EXTINF:2.400,", "segment/1.m4s"])
+
+    def test_playlist_marks_the_epoch_boundary(self):
+        cache = SegmentCache(max_segments=2)
+        cache.begin()
+        cache.add_segment(1, 2.0, b'a')
+        cache.begin()
+        cache.set_init(2, b'init')
+        self.assertIsNone(cache.get_init(1))
+        cache.add_segment(2, 2.0, b'b')
+        lines = cache.playlist(2).splitlines()
+        self.assertIn("#EXT-X-DISCONTINUITY-SEQUENCE:0", lines)
+        self.assertLess(lines.index("#EXT-X-DISCONTINUITY"), lines.index("segment/1.m4s"))
+        self.assertIn('#EXT-X-MAP:URI="init/2.mp4"', lines)
+        # Once the first segment of the epoch is evicted, the sequence counts the discontinuity
+        cache.add_segment(2, 2.0, b'c')
+        cache.add_segment(2, 2.0, b'd')
+        lines = cache.playlist(2).splitlines()
+        self.assertIn("#EXT-X-DISCONTINUITY-SEQUENCE:1", lines)
+        self.assertNotIn("#EXT-X-DISCONTINUITY", lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+"""
+Compares the JPEG encoder backends on a synthetic frame.
+
+Usage:
+    python3 tools/benchmark_encoders.py [iterations] [quality]
+"""
+import os
+import sys
+import time
+import numpy as np
+
+# Add the parent directory to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from video.frameEncoder import ENCODERS
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+quality = int(sys.argv[2]) if len(sys.argv) > 2 else 80
+
+def synthetic_frame(width, height, channels):
+    """
+    Builds a frame with smooth gradients plus noise, so it compresses roughly
+    like a real camera frame rather than a flat image.
+    """
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis]
+    base = (x * 0.6 + y * 0.4) + rng.normal(0, 12, (height, width))
+    frame = np.clip(base, 0, 255).astype(np.uint8)
+    if channels == 1:
+        return frame
+    return np.ascontiguousarray(np.stack([frame, np.roll(frame, 7, axis=1), np.roll(frame, 13, axis=0)], axis=2))
+
+frames = {
+    "540x540 gray": synthetic_frame(540, 540, 1),
+    "540x540 bgr": synthetic_frame(540, 540, 3),
+    "1080x1080 gray": synthetic_frame(1080, 1080, 1),
+    "1080x1080 bgr": synthetic_frame(1080, 1080, 3)
+}
+
+print(f"{iterations} iterations, quality {quality}")
+print(f"{'backend':<12}{'frame':<18}{'ms/frame':>10}{'fps':>10}{'KiB':>10}")
+for name, encoder_class in ENCODERS.items():
+    if encoder_class.hardware:
+        print(f"{name:<12}skipped (encodes camera streams, needs the camera)")
+        continue
+    try:
+        encoder = encoder_class(quality)
+    except ImportError as e:
+        print(f"{name:<12}not available: {e}")
+        continue
+    for label, frame in frames.items():
+        # Warm up once so library initialization is not measured
+        encoder.encode(frame)
+        start = time.perf_counter()
+        for i in range(iterations):
+            jpeg = encoder.encode(frame)
+        elapsed = (time.perf_counter() - start) / iterations
+        size = memoryview(jpeg).nbytes / 1024
+        print(f"{name:<12}{label:<18}{elapsed * 1000:>10.2f}{1 / elapsed:>10.1f}{size:>10.1f}")
@@ -0,0 +1,62 @@
+"""
+Measures the throughput gain of running a frame pipeline on the worker pool
+compared with running it serially, on synthetic frames.
+
+Usage:
+    python3 tools/benchmark_pipeline.py [pipeline] [frames] [workers] [depth]
+"""
+import os
+import sys
+import time
+import numpy as np
+
+# Add the parent directory to the system path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from video import framePipeline, parallelPipeline
+from hardware.frameSources import SOURCE_LUMA, SOURCE_YUV420
+
+name = sys.argv[1] if len(sys.argv) > 1 else "enhanced"
+count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+workers = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+depth = int(sys.argv[4]) if len(sys.argv) > 4 else 3
+width, height = 1080, 1080
+
+# Build a few distinct frames in the layout the pipeline consumes
+rng = np.random.default_rng(0)
+source = framePipeline.PIPELINES[name][1]
+if source == SOURCE_LUMA:
+    shape = (height, width)
+elif source == SOURCE_YUV420:
+    shape = (height * 3 // 2, width)
+else:
+    shape = (height, width, 3)
+frames = [rng.integers(0, 256, shape, dtype=np.uint8) for i in range(4)]
+
+pool = parallelPipeline.create_pool(workers)
+
+serial = framePipeline.build_pipeline(name)
+start = time.perf_counter()
+for i in range(count):
+    serial.process(frames[i % len(frames)])
+serial_fps = count / (time.perf_counter() - start)
+
+parallel = parallelPipeline.ParallelPipeline(pool, name, depth)
+# Warm up the workers so pipeline construction is not measured
+parallel.submit(frames[0])
+parallel.release(parallel.collect()[1])
+start = time.perf_counter()
+for i in range(count):
+    parallel.submit(frames[i % len(frames)])
+    if parallel.pending() >= depth:
+        parallel.release(parallel.collect()[1])
+while parallel.pending():
+    parallel.release(parallel.collect()[1])
+parallel_fps = count / (time.perf_counter() - start)
+parallel.close()
+pool.close()
+
+print(f"Pipeline '{name}', {count} frames of {width}x{height}, {workers} workers, depth {depth}")
+print(f"Serial:   {serial_fps:8.2f} fps")
+print(f"Parallel: {parallel_fps:8.2f} fps")
+print(f"Gain:     {parallel_fps / serial_fps:8.2f}x")
@@ -0,0 +1,166 @@
+"""
+JPEG encoder backends for the live video stream.
+
+Software encoders take a processed frame and return the JPEG data as a
+buffer-protocol object (a memoryview or bytes), so the caller can copy it
+straight into the outgoing multipart chunk without an intermediate tobytes()
+copy. The picamera2 hardware MJPEG encoder instead encodes a camera stream
+directly and hands each finished JPEG to a callback.
+"""
+import numpy as np
+import cv2
+
+DEFAULT_QUALITY = 80
+
+class JpegEncoder:
+    """
+    Base class for JPEG encoder backends.
+
+    Attributes:
+        name (str): The name of the backend in ENCODERS.
+        quality (int): The JPEG quality, 1-100.
+        hardware (bool): True if the backend encodes a camera stream directly
+            rather than individual frames.
+    """
+    name = "base"
+    hardware = False
+
+    def __init__(self, quality=DEFAULT_QUALITY):
+        self.quality = int(quality)
+
+    def encode(self, frame, quality=None):
+        """
+        Encodes a frame as JPEG.
+
+        Args:
+            frame (numpy.ndarray): A 2D grayscale or 3/4 channel BGR frame.
+            quality (int): Overrides the encoder quality for this frame.
+
+        Returns:
+            A buffer-protocol object containing the JPEG data.
+        """
+        raise NotImplementedError
+
+class Cv2Encoder(JpegEncoder):
+    """
+    Encodes with cv2.imencode. The encoded array is returned as a memoryview
+    instead of being copied out with tobytes().
+    """
+    name = "cv2"
+
+    def encode(self, frame, quality=None):
+        ok, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality or self.quality])
+        if not ok:
+            raise RuntimeError("cv2.imencode failed")
+        return jpeg.data
+
+class SimpleJpegEncoder(JpegEncoder):
+    """
+    Encodes with simplejpeg (libjpeg-turbo), which encodes directly from the
+    frame's memory for grayscale, BGR and BGRX frames.
+    """
+    name = "simplejpeg"
+
+    def __init__(self, quality=DEFAULT_QUALITY):
+        super().__init__(quality)
+        import simplejpeg
+        self.simplejpeg = simplejpeg
+
+    def encode(self, frame, quality=None):
+        if frame.ndim == 2:
+            # simplejpeg expects an explicit channel axis, which is a free view
+            frame = frame[:, :, np.newaxis]
+            colorspace = 'GRAY'
+        elif frame.shape[2] == 4:
+            colorspace = 'BGRX'
+        else:
+            colorspace = 'BGR'
+        return self.simplejpeg.encode_jpeg(np.ascontiguousarray(frame), quality=quality or self.quality,
+                                           colorspace=colorspace, colorsubsampling='420')
+
+class HardwareMjpegEncoder(JpegEncoder):
+    """
+    Encodes a camera stream with the picamera2 MJPEGEncoder. Frames are not
+    passed through the processing pipeline; each JPEG produced by the encoder
+    is passed to the callback given to start().
+    """
+    name = "mjpeg"
+    hardware = True
+
+    def __init__(self, quality=DEFAULT_QUALITY):
+        super().__init__(quality)
+        self.camera = None
+        self.encoder = None
+
+    def encode(self, frame, quality=None):
+        raise RuntimeError("The hardware MJPEG encoder encodes camera streams, not individual frames")
+
+    def start(self, camera, stream, callback):
+        """
+        Starts encoding a camera stream.
+
+        Args:
+            camera (PiCam.Camera): The camera to encode from.
+            stream (str): The camera stream to encode ("main" or "lores").
+            callback (function): Called with the JPEG data of each frame.
+
+        Returns:
+            None
+        """
+        from picamera2.encoders import MJPEGEncoder, Quality
+        from picamera2.outputs import Output
+
+        class CallbackOutput(Output):
+            def outputframe(self, frame, *args, **kwargs):
+                callback(frame)
+
+        # Map the 1-100 JPEG quality onto the encoder's quality presets
+        presets = [Quality.VERY_LOW, Quality.LOW, Quality.MEDIUM, Quality.HIGH, Quality.VERY_HIGH]
+        preset = presets[min(len(presets) - 1, max(0, (self.quality - 1) // 20))]
+        self.camera = camera
+        self.encoder = MJPEGEncoder()
+        camera.camera.start_encoder(self.encoder, CallbackOutput(), quality=preset, name=stream)
+
+    def stop(self):
+        """
+        Stops the encoder started by start().
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        if self.encoder is not None:
+            self.camera.camera.stop_encoder(self.encoder)
+            self.encoder = None
+
+# Encoder backends, by name
+ENCODERS = {
+    Cv2Encoder.name: Cv2Encoder,
+    SimpleJpegEncoder.name: SimpleJpegEncoder,
+    HardwareMjpegEncoder.name: HardwareMjpegEncoder
+}
+
+def create_encoder(name, quality=DEFAULT_QUALITY):
+    """
+    Creates an encoder backend, falling back to cv2 if the backend cannot be loaded.
+
+    Args:
+        name (str): The name of the backend in ENCODERS.
+        quality (int): The JPEG quality, 1-100.
+
+    Returns:
+        JpegEncoder: The encoder.
+
+    Raises:
+        ValueError: If no backend is registered under the name.
+    """
+    encoder_class = ENCODERS.get(name)
+    if encoder_class is None:
+        raise ValueError(f"Unknown JPEG encoder '{name}'")
+    try:
+        return encoder_class(quality)
+    except ImportError as e:
+        print(f"JPEG encoder '{name}' not available ({e}), using cv2")
+        return Cv2Encoder(quality)
@@ -0,0 +1,291 @@
+"""
+Frame processing pipelines for the live video stream.
+
+A pipeline is an ordered list of stages. Stages build any expensive state
+(CLAHE objects, lookup tables) once when they are constructed, so a pipeline
+is built when a camera mode is selected and then reused for every frame. Each
+stage records how long it takes so the slow stages can be identified.
+
+Every pipeline also declares the frame source it consumes (see frameSources.SOURCE_*),
+so grayscale pipelines can start from the camera's Y plane without any color
+conversion.
+"""
+import time
+import cv2
+import numpy as np
+
+from hardware.frameSources import SOURCE_LUMA, SOURCE_YUV420, SOURCE_BGR
+
+class StageTiming:
+    """
+    Running timing statistics for a single pipeline stage.
+
+    Attributes:
+        calls (int): The number of frames processed by the stage.
+        total (float): The total time spent in the stage in seconds.
+        last (float): The duration of the most recent call in seconds.
+        max (float): The longest call in seconds.
+    """
+    def __init__(self):
+        """
+        Initializes empty timing statistics.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        self.calls = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def record(self, duration):
+        """
+        Records the duration of a single call.
+
+        Args:
+            duration (float): The duration of the call in seconds.
+
+        Returns:
+            None
+        """
+        self.calls += 1
+        self.total += duration
+        self.last = duration
+        if duration > self.max:
+            self.max = duration
+
+    def to_dict(self):
+        """
+        Returns the statistics in milliseconds.
+
+        Args:
+            None
+
+        Returns:
+            dict: The call count and the average, last and maximum durations in ms.
+        """
+        return {
+            'calls': self.calls,
+            'avg_ms': round(self.total / self.calls * 1000, 3) if self.calls else 0.0,
+            'last_ms': round(self.last * 1000, 3),
+            'max_ms': round(self.max * 1000, 3)
+        }
+
+class Stage:
+    """
+    Base class for a single frame processing step.
+
+    Subclasses build their state in __init__ and implement apply(). Each stage
+    keeps its previous output and passes it back to apply() as the destination,
+    so once the frame size is stable a stage writes into the same buffer every
+    frame instead of allocating a new one. The returned frame is therefore only
+    valid until the stage runs again.
+    """
+    name = "stage"
+
+    def __init__(self):
+        self.timing = StageTiming()
+        self.buffer = None
+
+    def apply(self, frame, dst):
+        """
+        Processes a frame.
+
+        Args:
+            frame (numpy.ndarray): The input frame.
+            dst (numpy.ndarray): The stage's previous output, to be reused as the
+                output if it has the right shape and type, or None.
+
+        Returns:
+            numpy.ndarray: The processed frame.
+        """
+        raise NotImplementedError
+
+    def __call__(self, frame):
+        start = time.perf_counter()
+        out = self.apply(frame, self.buffer)
+        self.buffer = out
+        self.timing.record(time.perf_counter() - start)
+        return out
+
+class ColorConvert(Stage):
+    """
+    Converts the color space of a frame with cv2.cvtColor.
+    """
+    name = "color_convert"
+
+    def __init__(self, code):
+        super().__init__()
+        self.code = code
+
+    def apply(self, frame, dst):
+        return cv2.cvtColor(frame, self.code, dst=dst)
+
+class ExtractChannel(Stage):
+    """
+    Selects a single channel of a multi-channel frame (as a view, without copying).
+    """
+    name = "extract_channel"
+
+    def __init__(self, channel):
+        super().__init__()
+        self.channel = channel
+
+    def apply(self, frame, dst):
+        return frame[:, :, self.channel]
+
+class Bilateral(Stage):
+    """
+    Edge preserving smoothing with cv2.bilateralFilter.
+    """
+    name = "bilateral"
+
+    def __init__(self, diameter=5, sigma_color=150, sigma_space=150):
+        super().__init__()
+        self.diameter = diameter
+        self.sigma_color = sigma_color
+        self.sigma_space = sigma_space
+
+    def apply(self, frame, dst):
+        return cv2.bilateralFilter(frame, self.diameter, self.sigma_color, self.sigma_space, dst=dst)
+
+class Clahe(Stage):
+    """
+    Contrast limited adaptive histogram equalization. The CLAHE object is
+    created once and reused for every frame.
+    """
+    name = "clahe"
+
+    def __init__(self, clip_limit=2.0, tile_grid_size=(8, 8)):
+        super().__init__()
+        self.clahe = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+
+    def apply(self, frame, dst):
+        return self.clahe.apply(frame, dst=dst)
+
+class Lut(Stage):
+    """
+    Applies an 8-bit lookup table. The table is computed once from a gamma value
+    unless an explicit table is given.
+    """
+    name = "lut"
+
+    def __init__(self, gamma=1.0, table=None):
+        super().__init__()
+        if table is None:
+            table = np.clip(((np.arange(256) / 255.0) ** (1.0 / gamma)) * 255.0, 0, 255)
+        self.table = np.asarray(table, dtype=np.uint8)
+
+    def apply(self, frame, dst):
+        return cv2.LUT(frame, self.table, dst=dst)
+
+class Resize(Stage):
+    """
+    Resizes a frame to a fixed (width, height).
+    """
+    name = "resize"
+
+    def __init__(self, size, interpolation=cv2.INTER_AREA):
+        super().__init__()
+        self.size = tuple(size)
+        self.interpolation = interpolation
+
+    def apply(self, frame, dst):
+        return cv2.resize(frame, self.size, dst=dst, interpolation=self.interpolation)
+
+class Pipeline:
+    """
+    An ordered list of stages applied to every frame.
+
+    Attributes:
+        name (str): The name the pipeline is registered under.
+        stages (list): The Stage objects, applied in order.
+        source (str): The frame source the first stage expects (frameSources.SOURCE_*).
+    """
+    def __init__(self, name, stages, source=SOURCE_BGR):
+        self.name = name
+        self.stages = list(stages)
+        self.source = source
+
+    def process(self, frame):
+        """
+        Runs a frame through every stage.
+
+        Args:
+            frame (numpy.ndarray): The raw frame.
+
+        Returns:
+            numpy.ndarray: The processed frame.
+        """
+        for stage in self.stages:
+            frame = stage(frame)
+        return frame
+
+    def get_stats(self):
+        """
+        Returns the timing statistics of every stage.
+
+        Args:
+            None
+
+        Returns:
+            dict: The pipeline name and a list of per-stage statistics in ms.
+        """
+        stages = []
+        for stage in self.stages:
+            stats = stage.timing.to_dict()
+            stats['stage'] = stage.name
+            stages.append(stats)
+        return {'pipeline': self.name, 'source': self.source, 'stages': stages}
+
+# Registered pipelines, by name. Each entry is a (factory, source) tuple
+PIPELINES = {}
+# Camera modes cycled through by the toggle button, in order
+CAMERA_MODES = ['gray', 'enhanced', 'color']
+NUM_CAMERA_MODES = len(CAMERA_MODES)
+
+def register_pipeline(name, factory, source=SOURCE_BGR):
+    """
+    Registers a pipeline factory under a name.
+
+    Args:
+        name (str): The name of the pipeline.
+        factory (function): A function returning a list of Stage objects.
+        source (str): The frame source the pipeline consumes (frameSources.SOURCE_*).
+
+    Returns:
+        None
+    """
+    PIPELINES[name] = (factory, source)
+
+def build_pipeline(name):
+    """
+    Builds a new pipeline from its registered factory.
+
+    Args:
+        name (str): The name of the pipeline.
+
+    Returns:
+        Pipeline: The built pipeline.
+
+    Raises:
+        ValueError: If no pipeline is registered under the name.
+    """
+    entry = PIPELINES.get(name)
+    if entry is None:
+        raise ValueError(f"Unknown frame pipeline '{name}'")
+    factory, source = entry
+    return Pipeline(name, factory(), source)
+
+# The grayscale modes work directly on the Y plane, so they need no color conversion
+register_pipeline('gray', lambda: [], source=SOURCE_LUMA)
+register_pipeline('enhanced', lambda: [
+    Bilateral(5, 150, 150),
+    Clahe(clip_limit=2.0, tile_grid_size=(8, 8))
+], source=SOURCE_LUMA)
+register_pipeline('color', lambda: [
+    ColorConvert(cv2.COLOR_YUV2BGR_I420)
+], source=SOURCE_YUV420)
@@ -0,0 +1,301 @@
+"""
+Multi-core frame processing for the heavy pipelines.
+
+Frames are handed to a pool of worker processes through shared memory slots
+instead of being pickled: the producer copies a captured frame into a free
+input slot, a worker runs the pipeline and writes the result into the
+matching output slot, and only the slot names and frame shape cross the
+process boundary. Several frames are kept in flight so capture, processing
+and encoding overlap, and results are collected in submission order.
+"""
+from collections import deque
+from multiprocessing import shared_memory, resource_tracker
+import multiprocessing
+import time
+import numpy as np
+
+from video import framePipeline
+
+# Output slots are sized for a result with up to this many times the input's bytes
+OUTPUT_SLOT_SCALE = 3
+# Maximum number of shared memory blocks a worker keeps attached
+WORKER_ATTACH_CACHE = 32
+
+# Per worker process state
+_worker_pipelines = {}
+_worker_blocks = {}
+
+def create_pool(workers):
+    """
+    Creates the worker process pool.
+
+    The pool is forked, so it should be created at startup before the camera
+    and stream threads exist.
+
+    Args:
+        workers (int): The number of worker processes.
+
+    Returns:
+        multiprocessing.pool.Pool: The pool.
+    """
+    return multiprocessing.get_context('fork').Pool(processes=workers)
+
+def _attach(name):
+    """
+    Attaches to a shared memory block in a worker, caching the attachment.
+
+    Args:
+        name (str): The name of the block.
+
+    Returns:
+        shared_memory.SharedMemory: The block.
+    """
+    block = _worker_blocks.pop(name, None)
+    if block is None:
+        block = shared_memory.SharedMemory(name=name)
+        # The producer owns and unlinks the block; stop the tracker from unlinking it too
+        resource_tracker.unregister(block._name, "shared_memory")
+        if len(_worker_blocks) >= WORKER_ATTACH_CACHE:
+            # Close the least recently used block, it may belong to a closed pipeline
+            oldest = next(iter(_worker_blocks))
+            _worker_blocks.pop(oldest).close()
+    _worker_blocks[name] = block
+    return block
+
+def _process_slot(pipeline_name, in_name, out_name, shape, dtype):
+    """
+    Worker function: runs a pipeline on the frame in an input slot and writes
+    the result into the output slot.
+
+    Args:
+        pipeline_name (str): The registered pipeline to run.
+        in_name (str): The name of the input block.
+        out_name (str): The name of the output block.
+        shape (tuple): The shape of the input frame.
+        dtype (str): The dtype of the input frame.
+
+    Returns:
+        tuple: (shape, dtype, array, duration). array is None when the result was
+        written to the output slot, or the result itself if it did not fit.
+    """
+    start = time.perf_counter()
+    pipeline = _worker_pipelines.get(pipeline_name)
+    if pipeline is None:
+        pipeline = framePipeline.build_pipeline(pipeline_name)
+        _worker_pipelines[pipeline_name] = pipeline
+    frame = np.ndarray(shape, dtype=dtype, buffer=_attach(in_name).buf)
+    result = pipeline.process(frame)
+    out_block = _attach(out_name)
+    if result.nbytes > out_block.size:
+        return result.shape, result.dtype.str, result, time.perf_counter() - start
+    out = np.ndarray(result.shape, dtype=result.dtype, buffer=out_block.buf)
+    np.copyto(out, result)
+    return result.shape, result.dtype.str, None, time.perf_counter() - start
+
+class ParallelPipeline:
+    """
+    A pipeline whose frames are processed by a worker pool.
+
+    Exposes the same name, source and get_stats() as framePipeline.Pipeline,
+    plus submit()/collect()/release() for pipelined use.
+
+    Attributes:
+        name (str): The registered pipeline run by the workers.
+        source (str): The frame source the pipeline consumes.
+        depth (int): The number of frames kept in flight.
+        parallel (bool): Always True, distinguishes it from a serial Pipeline.
+    """
+    parallel = True
+
+    def __init__(self, pool, name, depth=3):
+        """
+        Initializes the pipeline. Shared memory is allocated on the first frame.
+
+        Args:
+            pool (multiprocessing.pool.Pool): The worker pool.
+            name (str): The registered pipeline to run.
+            depth (int): The number of frames kept in flight.
+
+        Returns:
+            None
+        """
+        self.pool = pool
+        self.name = name
+        self.source = framePipeline.PIPELINES[name][1]
+        self.depth = depth
+        self.slots = []
+        self.free = deque()
+        self.in_flight = deque()
+        self.frame_key = None
+        # Throughput statistics
+        self.frames = 0
+        self.worker_time = 0.0
+        self.started = None
+        self.last_output = None
+
+    def _allocate(self, frame):
+        """
+        Allocates one input and output shared memory block per in-flight frame.
+
+        Args:
+            frame (numpy.ndarray): A frame of the size that will be submitted.
+
+        Returns:
+            None
+        """
+        self.close()
+        for i in range(self.depth):
+            in_block = shared_memory.SharedMemory(create=True, size=frame.nbytes)
+            out_block = shared_memory.SharedMemory(create=True, size=frame.nbytes * OUTPUT_SLOT_SCALE)
+            self.slots.append((in_block, out_block))
+            self.free.append(i)
+        self.frame_key = (frame.shape, frame.dtype.str)
+
+    def matches(self, frame):
+        """
+        Returns whether a frame fits the allocated slots, which is required
+        while frames are in flight.
+
+        Args:
+            frame (numpy.ndarray): The frame to submit.
+
+        Returns:
+            bool: True if the frame has the size and type of the allocated slots.
+        """
+        return self.frame_key == (frame.shape, frame.dtype.str)
+
+    def pending(self):
+        """
+        Returns the number of frames in flight.
+
+        Args:
+            None
+
+        Returns:
+            int: The number of submitted frames not yet collected.
+        """
+        return len(self.in_flight)
+
+    def submit(self, frame):
+        """
+        Copies a frame into a free slot and queues it for processing.
+
+        Args:
+            frame (numpy.ndarray): The captured frame.
+
+        Returns:
+            None
+
+        Raises:
+            RuntimeError: If all slots are in flight.
+        """
+        if not self.matches(frame):
+            if self.in_flight:
+                raise RuntimeError("Frame size changed with frames in flight")
+            self._allocate(frame)
+        if not self.free:
+            raise RuntimeError("No free parallel pipeline slot")
+        slot = self.free.popleft()
+        in_block, out_block = self.slots[slot]
+        np.copyto(np.ndarray(frame.shape, dtype=frame.dtype, buffer=in_block.buf), frame)
+        result = self.pool.apply_async(_process_slot, (self.name, in_block.name, out_block.name, frame.shape, frame.dtype.str))
+        self.in_flight.append((slot, result))
+        if self.started is None:
+            self.started = time.perf_counter()
+
+    def collect(self):
+        """
+        Waits for the oldest frame in flight, preserving submission order.
+
+        The returned frame is a view of the slot's shared memory and stays valid
+        until release() is called with the slot.
+
+        Args:
+            None
+
+        Returns:
+            tuple: (frame, slot)
+        """
+        slot, result = self.in_flight.popleft()
+        try:
+            shape, dtype, array, duration = result.get()
+        except Exception:
+            self.free.append(slot)
+            raise
+        self.frames += 1
+        self.worker_time += duration
+        self.last_output = time.perf_counter()
+        if array is not None:
+            return array, slot
+        return np.ndarray(shape, dtype=dtype, buffer=self.slots[slot][1].buf), slot
+
+    def release(self, slot):
+        """
+        Returns a collected slot to the free list.
+
+        Args:
+            slot (int): The slot returned by collect().
+
+        Returns:
+            None
+        """
+        self.free.append(slot)
+
+    def discard(self):
+        """
+        Waits for and drops all frames in flight, then frees the shared memory.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        while self.in_flight:
+            try:
+                self.release(self.collect()[1])
+            except Exception as e:
+                print("Parallel pipeline error: " + str(e))
+        self.close()
+
+    def close(self):
+        """
+        Frees the shared memory blocks. They are allocated again on the next submit().
+        The throughput statistics are kept.
+
+        Args:
+            None
+
+        Returns:
+            None
+        """
+        for in_block, out_block in self.slots:
+            for block in (in_block, out_block):
+                block.close()
+                block.unlink()
+        self.slots = []
+        self.free.clear()
+        self.frame_key = None
+
+    def get_stats(self):
+        """
+        Returns the measured throughput compared with processing serially.
+
+        The serial rate is what a single core achieves given the measured
+        per-frame worker time; the gain is the achieved rate divided by it.
+
+        Args:
+            None
+
+        Returns:
+            dict: The pipeline name, depth, and frame rates.
+        """
+        stats = {'pipeline': self.name, 'source': self.source, 'parallel': True,
+                 'depth': self.depth, 'frames': self.frames}
+        if self.frames > 1 and self.last_output is not None and self.worker_time > 0:
+            achieved = self.frames / (self.last_output - self.started)
+            serial = self.frames / self.worker_time
+            stats['achieved_fps'] = round(achieved, 2)
+            stats['serial_fps'] = round(serial, 2)
+            stats['throughput_gain'] = round(achieved / serial, 2)
+        return stats